@@ -1,6 +1,7 @@
 """
 Amazon 关键词自然位/広告位追踪到飞书电子表格。
-在 agent 目录下运行：python run_amazon_keyword.py [--sheet KW追踪] [--dry-run]
+在 agent 目录下运行：python run_amazon_keyword.py [--sheet KW追踪] [--dry-run] [--concurrency 4] [--rpm 20]
+离线重新解析缓存：python run_amazon_keyword.py --reparse [2026-03-13]
 """
 import argparse
 import sys
@@ -8,26 +9,52 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-from src.features.ecommerce.amazon.keyword_tracker import run_keyword_tracking
+from src.features.ecommerce.amazon.keyword_tracker import (
+    close_session_pool,
+    rebuild_keyword_logs_from_cache,
+    run_keyword_tracking,
+)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Amazon 关键词位置追踪到飞书 Sheet")
     parser.add_argument("--sheet", type=str, help="飞书 Sheet 名称，默认 FEISHU_KEYWORD_SHEET_NAME 或 KW追踪")
     parser.add_argument("--dry-run", action="store_true", help="只抓取解析，不写入飞书")
+    parser.add_argument("--concurrency", type=int, help="并发 worker 数，默认 AMZ_KEYWORD_CONCURRENCY 或 1（串行）")
+    parser.add_argument("--rpm", type=float, help="amazon.co.jp 每分钟请求预算，默认 AMZ_RPM 或 20")
+    parser.add_argument("--adaptive", action="store_true", help="按历史排名自适应决定翻页深度（默认 AMZ_KEYWORD_ADAPTIVE）")
+    parser.add_argument(
+        "--reparse", nargs="?", const="", metavar="YYYY-MM-DD",
+        help="不访问网络，用本地 HTML 缓存重建指定日期（默认今天）的排名记录",
+    )
     args = parser.parse_args()
 
-    result = run_keyword_tracking(sheet_title=args.sheet, dry_run=args.dry_run)
+    if args.reparse is not None:
+        result = rebuild_keyword_logs_from_cache(day=args.reparse or None)
+        args.dry_run = True
+    else:
+        result = run_keyword_tracking(
+            sheet_title=args.sheet,
+            dry_run=args.dry_run,
+            concurrency=args.concurrency,
+            rpm=args.rpm,
+            adaptive=args.adaptive or None,
+        )
     if result["success"]:
         print(f"✅ {result['message']}")
         if args.dry_run and result.get("results"):
             print("\n--- Dry-run 结果 ---")
             for r in result["results"]:
                 print(f"  Row {r['row']}: {r['asin']} | {r['keyword']} | {r['type']} → {r['position']}")
+        if result.get("fetch_stats"):
+            print(f"抓取统计: {result['fetch_stats']}")
     else:
         print(f"❌ {result['message']}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_session_pool()
@@ -1,6 +1,7 @@
 """
 Amazon 日本站排名同步到飞书电子表格。
-在 agent 目录下运行：python run_amazon_rank.py [--sheet 3月]
+在 agent 目录下运行：python run_amazon_rank.py [--sheet 3月] [--concurrency 4] [--rpm 20] [--resume]
+离线重新解析缓存：python run_amazon_rank.py --reparse [2026-03-13]
 """
 import argparse
 import sys
@@ -8,21 +9,46 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-from src.features.ecommerce.amazon.rank_sync import run_amazon_rank_sync
+from src.features.ecommerce.amazon.rank_sync import (
+    close_session_pool,
+    rebuild_rank_values_from_cache,
+    run_amazon_rank_sync,
+)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Amazon 排名同步到飞书 Sheet")
     parser.add_argument("--sheet", type=str, help="飞书 Sheet 名称，默认用 FEISHU_SHEET_NAME 或当前月份如 3月")
+    parser.add_argument("--concurrency", type=int, help="并发 worker 数，默认 AMZ_RANK_CONCURRENCY 或 1（串行）")
+    parser.add_argument("--rpm", type=float, help="amazon.co.jp 每分钟请求预算，默认 AMZ_RPM 或 20")
+    parser.add_argument("--resume", action="store_true", help="从今天的断点继续：跳过已抓到排名的 ASIN，补写未写回的结果")
+    parser.add_argument(
+        "--reparse", nargs="?", const="", metavar="YYYY-MM-DD",
+        help="不访问网络，用本地 HTML 缓存重新解析指定日期（默认今天）的排名，不写入飞书",
+    )
     args = parser.parse_args()
 
-    result = run_amazon_rank_sync(sheet_title=args.sheet)
+    if args.reparse is not None:
+        result = rebuild_rank_values_from_cache(day=args.reparse or None)
+    else:
+        result = run_amazon_rank_sync(
+            sheet_title=args.sheet, concurrency=args.concurrency, rpm=args.rpm, resume=args.resume
+        )
     if result["success"]:
         print(f"✅ {result['message']}")
+        for r in result.get("results") or []:
+            print(f"  {r['asin']} | 排名: {r['rank'] or r['status']} | 分类: {r['category'] or ''}")
+        if result.get("write_stats"):
+            print(f"写入统计: {result['write_stats']}")
+        if result.get("fetch_stats"):
+            print(f"抓取统计: {result['fetch_stats']}")
     else:
         print(f"❌ {result['message']}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_session_pool()
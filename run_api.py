@@ -15,28 +15,63 @@ import json
 from io import StringIO
 from contextlib import asynccontextmanager
 
+import anyio
 from fastapi import FastAPI, Body, Request
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 from src.features.page_analysis import PageAnalyzer
 from src.core.config_manager import get_env
 from src.features.ecommerce.rakuten.api_client import RakutenApiClient
 from src.features.ecommerce.rakuten.data_analyzer import RakutenDataAnalyzer
+from src.features.feishu.async_client import close_async_lark_client
 from src.features.feishu.bot_client import FeishuBotClient
+from src.features.feishu.write_behind import get_write_behind
 from src.features.feishu.sheet_manager import FeishuSheetManager
-from src.features.ecommerce.amazon.rank_sync import run_amazon_rank_sync
-from src.features.ecommerce.amazon.keyword_tracker import run_keyword_tracking
+from src.features.ecommerce.amazon.rank_sync import close_session_pool as close_rank_sessions, run_amazon_rank_sync
+from src.features.ecommerce.amazon.keyword_tracker import (
+    close_session_pool as close_keyword_sessions,
+    run_keyword_tracking,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # 开启 LARK_WRITE_BEHIND 时启动后台写入队列（上次退出时没写完的内容会先写回）
+    write_behind = get_write_behind()
     yield
-    # 可在此做清理
+    if write_behind is not None:
+        # 退出前把队列里的写入全部写回飞书
+        print(f"[INFO] write-behind stopped: {await run_in_threadpool(write_behind.stop)}")
+    # 关闭 asyncio 飞书客户端的连接池
+    await close_async_lark_client()
+    # 关闭 Amazon 抓取的 Session 池
+    close_rank_sessions()
+    close_keyword_sessions()
 
 
 app = FastAPI(title="个人智能体 API", lifespan=lifespan)
 
+
+async def close_in_threadpool(gen) -> None:
+    """
+    在线程池里关闭同步生成器（触发其 finally：写回飞书等）。
+    客户端断开时 Starlette 会取消响应任务，不加 shield 的 await 会立刻抛 CancelledError，
+    生成器只能等 GC 在事件循环线程上关闭；线程池里的 next() 还没返回时关闭会报
+    "generator already executing"，稍等再试。
+    """
+    with anyio.CancelScope(shield=True):
+        while True:
+            try:
+                await run_in_threadpool(gen.close)
+                return
+            except ValueError as e:
+                if "already executing" not in str(e):
+                    raise
+                await anyio.sleep(0.1)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
@@ -70,7 +105,7 @@ def analyze_page(body: dict = Body(...)):
 
 
 @app.post("/api/ecommerce/rakuten/sync")
-def rakuten_sync(body: dict | None = Body(default=None)):
+async def rakuten_sync(body: dict | None = Body(default=None)):
     body = body or {}
     date_str = body.get("date")
     if date_str:
@@ -84,65 +119,148 @@ def rakuten_sync(body: dict | None = Body(default=None)):
     try:
         rakuten_client = RakutenApiClient()
         analyzer = RakutenDataAnalyzer(client=rakuten_client)
-        summary_data_list = analyzer.get_revenue_summary(target_date)
+        # 乐天 API 仍是同步请求，放到线程池里执行
+        summary_data_list = await run_in_threadpool(analyzer.get_revenue_summary, target_date)
 
         feishu_client = FeishuBotClient(bot_token=get_env("FEISHU_BOT_TOKEN", "") or "dummy")
         sheet_manager = FeishuSheetManager(client=feishu_client)
-        success_count = 0
-        for sku_data in summary_data_list:
-            sheet_manager.upsert_pivot_revenue_record(
-                app_token=None,
-                table_id=None,
-                target_date=target_date,
-                data=sku_data,
-            )
-            success_count += 1
-        return {"success": True, "message": f"已同步 {success_count} 条记录"}
+        # 整表扫描一次 + 批量更新 / 新建，代替逐个 SKU 搜索和写入
+        result = await sheet_manager.upsert_pivot_revenue_records_async(
+            app_token=None,
+            table_id=None,
+            target_date=target_date,
+            data_list=summary_data_list,
+        )
+        return {
+            "success": True,
+            "message": f"已同步 {result['updated'] + result['created']} 条记录"
+                       f"（更新 {result['updated']}，新增 {result['created']}）",
+            "stats": result,
+        }
     except Exception as e:
         return {"success": False, "message": str(e)}
 
 
 @app.post("/api/feishu/sync")
-def feishu_sync():
+async def feishu_sync():
     """手动触发飞书同步（复用乐天同步逻辑，默认昨日）"""
-    return rakuten_sync({})
+    return await rakuten_sync({})
+
+
+@app.post("/api/feishu/revenue/snapshot")
+async def feishu_revenue_snapshot(body: dict | None = Body(default=None)):
+    """把营业额横表整表导出为本地快照（body 可传 format: sqlite / parquet）"""
+    body = body or {}
+    try:
+        sheet_manager = FeishuSheetManager(client=FeishuBotClient(bot_token=get_env("FEISHU_BOT_TOKEN", "") or "dummy"))
+        result = await run_in_threadpool(sheet_manager.export_pivot_snapshot, fmt=body.get("format"))
+        return {"success": True, "message": f"已导出 {result['records']} 条记录", "snapshot": result}
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+
+
+@app.get("/api/ecommerce/rakuten/revenue")
+def get_rakuten_revenue(refresh: bool = False, format: str | None = None):
+    """
+    看板读取营业额横表：读本地快照，不请求飞书；refresh=true 或还没有快照时先导出一次。
+    format=sqlite|parquet 指定快照格式，不传时读已有的快照（两种都有时取最近导出的）。
+    snapshot 为快照的元数据（format / exported_at / record_count / fields）。
+    """
+    try:
+        sheet_manager = FeishuSheetManager(client=FeishuBotClient(bot_token=get_env("FEISHU_BOT_TOKEN", "") or "dummy"))
+        frame = sheet_manager.read_pivot_snapshot(refresh=refresh, fmt=format)
+        # 快照的导出时间、记录数等，看板据此显示数据是什么时候的
+        info = sheet_manager.pivot_snapshot_info(fmt=format)
+    except Exception as e:
+        return {"success": False, "message": str(e)}
+    # NaN（空单元格）转成 None，才能序列化为 JSON
+    frame = frame.astype(object).where(frame.notna(), None)
+    return {"success": True, "snapshot": info, "columns": list(frame.columns), "records": frame.to_dict("records")}
 
 
 @app.post("/api/feishu/amazon-rank/sync")
 def feishu_amazon_rank_sync(body: dict | None = Body(default=None)):
-    """Amazon 排名同步到飞书电子表格。可选 body: {"sheet": "3月"}"""
+    """Amazon 排名同步到飞书电子表格。可选 body: {"sheet": "3月", "concurrency": 4, "rpm": 20, "resume": true}"""
     body = body or {}
     sheet_title = body.get("sheet")
-    return run_amazon_rank_sync(sheet_title=sheet_title)
+    return run_amazon_rank_sync(
+        sheet_title=sheet_title,
+        concurrency=body.get("concurrency"),
+        rpm=body.get("rpm"),
+        resume=bool(body.get("resume")),
+    )
 
 
 @app.post("/api/feishu/amazon-rank/sync/stream")
 async def feishu_amazon_rank_sync_stream(request: Request, body: dict | None = Body(default=None)):
-    """流式返回的 Amazon 排名同步。"""
+    """流式返回的 Amazon 排名同步。body 同上；中断后用 {"resume": true} 重新运行可跳过今天已抓到的 ASIN。"""
     body = body or {}
     sheet_title = body.get("sheet")
     
     async def event_generator():
         from src.features.ecommerce.amazon.rank_sync import run_amazon_rank_sync_generator
-        gen = run_amazon_rank_sync_generator(sheet_title=sheet_title)
-        
-        for item in gen:
-            # 每次拿到一个事件时，检查客户端是否已断开（取消请求）
-            if await request.is_disconnected():
-                print("Client disconnected, cancelling task!")
-                break
-                
-            yield json.dumps(item) + "\n"
+        gen = run_amazon_rank_sync_generator(
+            sheet_title=sheet_title,
+            concurrency=body.get("concurrency"),
+            rpm=body.get("rpm"),
+            resume=bool(body.get("resume")),
+        )
+        try:
+            # 生成器内部是阻塞的抓取和飞书写入，逐个事件放到线程池里取，不阻塞事件循环
+            async for item in iterate_in_threadpool(gen):
+                # 每次拿到一个事件时，检查客户端是否已断开（取消请求）
+                if await request.is_disconnected():
+                    print("Client disconnected, cancelling task!")
+                    break
+
+                yield json.dumps(item) + "\n"
+        finally:
+            # 关闭生成器：取消尚未开始的抓取任务，已抓到的排名写回飞书并记入断点
+            await close_in_threadpool(gen)
             
     return StreamingResponse(event_generator(), media_type="application/x-ndjson")
 
 
 @app.post("/api/feishu/amazon-keyword/track")
 def feishu_amazon_keyword_track(body: dict | None = Body(default=None)):
-    """Amazon 关键词自然位/広告位追踪。可选 body: {"sheet": "KW追踪"}"""
+    """Amazon 关键词自然位/広告位追踪。可选 body: {"sheet": "KW追踪", "concurrency": 4, "rpm": 20, "adaptive": true}"""
     body = body or {}
     sheet_title = body.get("sheet")
-    return run_keyword_tracking(sheet_title=sheet_title)
+    return run_keyword_tracking(
+        sheet_title=sheet_title,
+        concurrency=body.get("concurrency"),
+        rpm=body.get("rpm"),
+        adaptive=body.get("adaptive"),
+    )
+
+
+@app.post("/api/feishu/amazon-keyword/track/stream")
+async def feishu_amazon_keyword_track_stream(request: Request, body: dict | None = Body(default=None)):
+    """流式返回的 Amazon 关键词追踪（NDJSON），断开连接时已抓取的结果仍会写入飞书。"""
+    body = body or {}
+
+    async def event_generator():
+        from src.features.ecommerce.amazon.keyword_tracker import run_keyword_tracking_generator
+        gen = run_keyword_tracking_generator(
+            sheet_title=body.get("sheet"),
+            concurrency=body.get("concurrency"),
+            rpm=body.get("rpm"),
+            adaptive=body.get("adaptive"),
+        )
+        try:
+            # 生成器内部是阻塞的抓取和飞书写入，逐个事件放到线程池里取，不阻塞事件循环
+            async for item in iterate_in_threadpool(gen):
+                # 每次拿到一个事件时，检查客户端是否已断开（取消请求）
+                if await request.is_disconnected():
+                    print("Client disconnected, cancelling task!")
+                    break
+
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # 关闭生成器：停止抓取并把已抓取的结果写入飞书
+            await close_in_threadpool(gen)
+
+    return StreamingResponse(event_generator(), media_type="application/x-ndjson")
 
 
 @app.get("/api/inventory/dashboard")
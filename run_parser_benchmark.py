@@ -0,0 +1,110 @@
+"""
+HTML 解析基准测试：对录制好的 Amazon 页面逐个解析方式运行，报告每页耗时、CPU 时间与峰值内存。
+在 agent 目录下运行：python run_parser_benchmark.py FIXTURE [FIXTURE ...] [--repeat 5] [--kind serp|product]
+FIXTURE 可以是 .html / .html.gz 文件或目录。
+- --kind serp（默认）：搜索结果页，比较各解析后端
+- --kind product：商品详情页的売れ筋ランキング，比较整页解析（full）与定位解析（targeted）
+峰值内存由 tracemalloc 统计，只包含 Python 侧分配（lxml / selectolax 的 C 内存不计入）。
+"""
+import argparse
+import functools
+import gzip
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from src.core.html_parser import PARSER_BACKENDS, has_selectolax
+from src.features.ecommerce.amazon.rank_sync import _parse_rank
+from src.features.ecommerce.amazon.serp import SerpPage
+
+PRODUCT_PARSERS = {
+    "full": functools.partial(_parse_rank, targeted=False),
+    "targeted": _parse_rank,
+}
+
+
+def _load_fixtures(paths: list[str]) -> list[tuple[str, str]]:
+    files: list[Path] = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files.extend(sorted(x for x in p.rglob("*") if x.name.endswith((".html", ".html.gz"))))
+        else:
+            files.append(p)
+    fixtures = []
+    for f in files:
+        raw = f.read_bytes()
+        if f.name.endswith(".gz"):
+            raw = gzip.decompress(raw)
+        fixtures.append((f.name, raw.decode("utf-8", errors="replace")))
+    return fixtures
+
+
+def _parse(html: str, backend: str, kind: str):
+    if kind == "product":
+        return PRODUCT_PARSERS[backend](html)
+    serp = SerpPage.from_html(html, backend=backend)
+    return serp.organic_count, serp.sponsored_count
+
+
+def _bench(html: str, backend: str, kind: str, repeat: int) -> tuple[float, float, float, object]:
+    times, cpu_times = [], []
+    result = None
+    for _ in range(repeat):
+        t, c = time.perf_counter(), time.process_time()
+        result = _parse(html, backend, kind)
+        times.append(time.perf_counter() - t)
+        cpu_times.append(time.process_time() - c)
+    tracemalloc.start()
+    _parse(html, backend, kind)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times) * 1000, statistics.median(cpu_times) * 1000, peak / 1024 / 1024, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML 解析基准测试")
+    parser.add_argument("fixtures", nargs="+", help="录制的 HTML 文件或目录")
+    parser.add_argument("--kind", choices=("serp", "product"), default="serp", help="页面类型")
+    parser.add_argument("--backends", type=str, help="逗号分隔的解析方式，默认该页面类型的全部")
+    parser.add_argument("--repeat", type=int, default=5, help="每个页面重复解析次数（取中位数）")
+    args = parser.parse_args()
+
+    fixtures = _load_fixtures(args.fixtures)
+    if not fixtures:
+        print("❌ 没有找到 HTML fixture")
+        sys.exit(1)
+
+    available = PRODUCT_PARSERS if args.kind == "product" else PARSER_BACKENDS
+    backends = [b.strip() for b in (args.backends or ",".join(available)).split(",") if b.strip()]
+    unknown = [b for b in backends if b not in available]
+    if unknown:
+        print(f"❌ 未知的解析方式: {unknown}，可选: {list(available)}")
+        sys.exit(1)
+    if "selectolax" in backends and not has_selectolax():
+        print("⚠️ selectolax 未安装，跳过")
+        backends.remove("selectolax")
+
+    result_label = "rank/category/status" if args.kind == "product" else "organic/ad"
+    print(f"{'backend':<12} {'page':<32} {'size(KB)':>9} {'parse(ms)':>10} {'cpu(ms)':>9} {'peak(MB)':>9}  {result_label}")
+    totals: dict[str, list[tuple[float, float, float]]] = {b: [] for b in backends}
+    baseline: dict[str, object] = {}
+    for backend in backends:
+        for name, html in fixtures:
+            ms, cpu, peak, result = _bench(html, backend, args.kind, args.repeat)
+            totals[backend].append((ms, cpu, peak))
+            mark = "" if baseline.setdefault(name, result) == result else "  ⚠️ 结果与第一个解析方式不一致"
+            shown = "/".join(str(x) for x in result)
+            print(f"{backend:<12} {name[:32]:<32} {len(html) / 1024:>9.0f} {ms:>10.1f} {cpu:>9.1f} {peak:>9.1f}  {shown}{mark}")
+
+    print("\n--- 平均每页 ---")
+    for backend, values in totals.items():
+        ms, cpu, peak = (statistics.mean(v) for v in zip(*values))
+        print(f"  {backend:<12} {ms:.1f} ms  cpu {cpu:.1f} ms  peak {peak:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,10 @@ def main():
     parser = argparse.ArgumentParser(description="Synchronize Rakuten sales data to Feishu horizontal pivot table.")
     parser.add_argument("--date", type=str, help="Date to sync in YYYY-MM-DD format (defaults to yesterday)")
     parser.add_argument("--inspect", action="store_true", help="Inspect and print Lark table columns instead of syncing data")
+    parser.add_argument("--snapshot", action="store_true", help="同步后把飞书横表导出为本地快照，供看板读取本地副本")
+    parser.add_argument(
+        "--snapshot-format", choices=("sqlite", "parquet"), help="快照格式，默认 LARK_BITABLE_SNAPSHOT_FORMAT 或 sqlite"
+    )
     args = parser.parse_args()
 
     if args.inspect:
@@ -54,21 +58,28 @@ def main():
     sheet_manager = FeishuSheetManager(client=feishu_client)
 
     logger.info("将数据更新到飞书多维表格[横表]中...")
-    success_count = 0
     try:
-        for sku_data in summary_data_list:
-            sheet_manager.upsert_pivot_revenue_record(
-                app_token=None,  # Configured in config.yaml / .env
-                table_id=None,   # Configured in config.yaml / .env
-                target_date=target_date,  # 传入具体日期以确定写入 x 日的列
-                data=sku_data
-            )
-            success_count += 1
-            
-        logger.info(f"✅ 成功同步到飞书横表！共更新/插入了 {success_count} 个 SKU 记录。")
+        # 整表扫描一次取得 SKU -> record_id，再按 500 条一批更新 / 新建
+        result = sheet_manager.upsert_pivot_revenue_records(
+            app_token=None,  # Configured in config.yaml / .env
+            table_id=None,   # Configured in config.yaml / .env
+            target_date=target_date,  # 传入具体日期以确定写入 x 日的列
+            data_list=summary_data_list,
+        )
+        logger.info(
+            f"✅ 成功同步到飞书横表！更新 {result['updated']} 个、新增 {result['created']} 个 SKU 记录。 stats={result}"
+        )
     except Exception as e:
         logger.error(f"❌ 同步到飞书失败: {e}")
         sys.exit(1)
 
+    if args.snapshot:
+        try:
+            snapshot = sheet_manager.export_pivot_snapshot(fmt=args.snapshot_format)
+            logger.info(f"📦 已导出本地快照 {snapshot['path']}（{snapshot['records']} 条，{snapshot['seconds']}s）")
+        except Exception as e:
+            logger.error(f"❌ 导出快照失败: {e}")
+            sys.exit(1)
+
 if __name__ == "__main__":
     main()
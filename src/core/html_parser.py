@@ -0,0 +1,65 @@
+"""
+HTML 解析后端的统一入口，供页面分析 / 关键词追踪 / 排名同步共用。
+
+可选后端（环境变量 HTML_PARSER_BACKEND 或 config.yaml 的 scraper.html_parser）：
+- html.parser: Python 标准库解析器，最慢，不依赖 C 扩展
+- lxml:        默认，BeautifulSoup + lxml
+- strainer:    lxml + SoupStrainer，只构建调用方关心的那部分节点（如搜索结果卡片）
+- selectolax:  基于 C 的解析/选择器引擎（可选依赖 pip install selectolax），
+               仅部分调用方有原生实现，其余调用方自动退回 lxml
+"""
+from __future__ import annotations
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from src.core.config_manager import get_env, load_yaml_config
+
+PARSER_BACKENDS = ("html.parser", "lxml", "strainer", "selectolax")
+DEFAULT_BACKEND = "lxml"
+
+_warned: set[str] = set()
+
+
+def _warn_once(msg: str) -> None:
+    if msg not in _warned:
+        _warned.add(msg)
+        print(f"[WARN] {msg}")
+
+
+def get_parser_backend() -> str:
+    """当前配置的解析后端：环境变量优先，其次 config.yaml，最后默认 lxml。"""
+    backend = get_env("HTML_PARSER_BACKEND") or (
+        (load_yaml_config().get("scraper") or {}).get("html_parser")
+    )
+    backend = (backend or DEFAULT_BACKEND).strip().lower()
+    if backend not in PARSER_BACKENDS:
+        _warn_once(f"unknown HTML parser backend '{backend}', fallback to {DEFAULT_BACKEND}")
+        return DEFAULT_BACKEND
+    if backend == "selectolax" and not has_selectolax():
+        _warn_once("selectolax is not installed, fallback to lxml")
+        return DEFAULT_BACKEND
+    return backend
+
+
+def has_selectolax() -> bool:
+    try:
+        import selectolax.lexbor  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_soup(
+    html: str, backend: str | None = None, parse_only: SoupStrainer | None = None
+) -> BeautifulSoup:
+    """
+    按后端构建 BeautifulSoup。
+    parse_only 只在 strainer 后端生效；selectolax 后端在这里等同于 lxml
+    （需要原生 selectolax 路径的调用方应在调用前自行分支）。
+    """
+    backend = backend or get_parser_backend()
+    if backend == "html.parser":
+        return BeautifulSoup(html, "html.parser")
+    if backend == "strainer" and parse_only is not None:
+        return BeautifulSoup(html, "lxml", parse_only=parse_only)
+    return BeautifulSoup(html, "lxml")
@@ -0,0 +1,228 @@
+"""
+限流工具：令牌桶与熔断器，按 host 共享，供并发抓取时控制整体请求速率、在被大量拦截时暂停抓取。
+SharedTokenBucket 把令牌桶状态放在本地 SQLite 里，同一台机器上的多个进程共用一个请求预算。
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶。
+    - rate_per_minute: 每分钟补充的令牌数（即请求预算）
+    - burst: 桶容量，允许的瞬时突发请求数
+    acquire() 采用"预约"方式：令牌不足时先记账再在锁外 sleep，多个线程按到达顺序依次放行。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self._lock = threading.Lock()
+        self._rate = max(float(rate_per_minute), 0.001) / 60.0
+        self._capacity = float(max(int(burst), 1))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self.total_wait = 0.0
+
+    @property
+    def rate_per_minute(self) -> float:
+        return self._rate * 60.0
+
+    def set_rate(self, rate_per_minute: float, burst: int | None = None) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._rate = max(float(rate_per_minute), 0.001) / 60.0
+            if burst is not None:
+                self._capacity = float(max(int(burst), 1))
+                self._tokens = min(self._tokens, self._capacity)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+            self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """取得令牌，必要时阻塞等待。返回本次等待的秒数。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            self.total_wait += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_HOST_LIMITERS: dict[str, TokenBucket] = {}
+_HOST_LIMITERS_LOCK = threading.Lock()
+
+
+def get_host_limiter(host: str, rate_per_minute: float = 20.0, burst: int = 1) -> TokenBucket:
+    """按 host 取得共享的令牌桶；首次调用时按给定参数创建，之后返回同一个实例。"""
+    with _HOST_LIMITERS_LOCK:
+        limiter = _HOST_LIMITERS.get(host)
+        if limiter is None:
+            limiter = TokenBucket(rate_per_minute, burst)
+            _HOST_LIMITERS[host] = limiter
+        return limiter
+
+
+class CircuitBreaker:
+    """
+    按最近 window 次请求的被拦截比例熔断（线程安全）。
+    - 样本数 >= min_samples 且拦截比例 >= threshold 时打开，cooldown 秒内 wait() 会阻塞所有调用方
+    - 冷却结束后清空样本重新统计；连续熔断时冷却时间翻倍，最长 max_cooldown 秒
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        threshold: float = 0.5,
+        min_samples: int = 5,
+        cooldown: float = 120.0,
+        max_cooldown: float = 900.0,
+    ):
+        self._lock = threading.Lock()
+        self._results: deque[bool] = deque(maxlen=max(int(window), 1))
+        self.threshold = threshold
+        self.min_samples = max(int(min_samples), 1)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._open_until = 0.0
+        self._consecutive = 0
+        self.trips = 0
+        self.open_seconds = 0.0
+
+    def record(self, blocked: bool) -> bool:
+        """记录一次请求结果，本次导致熔断时返回 True。"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            self._results.append(blocked)
+            n = len(self._results)
+            if n < self.min_samples:
+                return False
+            if sum(self._results) / n < self.threshold:
+                self._consecutive = 0
+                return False
+            cooldown = min(self.cooldown * (2 ** self._consecutive), self.max_cooldown)
+            self._open_until = now + cooldown
+            self._consecutive += 1
+            self._results.clear()
+            self.trips += 1
+            self.open_seconds += cooldown
+            return True
+
+    def remaining(self) -> float:
+        """距离恢复还有多少秒，未熔断时为 0。"""
+        with self._lock:
+            return max(self._open_until - time.monotonic(), 0.0)
+
+    def wait(self, stop: threading.Event | None = None) -> float:
+        """熔断期间阻塞，返回等待的秒数；stop 被 set 时提前返回。"""
+        waited = 0.0
+        while (remaining := self.remaining()) > 0:
+            if stop is not None:
+                if stop.wait(remaining):
+                    break
+            else:
+                time.sleep(remaining)
+            waited += remaining
+        return waited
+
+    def stats(self) -> dict[str, float]:
+        return {"trips": self.trips, "open_seconds": round(self.open_seconds, 1)}
+
+
+_HOST_BREAKERS: dict[str, CircuitBreaker] = {}
+_HOST_BREAKERS_LOCK = threading.Lock()
+
+
+def get_host_breaker(host: str, **kwargs) -> CircuitBreaker:
+    """按 host 取得共享的熔断器；首次调用时按给定参数创建，之后返回同一个实例。"""
+    with _HOST_BREAKERS_LOCK:
+        breaker = _HOST_BREAKERS.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(**kwargs)
+            _HOST_BREAKERS[host] = breaker
+        return breaker
+
+
+class SharedTokenBucket:
+    """
+    跨进程共享的令牌桶：状态（剩余令牌、补充时刻）存放在 SQLite 的 buckets 表中，
+    每次 acquire() 在一个 IMMEDIATE 事务里记账，与 TokenBucket 一样先预约再在锁外 sleep。
+    penalize(seconds) 让所有进程在 seconds 秒内都拿不到令牌（用于服务端返回的限流重置时间）。
+    """
+
+    def __init__(self, path: str | Path, name: str, rate_per_second: float, burst: int = 1):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self._rate = max(float(rate_per_second), 0.001)
+        self._capacity = float(max(int(burst), 1))
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.total_wait = 0.0
+        self.penalties = 0
+
+    def _update(self, fn) -> float:
+        """在事务中读出 (tokens, updated)，fn 返回新的 (tokens, updated, wait)。"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                now = time.time()
+                tokens, updated = row if row else (self._capacity, now)
+                if now > updated:
+                    tokens = min(self._capacity, tokens + (now - updated) * self._rate)
+                    updated = now
+                tokens, updated, wait = fn(now, tokens, updated)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                    (self.name, tokens, updated),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return wait
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """预约令牌但不等待，返回调用方需要 sleep 的秒数（供 asyncio 代码用 asyncio.sleep 等待）。"""
+
+        def _take(now: float, left: float, updated: float):
+            left -= tokens
+            # updated 在未来说明处于惩罚期，令牌要从那时才开始补充
+            wait = max(updated - now, 0.0) + (-left / self._rate if left < 0 else 0.0)
+            self.total_wait += wait
+            return left, updated, wait
+
+        return self._update(_take)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """取得令牌，必要时阻塞等待。返回本次等待的秒数。"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, seconds: float) -> None:
+        """seconds 秒内不再发放令牌，之后从空桶开始补充。"""
+
+        def _block(now: float, left: float, updated: float):
+            return min(left, 0.0), max(updated, now + seconds), 0.0
+
+        self._update(_block)
+        self.penalties += 1
+
+    def stats(self) -> dict[str, float]:
+        return {"wait_seconds": round(self.total_wait, 3), "penalties": self.penalties}
@@ -0,0 +1,100 @@
+"""
+Amazon 排名同步的断点记录。
+每次运行按 (表格, sheet, 当日列, 日期) 保存一个 JSON（默认 data/checkpoints/），
+记录每行抓到的结果以及是否已写回飞书；中断后用 resume 重新运行时，
+已抓到排名的 ASIN 直接跳过，其中还没写回的结果直接补写，不再重新抓取。
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from src.core.config_manager import get_env, get_project_path
+
+JST = timezone(timedelta(hours=9))
+
+CHECKPOINT_DIR = get_env("AMZ_CHECKPOINT_DIR") or str(get_project_path("data", "checkpoints"))
+CHECKPOINT_KEEP_DAYS = float(get_env("AMZ_CHECKPOINT_KEEP_DAYS") or "7")
+
+
+class RankSyncCheckpoint:
+    def __init__(
+        self,
+        spreadsheet_token: str,
+        sheet_id: str,
+        col: str,
+        day: str | None = None,
+        root: str | Path = CHECKPOINT_DIR,
+    ):
+        self.day = day or datetime.now(JST).strftime("%Y-%m-%d")
+        safe = re.sub(r"[^0-9A-Za-z_-]", "_", f"{spreadsheet_token}_{sheet_id}_{col}")
+        self.path = Path(root) / f"rank_sync_{self.day}_{safe}.json"
+        # 行号（字符串）-> {"asin", "value", "category", "status", "written"}
+        self._rows: dict[str, dict] = {}
+
+    def load(self) -> int:
+        """读取已有的断点，返回记录的行数；没有断点时返回 0。"""
+        if not self.path.exists():
+            return 0
+        try:
+            self._rows = json.loads(self.path.read_text(encoding="utf-8")).get("rows", {})
+        except (OSError, ValueError) as e:
+            print(f"[WARN] failed to load checkpoint {self.path}: {e}")
+            self._rows = {}
+        return len(self._rows)
+
+    def finished(self, row: int, asin: str) -> bool:
+        """
+        该行今天是否已成功抓到排名（未写回的由 unwritten() 补写，不必重新抓取）。
+        抓取失败的行、或该行的 ASIN 已被改动时返回 False，resume 时会重新抓取。
+        """
+        entry = self._rows.get(str(row))
+        return bool(entry and entry["asin"] == asin and entry["status"] == "OK")
+
+    def unwritten(self) -> list[tuple[int, dict]]:
+        """已抓到但还没写回飞书的行。"""
+        return [(int(row), e) for row, e in self._rows.items() if not e["written"]]
+
+    def mark_fetched(self, row: int, asin: str, value: str | None, category: str | None, status: str) -> None:
+        self._rows[str(row)] = {
+            "asin": asin,
+            "value": value,
+            "category": category,
+            "status": status,
+            "written": False,
+        }
+
+    def mark_all_written(self) -> None:
+        for entry in self._rows.values():
+            entry["written"] = True
+
+    def stats(self) -> dict[str, int]:
+        written = sum(1 for e in self._rows.values() if e["written"])
+        return {"fetched": len(self._rows), "written": written}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"day": self.day, "rows": self._rows}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def prune_checkpoints(root: str | Path = CHECKPOINT_DIR, keep_days: float = CHECKPOINT_KEEP_DAYS) -> int:
+    """删除超过 keep_days 天的断点文件，返回删除的个数。"""
+    root = Path(root)
+    if keep_days <= 0 or not root.exists():
+        return 0
+    cutoff = time.time() - keep_days * 86400
+    removed = 0
+    for f in root.glob("rank_sync_*.json"):
+        try:
+            if f.stat().st_mtime < cutoff:
+                f.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
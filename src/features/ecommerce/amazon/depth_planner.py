@@ -0,0 +1,110 @@
+"""
+关键词排名的自适应翻页深度。
+根据每个 (ASIN, keyword) 最近几次的结果决定本次最多翻到第几页：
+- 最近一直在前几页出现的：翻到历史上出现过的最深页 + 余量即可
+- 最近一直没出现的：只看第 1 页
+- 每隔 AMZ_DEPTH_PROBE_EVERY 次（或上次预测失误后）做一次全深度探测，重新校准
+状态保存在本地 JSON（默认 data/keyword_depth_state.json）。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+
+from src.core.config_manager import get_env, get_project_path
+
+DEPTH_STATE_PATH = get_env("AMZ_DEPTH_STATE_PATH") or str(get_project_path("data", "keyword_depth_state.json"))
+DEPTH_HISTORY = int(get_env("AMZ_DEPTH_HISTORY") or "5")
+DEPTH_MARGIN = int(get_env("AMZ_DEPTH_MARGIN") or "1")
+DEPTH_PROBE_EVERY = int(get_env("AMZ_DEPTH_PROBE_EVERY") or "7")
+
+
+class DepthPlanner:
+    def __init__(
+        self,
+        path: str | Path = DEPTH_STATE_PATH,
+        history: int = DEPTH_HISTORY,
+        margin: int = DEPTH_MARGIN,
+        probe_every: int = DEPTH_PROBE_EVERY,
+    ):
+        self.path = Path(path)
+        self.history = max(history, 1)
+        self.margin = max(margin, 0)
+        self.probe_every = max(probe_every, 1)
+        self._lock = threading.Lock()
+        self._state: dict[str, dict] = {}
+        self._plans: dict[str, tuple[int, int | None, bool]] = {}
+        self._stats = {"pairs": 0, "probes": 0, "misses": 0}
+        if self.path.exists():
+            try:
+                self._state = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"[WARN] failed to load depth state {self.path}: {e}")
+
+    @staticmethod
+    def _key(asin: str, keyword: str) -> str:
+        return f"{asin}\t{keyword}"
+
+    def _expected_page(self, entry: dict) -> int | None:
+        """历史上出现过的最深页；从未出现过返回 None。"""
+        found = [p for org, ad, _ in entry.get("history", []) for p in (org, ad) if p]
+        return max(found) if found else None
+
+    def plan(self, asin: str, keyword: str, max_pages: int) -> int:
+        """返回本次对该 ASIN 最多翻到第几页。"""
+        key = self._key(asin, keyword)
+        with self._lock:
+            entry = self._state.get(key) or {}
+            expected = self._expected_page(entry)
+            probe = (
+                not entry.get("history")
+                or entry.get("runs_since_probe", 0) + 1 >= self.probe_every
+            )
+            if probe:
+                depth = max_pages
+            elif expected is None:
+                depth = 1
+            else:
+                depth = min(max_pages, expected + self.margin)
+            self._plans[key] = (depth, expected, probe)
+            return depth
+
+    def record(self, asin: str, keyword: str, organic_page: int, ad_page: int, max_pages: int) -> None:
+        """记录本次结果（0 表示在搜索深度内没找到），并统计预测是否失误。"""
+        key = self._key(asin, keyword)
+        with self._lock:
+            depth, expected, probe = self._plans.pop(key, (max_pages, None, True))
+            entry = self._state.setdefault(key, {"history": [], "runs_since_probe": 0})
+
+            found = [p for p in (organic_page, ad_page) if p]
+            if probe:
+                # 全深度探测：如果找到的页比自适应模式会翻到的更深，说明预测会漏掉
+                would_depth = 1 if expected is None else min(max_pages, expected + self.margin)
+                missed = bool(entry["history"]) and any(p > would_depth for p in found)
+            else:
+                # 自适应模式：历史上能找到，这次在预测深度内却没找到
+                missed = expected is not None and not found
+
+            entry["history"] = (entry["history"] + [[organic_page, ad_page, depth]])[-self.history:]
+            # 失误后下一次强制全深度探测
+            entry["runs_since_probe"] = self.probe_every if missed else (0 if probe else entry["runs_since_probe"] + 1)
+
+            self._stats["pairs"] += 1
+            self._stats["probes"] += int(probe)
+            self._stats["misses"] += int(missed)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            s = dict(self._stats)
+        s["miss_rate"] = round(s["misses"] / s["pairs"], 3) if s["pairs"] else 0.0
+        return s
+
+    def save(self) -> None:
+        with self._lock:
+            data = json.dumps(self._state, ensure_ascii=False)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(data, encoding="utf-8")
+        os.replace(tmp, self.path)
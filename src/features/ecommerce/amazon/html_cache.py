@@ -0,0 +1,207 @@
+"""
+Amazon 页面快照缓存：把抓取到的原始 HTML 按内容哈希（sha256）压缩保存到本地，
+索引 (kind, key, page, 抓取时间) -> 内容哈希，相同内容只存一份。
+解析逻辑变更或需要提取新字段时，可以直接从缓存重新解析，不必重新抓取。
+
+目录结构（默认 data/html_cache，可用 AMZ_HTML_CACHE_DIR 修改）：
+  index.sqlite            快照索引
+  blobs/ab/abcdef....gz   gzip 压缩的内容
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from src.core.config_manager import get_env, get_project_path
+
+JST = timezone(timedelta(hours=9))
+
+HTML_CACHE_ENABLED = (get_env("AMZ_HTML_CACHE") or "1") != "0"
+HTML_CACHE_DIR = get_env("AMZ_HTML_CACHE_DIR") or str(get_project_path("data", "html_cache"))
+HTML_CACHE_TTL_DAYS = float(get_env("AMZ_HTML_CACHE_TTL_DAYS") or "14")
+HTML_CACHE_MAX_MB = float(get_env("AMZ_HTML_CACHE_MAX_MB") or "512")
+
+# 每写入多少个快照检查一次是否需要淘汰
+_EVICT_EVERY = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_lookup ON snapshots (kind, key, page, day);
+CREATE INDEX IF NOT EXISTS idx_snapshots_day ON snapshots (kind, day);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    raw_size INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+
+class HtmlSnapshotStore:
+    def __init__(
+        self,
+        root: str | Path = HTML_CACHE_DIR,
+        ttl_days: float = HTML_CACHE_TTL_DAYS,
+        max_mb: float = HTML_CACHE_MAX_MB,
+    ):
+        self.root = Path(root)
+        self.ttl_days = ttl_days
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def _blob_path(self, sha: str) -> Path:
+        return self.root / "blobs" / sha[:2] / f"{sha}.gz"
+
+    # -----------------------------------------------------------------------
+    # 写入 / 读取
+    # -----------------------------------------------------------------------
+    def put(self, kind: str, key: str, page: int, content: str, fetched_at: datetime | None = None) -> str:
+        """保存一个快照，返回内容哈希。"""
+        raw = content.encode("utf-8")
+        sha = hashlib.sha256(raw).hexdigest()
+        ts = (fetched_at or datetime.now(JST)).astimezone(JST)
+        path = self._blob_path(sha)
+        with self._lock:
+            known = self._db.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (sha,)).fetchone()
+            if not known or not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f".tmp{threading.get_ident()}")
+                tmp.write_bytes(gzip.compress(raw, compresslevel=6))
+                os.replace(tmp, path)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO blobs (sha256, size, raw_size, created_at) VALUES (?, ?, ?, ?)",
+                    (sha, path.stat().st_size, len(raw), ts.isoformat()),
+                )
+            self._db.execute(
+                "INSERT INTO snapshots (kind, key, page, day, fetched_at, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, page, ts.strftime("%Y-%m-%d"), ts.isoformat(), sha),
+            )
+            self._db.commit()
+            self._puts += 1
+            due = self._puts % _EVICT_EVERY == 0
+        if due:
+            self.evict()
+        return sha
+
+    def get(self, kind: str, key: str, page: int = 1, day: str | None = None) -> str | None:
+        """取 (kind, key, page) 在指定日期（不填则不限）最新的一份快照。"""
+        sql = "SELECT sha256 FROM snapshots WHERE kind = ? AND key = ? AND page = ?"
+        params: list = [kind, key, page]
+        if day:
+            sql += " AND day = ?"
+            params.append(day)
+        sql += " ORDER BY fetched_at DESC, id DESC LIMIT 1"
+        with self._lock:
+            row = self._db.execute(sql, params).fetchone()
+        return self.read_blob(row[0]) if row else None
+
+    def read_blob(self, sha: str) -> str | None:
+        path = self._blob_path(sha)
+        if not path.exists():
+            return None
+        return gzip.decompress(path.read_bytes()).decode("utf-8")
+
+    def list_snapshots(self, kind: str, day: str | None = None) -> list[dict]:
+        sql = "SELECT key, page, day, fetched_at, sha256 FROM snapshots WHERE kind = ?"
+        params: list = [kind]
+        if day:
+            sql += " AND day = ?"
+            params.append(day)
+        sql += " ORDER BY fetched_at"
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            {"key": k, "page": p, "day": d, "fetched_at": f, "sha256": s}
+            for k, p, d, f, s in rows
+        ]
+
+    # -----------------------------------------------------------------------
+    # 淘汰：先按 TTL，再按总大小从最旧的开始删
+    # -----------------------------------------------------------------------
+    def evict(self) -> dict[str, int]:
+        removed_snapshots = 0
+        with self._lock:
+            if self.ttl_days > 0:
+                cutoff = (datetime.now(JST) - timedelta(days=self.ttl_days)).isoformat()
+                removed_snapshots += self._db.execute(
+                    "DELETE FROM snapshots WHERE fetched_at < ?", (cutoff,)
+                ).rowcount
+            removed_blobs = self._drop_orphan_blobs()
+
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            while self.max_bytes > 0 and total > self.max_bytes:
+                oldest_day = self._db.execute("SELECT MIN(day) FROM snapshots").fetchone()[0]
+                if oldest_day is None:
+                    break
+                removed_snapshots += self._db.execute(
+                    "DELETE FROM snapshots WHERE day = ?", (oldest_day,)
+                ).rowcount
+                removed_blobs += self._drop_orphan_blobs()
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            self._db.commit()
+        return {"snapshots": removed_snapshots, "blobs": removed_blobs, "bytes": total}
+
+    def _drop_orphan_blobs(self) -> int:
+        orphans = [
+            r[0]
+            for r in self._db.execute(
+                "SELECT sha256 FROM blobs WHERE sha256 NOT IN (SELECT DISTINCT sha256 FROM snapshots)"
+            ).fetchall()
+        ]
+        for sha in orphans:
+            try:
+                self._blob_path(sha).unlink()
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha,))
+        return len(orphans)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            snapshots = self._db.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+            blobs, size, raw = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) FROM blobs"
+            ).fetchone()
+        return {"snapshots": snapshots, "blobs": blobs, "bytes": size, "raw_bytes": raw}
+
+
+_STORE: HtmlSnapshotStore | None = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_html_store() -> HtmlSnapshotStore | None:
+    """进程内共享的快照库；AMZ_HTML_CACHE=0 时返回 None（不缓存）。"""
+    global _STORE
+    if not HTML_CACHE_ENABLED:
+        return None
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = HtmlSnapshotStore()
+        return _STORE
+
+
+def save_snapshot(kind: str, key: str, page: int, content: str) -> None:
+    """抓取路径上调用：写缓存失败只告警，不影响抓取本身。"""
+    try:
+        store = get_html_store()
+        if store is not None:
+            store.put(kind, key, page, content)
+    except Exception as e:
+        print(f"[WARN] failed to cache {kind} snapshot key='{key}' page={page}: {e}")
@@ -1,19 +1,29 @@
+import json
 import os
 import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
-from typing import Any
+from typing import Any, Callable, Iterator
 
-import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 
 from src.core.config_manager import get_env
+from src.core.rate_limiter import get_host_limiter
 from src.features.feishu.bot_client import _get_tenant_access_token
+from src.features.feishu.sheets_client import get_sheets_client
+from src.features.feishu.write_behind import get_write_behind
+from .depth_planner import DepthPlanner
+from .html_cache import get_html_store, save_snapshot
+from .rank_history import get_rank_history
+from .serp import SerpPage
+from .session_pool import AmazonSessionPool
 from .lark_api import (
-    HEADER_ROW,
-    _batch_get,
-    _batch_update,
+    _append_rows,
     _resolve_sheet_id,
 )
 
@@ -22,6 +32,18 @@ JST = timezone(timedelta(hours=9))
 MAX_RANK = 999
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# 并发抓取：worker 数与 amazon.co.jp 的整体请求预算（次/分钟，所有 worker 共享）
+AMZ_HOST = "www.amazon.co.jp"
+KEYWORD_CONCURRENCY = int(get_env("AMZ_KEYWORD_CONCURRENCY") or "1")
+AMZ_RPM = float(get_env("AMZ_RPM") or "20")
+AMZ_BURST = int(get_env("AMZ_BURST") or "2")
+# 流式运行时每攒够多少条记录写一次飞书
+KEYWORD_FLUSH_ROWS = int(get_env("AMZ_KEYWORD_FLUSH_ROWS") or "200")
+# 自适应翻页深度（按历史排名决定每个 ASIN 翻几页）
+KEYWORD_ADAPTIVE = (get_env("AMZ_KEYWORD_ADAPTIVE") or "0") == "1"
+# 每个 Session 复用多少次后回收重建
+AMZ_SESSION_MAX_USES = int(get_env("AMZ_SESSION_MAX_USES") or "50")
+
 DEFAULT_HEADERS = {
     "User-Agent": (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -60,7 +82,7 @@ def load_keywords_from_lark(sheet_title: str = "Master") -> list[dict]:
         return []
 
     try:
-        from .lark_api import _resolve_sheet_id, _batch_get
+        from .lark_api import _resolve_sheet_id, iter_sheet_records
 
         token = _get_tenant_access_token()
         try:
@@ -69,26 +91,12 @@ def load_keywords_from_lark(sheet_title: str = "Master") -> list[dict]:
             print(f"[ERROR] Sheet '{sheet_title}' not found in Lark, please create it: {e}")
             return []
 
-        # 获取数据 (A到Z列，最大支持1000行)
-        rng = f"{sheet_id}!A1:Z1000"
-        data = _batch_get(token, spreadsheet_token, [rng])
-        vr = data.get("data", {}).get("valueRanges", [])
-        rows = (vr[0].get("values") if vr else []) or []
-
-        if len(rows) <= 1:
-            print(f"[WARN] Sheet '{sheet_title}' is empty or only contains header")
-            return []
-
-        headers = [str(h).strip().lower() for h in rows[0]]
-        
-        try:
-            idx_brand = headers.index("brand") if "brand" in headers else -1
-            idx_asin = headers.index("asin")
-            idx_product = headers.index("product") if "product" in headers else -1
-            idx_keyword = headers.index("keyword")
-        except ValueError as e:
-            print(f"[ERROR] Master sheet header must contain 'asin' and 'keyword' columns: {e}")
-            return []
+        # 只读取需要的 4 列，按 LARK_READ_BLOCK_ROWS 行一块翻页直到数据结束
+        rows = iter_sheet_records(
+            token, spreadsheet_token, sheet_id,
+            columns=["brand", "asin", "product", "keyword"],
+            required=("asin", "keyword"),
+        )
 
         def _extract_text(cell) -> str:
             if cell is None:
@@ -105,48 +113,56 @@ def load_keywords_from_lark(sheet_title: str = "Master") -> list[dict]:
         last_brand = ""
         last_asin = ""
         last_product = ""
+        data_rows = 0
 
-        # rows[0] is header, rows[1:] are data
-        for row in rows[1:]:
-            # 将行数据补齐匹配表头长
-            row = row + [""] * (len(headers) - len(row))
-            
-            asin = _extract_text(row[idx_asin])
-            if not asin:
-                asin = last_asin
-            else:
-                last_asin = asin
-
-            brand = _extract_text(row[idx_brand]) if idx_brand != -1 else ""
-            if not brand:
-                brand = last_brand
-            else:
-                last_brand = brand
-
-            product = _extract_text(row[idx_product]) if idx_product != -1 else ""
-            if not product:
-                product = last_product
-            else:
-                last_product = product
-                
-            keyword = _extract_text(row[idx_keyword])
-            
-            # If both ASIN and Keyword are empty, we've likely hit the end of data rows
-            if not asin and not keyword:
-                continue
+        try:
+            for _, row in rows:
+                data_rows += 1
+                asin = _extract_text(row["asin"])
+                if not asin:
+                    asin = last_asin
+                else:
+                    last_asin = asin
+
+                brand = _extract_text(row.get("brand"))
+                if not brand:
+                    brand = last_brand
+                else:
+                    last_brand = brand
+
+                product = _extract_text(row.get("product"))
+                if not product:
+                    product = last_product
+                else:
+                    last_product = product
+
+                keyword = _extract_text(row["keyword"])
+
+                # If both ASIN and Keyword are empty, we've likely hit the end of data rows
+                if not asin and not keyword:
+                    continue
+
+                # Need at least a keyword to track
+                if not keyword:
+                    continue
+
+                records.append({
+                    "brand": brand,
+                    "asin": asin,
+                    "product": product,
+                    "keyword": keyword
+                })
+        except ValueError as e:
+            print(f"[ERROR] Master sheet header must contain 'asin' and 'keyword' columns: {e}")
+            return []
 
-            # Need at least a keyword to track
-            if not keyword:
-                continue
+        if not data_rows:
+            print(f"[WARN] Sheet '{sheet_title}' is empty or only contains header")
+            return []
 
-            records.append({
-                "brand": brand,
-                "asin": asin,
-                "product": product,
-                "keyword": keyword
-            })
-            
         print(f"[INFO] Successfully loaded {len(records)} keywords from Lark Sheet '{sheet_title}'.")
+        # 同时缓存本次的关键词配置，供离线重新解析使用
+        save_snapshot("master", sheet_title, 0, json.dumps(records, ensure_ascii=False))
         return records
 
     except Exception as e:
@@ -157,165 +173,170 @@ def load_keywords_from_lark(sheet_title: str = "Master") -> list[dict]:
 # =========================
 # Amazon 搜索页面（支持翻页和邮编模拟）
 # =========================
+def _amazon_limiter():
+    # 所有对 amazon.co.jp 的请求共用一个令牌桶，并发时整体速率不超过 AMZ_RPM
+    return get_host_limiter(AMZ_HOST, rate_per_minute=AMZ_RPM, burst=AMZ_BURST)
+
+
+# 已预热（带东京邮编 Cookie）的长连接 Session 池，每次抓取借出一个
+_SESSION_POOL = AmazonSessionPool(
+    headers=DEFAULT_HEADERS,
+    cookies=TOKYO_COOKIES,
+    warm_url=f"https://{AMZ_HOST}",
+    max_uses=AMZ_SESSION_MAX_USES,
+    max_idle=max(KEYWORD_CONCURRENCY, 8),
+    limiter=_amazon_limiter(),
+)
+
+
 def get_amazon_page(keyword: str, page: int = 1, timeout: int = 15) -> str | None:
     url = f"https://www.amazon.co.jp/s?k={keyword}"
     if page > 1:
         url += f"&page={page}"
-    
+
     try:
-        # 使用 Session 保持邮编设置
-        session = requests.Session()
-        # 第一次请求设置基础状态
-        session.get("https://www.amazon.co.jp", headers=DEFAULT_HEADERS, timeout=timeout, cookies=TOKYO_COOKIES)
-        
-        # 正式请求结果页
-        r = session.get(url, headers=DEFAULT_HEADERS, timeout=timeout)
-        if r.status_code == 503:
-            print(f"[WARN] Amazon returned 503 (Anti-scraping) for keyword='{keyword}' page={page}")
-            return None
-        r.raise_for_status()
-        return r.text
+        with _SESSION_POOL.checkout() as pooled:
+            _amazon_limiter().acquire()
+            r = pooled.get(url, timeout=timeout)
+            if r.status_code == 503:
+                # 被反爬拦截的 Session 不再复用
+                pooled.discard()
+                print(f"[WARN] Amazon returned 503 (Anti-scraping) for keyword='{keyword}' page={page}")
+                return None
+            r.raise_for_status()
+            save_snapshot("serp", keyword, page, r.text)
+            return r.text
     except requests.RequestException as e:
         print(f"[WARN] Failed to get Amazon page for keyword='{keyword}': {e}")
         return None
 
 
-# =========================
-# 解析自然位排名
-# =========================
-def extract_organic_rank(soup: BeautifulSoup, asin: str, offset: int = 0) -> int | None:
-    results = soup.select("div[data-asin]")
-    rank_in_page = 1
-
-    for r in results:
-        asin_found = r.get("data-asin")
-        if not asin_found:
-            continue
+def get_session_stats() -> dict[str, float]:
+    """Session 池的复用统计（创建/预热/回收次数、请求复用率等）。"""
+    return _SESSION_POOL.stats()
 
-        # 跳过广告位
-        classes = " ".join(r.get("class", []))
-        if "AdHolder" in classes or "sp-sponsored-result" in classes:
-            continue
-        
-        # 跳过空卡片（有时会有无 ASIN 的占位符）
-        if len(asin_found) < 5:
-            continue
 
-        if asin_found == asin:
-            return offset + rank_in_page
+def close_session_pool() -> None:
+    """关闭池里空闲的 Session（命令行退出、FastAPI 关闭时调用）。"""
+    _SESSION_POOL.close()
 
-        rank_in_page += 1
 
-    return None
+# =========================
+# 解析自然位排名
+# =========================
+def extract_organic_rank(soup: BeautifulSoup, asin: str, offset: int = 0) -> int | None:
+    return SerpPage.from_soup(soup).organic_rank(asin, offset=offset)
 
 
 # =========================
 # 解析广告位排名
 # =========================
 def extract_ad_rank(soup: BeautifulSoup, asin: str, offset: int = 0) -> int | None:
-    ads = soup.select("div[data-component-type='s-search-result'], div.AdHolder")
-
-    rank_in_page = 1
-    for ad in ads:
-        asin_found = ad.get("data-asin")
-        if not asin_found:
-            continue
-
-        is_sponsored = False
-        classes = " ".join(ad.get("class", []))
-        if "AdHolder" in classes or "sp-sponsored-result" in classes:
-            is_sponsored = True
-        else:
-            sponsored_label = ad.select_one(
-                ".puis-label-popover-default, .s-label-popover-default, .s-sponsored-label-info-icon"
-            )
-            if sponsored_label and any(kw in sponsored_label.get_text() for kw in ["スポンサー", "Sponsored"]):
-                is_sponsored = True
-            elif any(kw in ad.get_text(" ", strip=True)[:200] for kw in ["スポンサー", "Sponsored"]):
-                is_sponsored = True
-
-        if is_sponsored:
-            if asin_found == asin:
-                return offset + rank_in_page
-            rank_in_page += 1
-
-    return None
+    return SerpPage.from_soup(soup).ad_rank(asin, offset=offset)
 
 
 # =========================
-# 循环翻页抓取排名
+# 循环翻页抓取排名（同一关键词的多个 ASIN 共用一次抓取）
 # =========================
-def get_ranks(keyword: str, asin: str) -> tuple[int, int]:
-    max_pages = int(get_env("AMZ_KEYWORD_MAX_PAGES") or "1")
-    
-    final_organic = MAX_RANK
-    final_ad = MAX_RANK
-    
+@dataclass
+class KeywordScan:
+    """一个关键词的抓取结果。found_pages 中 0 表示在搜索深度内没找到。"""
+
+    ranks: dict[str, tuple[int, int]]
+    found_pages: dict[str, tuple[int, int]]
+    pages_fetched: int
+
+
+def _max_pages() -> int:
+    return int(get_env("AMZ_KEYWORD_MAX_PAGES") or "1")
+
+
+def scan_keyword(
+    keyword: str,
+    asins: list[str],
+    page_delay: bool = True,
+    fetch_page: Callable[[str, int], str | None] | None = None,
+    depths: dict[str, int] | None = None,
+) -> KeywordScan:
+    """
+    每个搜索结果页只抓取、解析一次，从同一页里同时解析所有 ASIN 的自然位/广告位；
+    只要还有 ASIN 没找到（且没超过它的 depths 深度）就继续翻页，全部找到后提前结束。
+    fetch_page(keyword, page) 默认实时抓取 Amazon，重新解析缓存时传入读缓存的函数。
+    """
+    fetch_page = fetch_page or (lambda kw, p: get_amazon_page(kw, page=p))
+    max_pages = _max_pages()
+    depths = depths or {}
+
+    organic = {a: MAX_RANK for a in asins}
+    ad = {a: MAX_RANK for a in asins}
+    organic_page = {a: 0 for a in asins}
+    ad_page = {a: 0 for a in asins}
+
     organic_offset = 0
     ad_offset = 0
+    fetched = 0
 
     for p in range(1, max_pages + 1):
-        if p > 1:
-            # 翻页节流
+        # 还需要看这一页的 ASIN（未找到，且自适应深度允许）
+        pending = [
+            a for a in asins
+            if (organic[a] == MAX_RANK or ad[a] == MAX_RANK) and depths.get(a, max_pages) >= p
+        ]
+        if not pending:
+            break
+
+        if p > 1 and page_delay:
+            # 翻页节流（并发模式下由令牌桶统一控制速率）
             time.sleep(random.uniform(1, 2))
-            
-        html = get_amazon_page(keyword, page=p)
+
+        html = fetch_page(keyword, p)
         if not html:
             break
+        fetched += 1
+
+        # 一次遍历得到本页的自然位/广告位位置表，之后每个 ASIN 都是字典查找
+        serp = SerpPage.from_html(html)
+
+        for a in pending:
+            if organic[a] == MAX_RANK:
+                found = serp.organic_rank(a, offset=organic_offset)
+                if found:
+                    organic[a], organic_page[a] = found, p
+            if ad[a] == MAX_RANK:
+                found = serp.ad_rank(a, offset=ad_offset)
+                if found:
+                    ad[a], ad_page[a] = found, p
+
+        # 累加这一页的自然/广告结果总数（用于下一页的 offset）
+        organic_offset += serp.organic_count
+        ad_offset += serp.sponsored_count
+
+    return KeywordScan(
+        ranks={a: (organic[a], ad[a]) for a in asins},
+        found_pages={a: (organic_page[a], ad_page[a]) for a in asins},
+        pages_fetched=fetched,
+    )
 
-        soup = BeautifulSoup(html, "html.parser")
-        
-        # 找自然位
-        if final_organic == MAX_RANK:
-            found_org = extract_organic_rank(soup, asin, offset=organic_offset)
-            if found_org:
-                final_organic = found_org
-            else:
-                # 累加这一页的自然结果总数（用于下一页的 offset）
-                page_results = soup.select("div[data-asin]")
-                page_organic_count = 0
-                for r in page_results:
-                    asin_v = r.get("data-asin")
-                    if asin_v and len(asin_v) > 5:
-                        c = " ".join(r.get("class", []))
-                        if "AdHolder" not in c and "sp-sponsored-result" not in c:
-                            page_organic_count += 1
-                organic_offset += page_organic_count
-
-        # 找广告位
-        if final_ad == MAX_RANK:
-            found_ad = extract_ad_rank(soup, asin, offset=ad_offset)
-            if found_ad:
-                final_ad = found_ad
-            else:
-                # 累加这一页的广告结果总数
-                page_ads = soup.select("div[data-component-type='s-search-result'], div.AdHolder")
-                page_ad_count = 0
-                for a in page_ads:
-                    if a.get("data-asin"):
-                        c = " ".join(a.get("class", []))
-                        is_sp = "AdHolder" in c or "sp-sponsored-result" in c
-                        if not is_sp:
-                            label = a.select_one(".puis-label-popover-default, .s-label-popover-default, .s-sponsored-label-info-icon")
-                            if label and any(kw in label.get_text() for kw in ["スポンサー", "Sponsored"]):
-                                is_sp = True
-                        if is_sp:
-                            page_ad_count += 1
-                ad_offset += page_ad_count
-
-        # 如果两个都找到了，提前结束翻页
-        if final_organic != MAX_RANK and final_ad != MAX_RANK:
-            break
-            
-    return final_organic, final_ad
+
+def get_ranks_for_asins(
+    keyword: str,
+    asins: list[str],
+    page_delay: bool = True,
+    fetch_page: Callable[[str, int], str | None] | None = None,
+) -> dict[str, tuple[int, int]]:
+    return scan_keyword(keyword, asins, page_delay=page_delay, fetch_page=fetch_page).ranks
+
+
+def get_ranks(keyword: str, asin: str, page_delay: bool = True) -> tuple[int, int]:
+    return get_ranks_for_asins(keyword, [asin], page_delay=page_delay)[asin]
 
 
 # =========================
 # 生成记录
 # =========================
-def create_log(brand, asin, product, keyword, rank_type, rank, start_time: str = ""):
+def create_log(brand, asin, product, keyword, rank_type, rank, start_time: str = "", date: str = ""):
     now = datetime.now(JST)
-    today = now.strftime("%Y-%m-%d")
+    today = date or now.strftime("%Y-%m-%d")
     current_time = start_time or now.strftime("%H:%M:%S")
     # 生成唯一 ID 防止 Lark Base 同步冲突
     uid = f"{today}_{asin}_{keyword}_{rank_type}"
@@ -332,6 +353,14 @@ def create_log(brand, asin, product, keyword, rank_type, rank, start_time: str =
     }
 
 
+def _save_history(logs: list[dict[str, Any]]) -> None:
+    """写入本地排名历史库；失败只告警，不影响写飞书。"""
+    try:
+        get_rank_history().append(logs)
+    except Exception as e:
+        print(f"[WARN] failed to save rank history: {e}")
+
+
 # =========================
 # 写入飞书 Sheet（纵向追加）
 # =========================
@@ -357,17 +386,6 @@ def _append_logs_to_lark(
         token = _get_tenant_access_token()
         sheet_id = _resolve_sheet_id(token, spreadsheet_token, title)
 
-        # 读取 A 列，计算当前已有行数，用于确定追加的起始行
-        rng = f"{sheet_id}!A:A"
-        data = _batch_get(token, spreadsheet_token, [rng])
-        vr = data.get("data", {}).get("valueRanges", [])
-        rows = (vr[0].get("values") if vr else None) or []
-
-        # values 的长度 = 已用行数（含表头），下一行 = len + 1
-        next_row = len(rows) + 1
-        if next_row <= HEADER_ROW:
-            next_row = HEADER_ROW + 1
-
         values = [
             [
                 log["id"],
@@ -383,96 +401,270 @@ def _append_logs_to_lark(
             for log in logs
         ]
 
-        start_row = next_row
-        end_row = next_row + len(values) - 1
-        cell_range = f"{sheet_id}!A{start_row}:I{end_row}"
+        write_behind = get_write_behind()
+        if write_behind is not None:
+            # 交给后台写入队列，按记录 id 去重后与其他任务的写入一起合并写回
+            queued = write_behind.put_rows(spreadsheet_token, sheet_id, "I", values)
+            return {
+                "success": True,
+                "message": f"已排队 {queued} 行，稍后写入飞书 Sheet '{title}'",
+                "updated_cells": queued * 9,
+            }
 
-        _batch_update(
-            token,
-            spreadsheet_token,
-            [
-                {
-                    "range": cell_range,
-                    "values": values,
-                }
-            ],
-        )
+        # 分块追加到末尾（values_append + 本地行游标），不再每次读取整列 A
+        res = _append_rows(token, spreadsheet_token, sheet_id, values, last_col="I")
         return {
             "success": True,
-            "message": f"已追加 {len(values)} 行到飞书 Sheet '{title}'",
-            "updated_cells": len(values) * 9,
+            "message": f"已追加 {res['rows']} 行到飞书 Sheet '{title}'（{res['requests']} 次写入请求）",
+            "updated_cells": res["rows"] * 9,
         }
     except Exception as e:
         return {"success": False, "message": str(e), "updated_cells": 0}
 
 
 # =========================
-# 对外入口：关键词追踪并写入飞书
+# 按关键词分组抓取
 # =========================
-def run_keyword_tracking(sheet_title: str = None, dry_run: bool = False) -> dict[str, Any]:
+def _group_by_keyword(pairs: list[dict]) -> dict[str, list[str]]:
+    """keyword -> 该关键词下需要追踪的 ASIN（去重，保持 Master 表顺序）。"""
+    groups: dict[str, list[str]] = {}
+    for k in pairs:
+        asins = groups.setdefault(k["keyword"], [])
+        if k["asin"] not in asins:
+            asins.append(k["asin"])
+    return groups
+
+
+def _track_keyword(
+    keyword: str, asins: list[str], page_delay: bool = True, planner: DepthPlanner | None = None
+) -> KeywordScan:
+    print("checking:", keyword, "|", len(asins), "ASIN(s) |", ", ".join(asins))
+    max_pages = _max_pages()
+    depths = {a: planner.plan(a, keyword, max_pages) for a in asins} if planner else None
+    scan = scan_keyword(keyword, asins, page_delay=page_delay, depths=depths)
+    if planner:
+        for a in asins:
+            planner.record(a, keyword, *scan.found_pages[a], max_pages=max_pages)
+    return scan
+
+
+def _iter_keyword_scans(
+    groups: dict[str, list[str]], workers: int = 1, planner: DepthPlanner | None = None
+) -> Iterator[tuple[str, KeywordScan] | None]:
     """
-    抓取关键词排名，并按品牌分 Sheet 写入：
-    - brand 列为空的归到 "UNKNOWN"
-    - 每个 brand 对应一个 Sheet（同一个 spreadsheet 下）
+    按 Master 顺序逐个产出 (keyword, KeywordScan)。
+    workers > 1 时用线程池并发抓取，只保持 workers*2 个任务在途（内存不随关键词数增长），
+    等待结果期间产出 None 作为心跳。生成器被关闭时取消尚未开始的任务。
+    """
+    if workers == 1:
+        for i, (keyword, asins) in enumerate(groups.items()):
+            if i:
+                # 简单节流，避免请求过快
+                time.sleep(random.uniform(2, 4))
+            yield keyword, _track_keyword(keyword, asins, planner=planner)
+        return
+
+    print(f"[INFO] concurrent mode: workers={workers} rpm={_amazon_limiter().rate_per_minute:.0f}")
+    pool = ThreadPoolExecutor(max_workers=workers)
+    window: deque[tuple[str, Future]] = deque()
+    items = iter(groups.items())
+    try:
+        while True:
+            while len(window) < workers * 2:
+                nxt = next(items, None)
+                if nxt is None:
+                    break
+                keyword, asins = nxt
+                window.append((keyword, pool.submit(_track_keyword, keyword, asins, False, planner)))
+            if not window:
+                return
+            keyword, fut = window[0]
+            while not wait([fut], timeout=1.0).done:
+                yield None
+            window.popleft()
+            yield keyword, fut.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+# =========================
+# 对外入口：流式关键词追踪（逐组产出进度，滚动写入飞书）
+# =========================
+def run_keyword_tracking_generator(
+    sheet_title: str | None = None,
+    dry_run: bool = False,
+    concurrency: int | None = None,
+    rpm: float | None = None,
+    adaptive: bool | None = None,
+    cancel: threading.Event | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    流式的关键词追踪，实时 yield 进度供前端显示与手动取消：
+    - 每完成一组 (ASIN, keyword) 产出一条 progress（含该组的两条 logs）
+    - 每攒够 AMZ_KEYWORD_FLUSH_ROWS 条记录就追加写入飞书，内存不随 Master 行数增长
+    - cancel 被 set 或生成器被关闭（客户端断开）时停止抓取，已抓到的记录仍会写入飞书
     """
     # 捕获全局开始时间
     start_time_str = datetime.now(JST).strftime("%H:%M:%S")
-    
+    started = time.monotonic()
+    workers = max(int(concurrency or KEYWORD_CONCURRENCY), 1)
+    if adaptive is None:
+        adaptive = KEYWORD_ADAPTIVE
+
     keywords = load_keywords_from_lark()
     if not keywords:
-        return {
-            "success": False,
-            "message": "未能从飞书 Master 表中读取到关键词配置，退出执行",
-            "updated_cells": 0,
-        }
+        yield {"type": "error", "message": "未能从飞书 Master 表中读取到关键词配置，退出执行", "updated_cells": 0}
+        return
 
-    by_brand: dict[str, list[dict[str, Any]]] = {}
+    pairs = [k for k in keywords if k.get("asin", "") and k.get("keyword", "")]
+    groups = _group_by_keyword(pairs)
+    pairs_by_keyword: dict[str, list[dict]] = {}
+    for k in pairs:
+        pairs_by_keyword.setdefault(k["keyword"], []).append(k)
 
-    for k in keywords:
-        brand = (k.get("brand") or "").strip() or "UNKNOWN"
-        asin = k.get("asin", "")
-        product = k.get("product", "")
-        keyword = k.get("keyword", "")
-
-        if not asin or not keyword:
-            continue
-
-        print("checking:", brand, "|", asin, "|", keyword)
-
-        organic_rank, ad_rank = get_ranks(keyword, asin)
-
-        by_brand.setdefault(brand, []).append(
-            create_log(
-                brand,
-                asin,
-                product,
-                keyword,
-                "organic",
-                organic_rank,
-                start_time=start_time_str,
-            )
-        )
+    # 書き込み先 sheet 名の決定:
+    # --sheet 指定あり → そのまま使用
+    # 指定なし → .env の FEISHU_KEYWORD_SHEET_NAME (デフォルト "KW追踪") に全ブランドまとめて書き込み
+    dest_sheet = sheet_title or (get_env("FEISHU_KEYWORD_SHEET_NAME") or "KW追踪")
+    planner = DepthPlanner() if adaptive else None
 
-        by_brand.setdefault(brand, []).append(
-            create_log(
-                brand,
-                asin,
-                product,
-                keyword,
-                "ad",
-                ad_rank,
-                start_time=start_time_str,
-            )
-        )
+    buffer: list[dict[str, Any]] = []
+    total_cells = 0
+    done_pairs = 0
+    pages = 0
+    # 写入失败过就不再在 finally 里重写同一批（避免重复写入、掩盖第一次的错误）
+    flush_error: Exception | None = None
+
+    def _flush() -> str | None:
+        nonlocal total_cells, flush_error
+        if dry_run or not buffer:
+            return None
+        _save_history(buffer)
+        try:
+            res = _append_logs_to_lark(buffer, sheet_title=dest_sheet)
+            print(f"-> {res.get('message')}")
+            if not res.get("success"):
+                raise RuntimeError(res.get("message"))
+        except Exception as e:
+            flush_error = e
+            raise
+        buffer.clear()
+        total_cells += int(res.get("updated_cells") or 0)
+        return res.get("message")
+
+    yield {"type": "progress", "message": f"共读取到 {len(pairs)} 组 ASIN/关键词（{len(groups)} 个关键词），开始查询..."}
+
+    limiter = _amazon_limiter()
+    default_rpm = limiter.rate_per_minute
+    if rpm:
+        # 令牌桶是整个进程共用的：rpm 只对本次运行生效，结束时在 finally 里恢复
+        limiter.set_rate(rpm)
+    scans = _iter_keyword_scans(groups, workers, planner)
+    try:
+        for item in scans:
+            if cancel is not None and cancel.is_set():
+                yield {"type": "progress", "message": "已取消，正在写入已抓取的结果..."}
+                break
+            if item is None:
+                yield {"type": "heartbeat"}
+                continue
 
-        # 简单节流，避免请求过快
-        time.sleep(random.uniform(2, 4))
+            keyword, scan = item
+            pages += scan.pages_fetched
+            for k in pairs_by_keyword[keyword]:
+                brand = (k.get("brand") or "").strip() or "UNKNOWN"
+                organic_rank, ad_rank = scan.ranks[k["asin"]]
+                logs = [
+                    create_log(brand, k["asin"], k.get("product", ""), keyword, "organic", organic_rank, start_time=start_time_str),
+                    create_log(brand, k["asin"], k.get("product", ""), keyword, "ad", ad_rank, start_time=start_time_str),
+                ]
+                buffer.extend(logs)
+                done_pairs += 1
+                yield {
+                    "type": "progress",
+                    "message": f"[{done_pairs}/{len(pairs)}] {brand} | {k['asin']} | {keyword} | 自然位 {organic_rank} | 广告位 {ad_rank}",
+                    "logs": logs,
+                }
 
-    all_logs = [log for logs in by_brand.values() for log in logs]
+            if len(buffer) >= KEYWORD_FLUSH_ROWS:
+                msg = _flush()
+                if msg:
+                    yield {"type": "progress", "message": msg}
+    except Exception as e:
+        yield {"type": "error", "message": str(e), "updated_cells": total_cells}
+        return
+    finally:
+        # 正常结束、取消、客户端断开都会走到这里：停止抓取，写入已抓到的结果
+        scans.close()
+        if rpm:
+            limiter.set_rate(default_rpm)
+        if planner:
+            planner.save()
+        if flush_error is None:
+            try:
+                _flush()
+            except Exception as e:
+                print(f"[ERROR] failed to flush keyword logs: {e}")
+
+    if flush_error is not None:
+        yield {"type": "error", "message": str(flush_error), "updated_cells": total_cells}
+        return
+
+    fetch_stats: dict[str, Any] = {
+        "pairs": done_pairs,
+        "keywords": len(groups),
+        "pages_fetched": pages,
+        "avg_pages_per_pair": round(pages / done_pairs, 2) if done_pairs else 0.0,
+    }
+    if planner:
+        depth = planner.stats()
+        fetch_stats.update({"probes": depth["probes"], "prediction_misses": depth["misses"], "miss_rate": depth["miss_rate"]})
+    print(
+        f"[INFO] checked {done_pairs} pairs in {time.monotonic() - started:.1f}s, fetch={fetch_stats}, "
+        f"sessions={get_session_stats()}, lark={get_sheets_client().stats()}"
+    )
 
     if dry_run:
+        message = f"dry-run: 共生成 {done_pairs * 2} 条排名记录"
+    elif not done_pairs:
+        message = "没有有效的关键词/ASIN 记录，未写入飞书"
+    else:
+        message = f"已写入到飞书 Sheet '{dest_sheet}'，更新了 {total_cells} 个单元格"
+    yield {"type": "done", "success": True, "message": message, "updated_cells": total_cells, "fetch_stats": fetch_stats}
+
+
+# 兼容旧同步方法的壳
+def run_keyword_tracking(
+    sheet_title: str = None,
+    dry_run: bool = False,
+    concurrency: int | None = None,
+    rpm: float | None = None,
+    adaptive: bool | None = None,
+) -> dict[str, Any]:
+    """
+    抓取关键词排名并追加写入飞书 Sheet（brand 列为空的归到 "UNKNOWN"）：
+    - 同一关键词下的多个 ASIN 共用一次翻页抓取
+    - concurrency > 1 时用线程池按关键词并发抓取，所有 worker 共享 amazon.co.jp 的令牌桶（rpm 次/分钟）；
+      结果按 Master 表顺序（同一关键词的 ASIN 连在一起）汇总，与串行模式一致
+    - adaptive 时按每组 (ASIN, keyword) 最近的排名历史决定翻页深度，定期做全深度探测校准
+    """
+    result: dict[str, Any] = {"success": False, "message": "Unknown error", "updated_cells": 0}
+    logs: list[dict[str, Any]] = []
+    for event in run_keyword_tracking_generator(sheet_title, dry_run, concurrency, rpm, adaptive):
+        if dry_run and event.get("logs"):
+            logs.extend(event["logs"])
+        if event["type"] in ("done", "error"):
+            result = {
+                "success": event.get("success", False) or event["type"] == "done",
+                "message": event.get("message", ""),
+                "updated_cells": event.get("updated_cells", 0),
+            }
+            if event.get("fetch_stats"):
+                result["fetch_stats"] = event["fetch_stats"]
+
+    if dry_run and result["success"]:
         # 仅返回结果，不写入飞书
-        results = [
+        result["results"] = [
             {
                 "row": i + 1,
                 "brand": log["brand"],
@@ -481,95 +673,83 @@ def run_keyword_tracking(sheet_title: str = None, dry_run: bool = False) -> dict
                 "type": log["rank_type"],
                 "position": log["rank"],
             }
-            for i, log in enumerate(all_logs)
+            for i, log in enumerate(logs)
         ]
-        return {
-            "success": True,
-            "message": f"dry-run: 共生成 {len(all_logs)} 条排名记录，{len(by_brand)} 个品牌",
-            "updated_cells": 0,
-            "results": results,
-        }
+    return result
 
-    if not all_logs:
-        return {
-            "success": True,
-            "message": "没有有效的关键词/ASIN 记录，未写入飞书",
-            "updated_cells": 0,
-        }
 
-    # 書き込み先 sheet 名の決定:
-    # --sheet 指定あり → そのまま使用
-    # 指定なし → .env の FEISHU_KEYWORD_SHEET_NAME (デフォルト "KW追踪") に全ブランドまとめて書き込み
-    dest_sheet = sheet_title or (get_env("FEISHU_KEYWORD_SHEET_NAME") or "KW追踪")
-
-    total_cells = 0
-    res = _append_logs_to_lark(all_logs, sheet_title=dest_sheet)
-    print(f"-> {res.get('message')}")
-    total_cells += int(res.get("updated_cells") or 0)
+# =========================
+# 离线重新解析：用缓存的 Master 配置和搜索页快照重建排名记录（不访问网络）
+# =========================
+def rebuild_keyword_logs_from_cache(day: str | None = None, sheet_title: str = "Master") -> dict[str, Any]:
+    store = get_html_store()
+    if store is None:
+        return {"success": False, "message": "HTML 缓存未启用（AMZ_HTML_CACHE=0）", "updated_cells": 0}
+
+    day = day or datetime.now(JST).strftime("%Y-%m-%d")
+    master = store.get("master", sheet_title, 0, day=day)
+    if not master:
+        return {"success": False, "message": f"缓存中没有 {day} 的 '{sheet_title}' 关键词配置", "updated_cells": 0}
+
+    pairs = [k for k in json.loads(master) if k.get("asin", "") and k.get("keyword", "")]
+    snapshots = store.list_snapshots("serp", day=day)
+    start_time = snapshots[0]["fetched_at"][11:19] if snapshots else ""
+
+    ranks: dict[tuple[str, str], tuple[int, int]] = {}
+    for keyword, asins in _group_by_keyword(pairs).items():
+        group_ranks = get_ranks_for_asins(
+            keyword,
+            asins,
+            page_delay=False,
+            fetch_page=lambda kw, p: store.get("serp", kw, p, day=day),
+        )
+        for asin, r in group_ranks.items():
+            ranks[(keyword, asin)] = r
 
+    logs: list[dict[str, Any]] = []
+    for k in pairs:
+        brand = (k.get("brand") or "").strip() or "UNKNOWN"
+        organic_rank, ad_rank = ranks[(k["keyword"], k["asin"])]
+        logs.append(create_log(brand, k["asin"], k.get("product", ""), k["keyword"], "organic", organic_rank, start_time=start_time, date=day))
+        logs.append(create_log(brand, k["asin"], k.get("product", ""), k["keyword"], "ad", ad_rank, start_time=start_time, date=day))
+
+    results = [
+        {
+            "row": i + 1,
+            "brand": log["brand"],
+            "asin": log["asin"],
+            "keyword": log["keyword"],
+            "type": log["rank_type"],
+            "position": log["rank"],
+        }
+        for i, log in enumerate(logs)
+    ]
     return {
         "success": True,
-        "message": f"已写入到飞书 Sheet '{dest_sheet}'，更新了 {total_cells} 个单元格",
-        "updated_cells": total_cells,
+        "message": f"reparse: 从缓存重建了 {day} 的 {len(logs)} 条排名记录（{len(snapshots)} 个页面快照）",
+        "updated_cells": 0,
+        "results": results,
+        "logs": logs,
     }
 
 
 # =========================
-# 兼容：本地运行仍写 CSV
+# 本地运行：写入本地排名历史库
 # =========================
 def main():
-    keywords = load_keywords_from_lark()
-    if not keywords:
-        print("未读取到关键词配置，退出。")
-        return
-
     logs: list[dict[str, Any]] = []
-
-    for k in keywords:
-        brand = k.get("brand", "")
-        asin = k.get("asin", "")
-        product = k.get("product", "")
-        keyword = k.get("keyword", "")
-
-        if not asin or not keyword:
-            continue
-
-        print("checking (CSV):", asin, "|", keyword)
-
-        organic_rank, ad_rank = get_ranks(keyword, asin)
-
-        logs.append(
-            create_log(
-                brand,
-                asin,
-                product,
-                keyword,
-                "organic",
-                organic_rank,
-            )
-        )
-
-        logs.append(
-            create_log(
-                brand,
-                asin,
-                product,
-                keyword,
-                "ad",
-                ad_rank,
-            )
-        )
-
-        time.sleep(random.uniform(2, 4))
+    for event in run_keyword_tracking_generator(dry_run=True):
+        logs.extend(event.get("logs") or [])
 
     if not logs:
-        print("no logs, skip csv")
+        print("no logs, skip history")
         return
 
-    df = pd.DataFrame(logs)
-    log_path = os.path.join(BASE_DIR, "rank_log.csv")
-
-    header = not os.path.exists(log_path)
-    df.to_csv(log_path, mode="a", header=header, index=False)
+    history = get_rank_history()
+    # 旧版本写在 rank_log.csv 里的记录，第一次运行时导入一次
+    imported = history.import_csv(os.path.join(BASE_DIR, "rank_log.csv"))
+    if imported:
+        print(f"imported {imported} rows from rank_log.csv")
+    history.append(logs)
 
-    print("done")
+    print(f"done, saved {len(logs)} rows to {history.path}")
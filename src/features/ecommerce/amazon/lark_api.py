@@ -1,128 +1,346 @@
+import json
+import os
+import re
+import threading
 import time
-import random
-from datetime import datetime, timezone, timedelta
-import requests
+from typing import Iterator
 
-from src.core.config_manager import get_env
+from src.core.config_manager import get_env, get_project_path
+from src.features.feishu.sheets_client import _cell_runs, _num_to_col, get_sheets_client, maybe_applied
+from src.features.feishu.write_behind import get_write_behind
 
 # ---------------------------------------------------------------------------
 # 配置
 # ---------------------------------------------------------------------------
-LARK_HOST = (get_env("LARK_HOST") or "https://open.larksuite.com").rstrip("/")
-LARK_RETRY = int(get_env("LARK_RETRY") or "3")
-LARK_RETRY_BASE_SLEEP = float(get_env("LARK_RETRY_BASE_SLEEP") or "1.5")
 HEADER_ROW = 1
-JST = timezone(timedelta(hours=9))
-
-def _today_header_text() -> str:
-    now = datetime.now(JST)
-    return f"{now.month}月{now.day}日"
-
-def _num_to_col(n: int) -> str:
-    s = ""
-    while n > 0:
-        n, r = divmod(n - 1, 26)
-        s = chr(r + ord("A")) + s
-    return s
-
-def _headers(token: str) -> dict:
-    return {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json; charset=utf-8",
-    }
-
-def _request_with_retry(fn, *, max_retry=LARK_RETRY, base_sleep=LARK_RETRY_BASE_SLEEP):
-    last_err = None
-    for attempt in range(1, max_retry + 1):
-        try:
-            return fn()
-        except Exception as e:
-            last_err = e
-            t = base_sleep * (1.6 ** (attempt - 1)) + random.uniform(0, 0.8)
-            print(f"[WARN] retry {attempt}/{max_retry} error={e} sleep={t:.1f}s")
-            time.sleep(t)
-    raise last_err
-
-def _list_sheets(token: str, spreadsheet_token: str) -> list[dict]:
-    url = f"{LARK_HOST}/open-apis/sheets/v3/spreadsheets/{spreadsheet_token}/sheets/query"
+# 追加写入时每次请求的最大行数（Lark 单次写入上限 5000 行）
+LARK_APPEND_CHUNK_ROWS = int(get_env("LARK_APPEND_CHUNK_ROWS") or "500")
+# 本地记录每个 sheet 已写到第几行（追加游标）
+SHEET_CURSOR_PATH = get_env("LARK_SHEET_CURSOR_PATH") or str(get_project_path("data", "sheet_cursors.json"))
+# 分页读取时每次请求的行数
+LARK_READ_BLOCK_ROWS = int(get_env("LARK_READ_BLOCK_ROWS") or "1000")
+# 逐格更新的缓冲：攒够多少行或多少秒写一次；单次请求最多多少个单元格
+LARK_UPDATE_FLUSH_ROWS = int(get_env("LARK_UPDATE_FLUSH_ROWS") or "50")
+LARK_UPDATE_FLUSH_SECONDS = float(get_env("LARK_UPDATE_FLUSH_SECONDS") or "30")
+LARK_UPDATE_MAX_CELLS = int(get_env("LARK_UPDATE_MAX_CELLS") or "5000")
 
-    def _call():
-        r = requests.get(url, headers=_headers(token), timeout=20)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-            except Exception:
-                j = r.text
-            raise RuntimeError(f"[LARK][list_sheets] status={r.status_code} body={j}")
-        data = r.json()
-        if data.get("code") != 0:
-            raise RuntimeError(f"[LARK][list_sheets] {data}")
-        return data.get("data", {}).get("sheets", [])
+def _col_to_num(col: str) -> int:
+    n = 0
+    for ch in col.upper():
+        n = n * 26 + ord(ch) - ord("A") + 1
+    return n
 
-    return _request_with_retry(_call)
+# ---------------------------------------------------------------------------
+# Lark Sheet API：统一走 feishu.sheets_client 的共享客户端（长连接 + 连接池 + 重试）
+# ---------------------------------------------------------------------------
+def _list_sheets(token: str, spreadsheet_token: str) -> list[dict]:
+    return get_sheets_client().list_sheets(token, spreadsheet_token)
 
 def _resolve_sheet_id(token: str, spreadsheet_token: str, title: str) -> str:
-    sheets = _list_sheets(token, spreadsheet_token)
-    for s in sheets:
-        if s.get("title") == title:
-            return s.get("sheet_id")
-    titles = [x.get("title") for x in sheets]
-    raise RuntimeError(f"[LARK] sheet title not found: '{title}'. existing titles={titles}")
+    return get_sheets_client().resolve_sheet_id(token, spreadsheet_token, title)
 
 def _batch_get(token: str, spreadsheet_token: str, ranges: list[str]) -> dict:
-    url = f"{LARK_HOST}/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values_batch_get"
+    return get_sheets_client().batch_get(token, spreadsheet_token, ranges)
 
-    def _call():
-        r = requests.get(url, headers=_headers(token), params={"ranges": ranges}, timeout=30)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-            except Exception:
-                j = r.text
-            raise RuntimeError(f"[LARK][batch_get] status={r.status_code} body={j}")
-        data = r.json()
-        if data.get("code") != 0:
-            raise RuntimeError(f"[LARK][batch_get] {data}")
-        return data
+def _batch_update(token: str, spreadsheet_token: str, updates: list[dict]) -> dict:
+    return get_sheets_client().batch_update(token, spreadsheet_token, updates)
 
-    return _request_with_retry(_call)
+def _ensure_today_col(token: str, spreadsheet_token: str, sheet_id: str) -> str:
+    return get_sheets_client().ensure_today_col(token, spreadsheet_token, sheet_id, HEADER_ROW)
 
-def _batch_update(token: str, spreadsheet_token: str, updates: list[dict]) -> dict:
-    url = f"{LARK_HOST}/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values_batch_update"
+def _values_append(token: str, spreadsheet_token: str, rng: str, values: list[list]) -> dict:
+    return get_sheets_client().values_append(token, spreadsheet_token, rng, values)
 
-    def _call():
-        body = {"valueInputOption": "RAW", "valueRanges": updates}
-        r = requests.post(url, headers=_headers(token), json=body, timeout=30)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-            except Exception:
-                j = r.text
-            raise RuntimeError(f"[LARK][batch_update] status={r.status_code} body={j}")
-        data = r.json()
-        if data.get("code") != 0:
-            raise RuntimeError(f"[LARK][batch_update] {data}")
-        return data
+# ---------------------------------------------------------------------------
+# 分页读取：按行块翻页直到数据结束，只请求需要的列
+# ---------------------------------------------------------------------------
+def iter_sheet_rows(
+    token: str,
+    spreadsheet_token: str,
+    sheet_id: str,
+    cols: list[str],
+    start_row: int = HEADER_ROW + 1,
+    block_rows: int = LARK_READ_BLOCK_ROWS,
+    max_rows: int | None = None,
+) -> Iterator[tuple[int, list]]:
+    """
+    逐行产出 (行号, [cols 各列的值])，每次只读取 block_rows 行。
+    相邻的列合并成一个 range 请求；整块都为空（或读满 max_rows 行）时结束，块内末尾的空行不产出。
+    """
+    nums = [_col_to_num(c) for c in cols]
+    spans: list[tuple[int, int]] = []
+    for n in sorted(set(nums)):
+        if spans and spans[-1][1] == n - 1:
+            spans[-1] = (spans[-1][0], n)
+        else:
+            spans.append((n, n))
+    block_rows = max(int(block_rows), 1)
+    last_row = start_row + max_rows - 1 if max_rows else None
 
-    return _request_with_retry(_call)
+    row = start_row
+    while last_row is None or row <= last_row:
+        end = row + block_rows - 1 if last_row is None else min(row + block_rows - 1, last_row)
+        ranges = [f"{sheet_id}!{_num_to_col(a)}{row}:{_num_to_col(b)}{end}" for a, b in spans]
+        data = _batch_get(token, spreadsheet_token, ranges)
+        vrs = data.get("data", {}).get("valueRanges", [])
 
-def _ensure_today_col(token: str, spreadsheet_token: str, sheet_id: str) -> str:
-    rng = f"{sheet_id}!A{HEADER_ROW}:ZZ{HEADER_ROW}"
-    data = _batch_get(token, spreadsheet_token, [rng])
+        size = end - row + 1
+        cells: dict[int, list] = {n: [None] * size for n in nums}
+        for (a, b), vr in zip(spans, vrs):
+            for i, values in enumerate(((vr.get("values") if vr else None) or [])[:size]):
+                for j, v in enumerate((values or [])[: b - a + 1]):
+                    if a + j in cells:
+                        cells[a + j][i] = v
+        block = [[cells[n][i] for n in nums] for i in range(size)]
+        filled = [i for i, values in enumerate(block) if any(not _cell_empty(v) for v in values)]
+        if not filled:
+            return
+        for i in range(filled[-1] + 1):
+            yield row + i, block[i]
+        row = end + 1
+
+def read_sheet_header(token: str, spreadsheet_token: str, sheet_id: str, header_row: int = HEADER_ROW) -> list[str]:
+    """读取表头行（TTL 内走元数据缓存），返回去掉空白、转为小写的表头文字。"""
+    row = get_sheets_client().header_row(token, spreadsheet_token, sheet_id, header_row)
+    return [str(h).strip().lower() if h is not None else "" for h in row]
+
+def iter_sheet_records(
+    token: str,
+    spreadsheet_token: str,
+    sheet_id: str,
+    columns: list[str],
+    required: tuple[str, ...] = (),
+    header_row: int = HEADER_ROW,
+    block_rows: int = LARK_READ_BLOCK_ROWS,
+    max_rows: int | None = None,
+) -> Iterator[tuple[int, dict]]:
+    """
+    按表头名（不区分大小写）投影读取：逐行产出 (行号, {表头名: 值})，只请求 columns 里存在的列。
+    required 中的表头不存在时抛出 ValueError。
+    """
+    headers = read_sheet_header(token, spreadsheet_token, sheet_id, header_row)
+    found = {name: _num_to_col(headers.index(name.lower()) + 1) for name in columns if name.lower() in headers}
+    missing = [name for name in required if name not in found]
+    if missing:
+        raise ValueError(f"sheet header must contain {missing}, got {headers}")
+    if not found:
+        return
+    names = list(found)
+    for row_no, values in iter_sheet_rows(
+        token, spreadsheet_token, sheet_id, [found[n] for n in names],
+        start_row=header_row + 1, block_rows=block_rows, max_rows=max_rows,
+    ):
+        yield row_no, dict(zip(names, values))
+
+# ---------------------------------------------------------------------------
+# 追加游标：本地记录最后写入的行号，下次只校验两格即可确定追加位置
+# ---------------------------------------------------------------------------
+_CURSOR_LOCK = threading.Lock()
+
+def _cursor_key(spreadsheet_token: str, sheet_id: str) -> str:
+    return f"{spreadsheet_token}:{sheet_id}"
+
+def _load_cursors() -> dict:
+    try:
+        with open(SHEET_CURSOR_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _get_cursor(spreadsheet_token: str, sheet_id: str) -> int | None:
+    with _CURSOR_LOCK:
+        return _load_cursors().get(_cursor_key(spreadsheet_token, sheet_id))
+
+def _set_cursor(spreadsheet_token: str, sheet_id: str, last_row: int) -> None:
+    with _CURSOR_LOCK:
+        cursors = _load_cursors()
+        cursors[_cursor_key(spreadsheet_token, sheet_id)] = last_row
+        os.makedirs(os.path.dirname(SHEET_CURSOR_PATH), exist_ok=True)
+        tmp = f"{SHEET_CURSOR_PATH}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cursors, f)
+        os.replace(tmp, SHEET_CURSOR_PATH)
+
+def _cell_empty(v) -> bool:
+    return v is None or str(v).strip() == ""
+
+def _next_free_row(token: str, spreadsheet_token: str, sheet_id: str) -> int:
+    """优先用本地游标（只读两格校验），游标失效时才回退为读取整列 A。"""
+    cursor = _get_cursor(spreadsheet_token, sheet_id)
+    if cursor and cursor >= HEADER_ROW:
+        data = _batch_get(token, spreadsheet_token, [f"{sheet_id}!A{cursor}:A{cursor + 1}"])
+        vr = data.get("data", {}).get("valueRanges", [])
+        cells = [(r[0] if r else None) for r in ((vr[0].get("values") if vr else None) or [])]
+        cells += [None] * (2 - len(cells))
+        if not _cell_empty(cells[0]) and _cell_empty(cells[1]):
+            return cursor + 1
+        print(f"[WARN] sheet cursor row {cursor} is stale, rescanning column A")
+
+    data = _batch_get(token, spreadsheet_token, [f"{sheet_id}!A:A"])
     vr = data.get("data", {}).get("valueRanges", [])
-    row = ((vr[0].get("values") if vr else None) or [[]])[0]
-    today = _today_header_text()
-    last = 0
-    for i, v in enumerate(row):
-        sv = str(v).strip() if v is not None else ""
-        if sv:
-            last = i + 1
-        if sv == today:
-            return _num_to_col(i + 1)
-    target = last + 1
-    col = _num_to_col(target)
-    _batch_update(token, spreadsheet_token, [{
-        "range": f"{sheet_id}!{col}{HEADER_ROW}:{col}{HEADER_ROW}",
-        "values": [[today]],
-    }])
-    return col
+    rows = (vr[0].get("values") if vr else None) or []
+    return max(len(rows) + 1, HEADER_ROW + 1)
+
+def _updated_end_row(resp: dict) -> int | None:
+    rng = (resp.get("data", {}).get("updates") or {}).get("updatedRange") or ""
+    m = re.search(r"(\d+)$", rng)
+    return int(m.group(1)) if m else None
+
+def _append_rows(
+    token: str,
+    spreadsheet_token: str,
+    sheet_id: str,
+    values: list[list],
+    last_col: str,
+    chunk_rows: int = LARK_APPEND_CHUNK_ROWS,
+) -> dict:
+    """
+    分块追加多行到 sheet 末尾：
+    - 优先使用 values_append 接口，并用返回的 updatedRange 更新本地游标
+    - values_append 不会在超时时自动重试；结果不明时按第一列的行 id 确认是否已写入
+    - 接口不可用时回退为 游标定位 + values_batch_update
+    返回 {"rows": 写入行数, "requests": 写入请求次数, "last_row": 最后一行行号}
+    """
+    chunk_rows = max(int(chunk_rows), 1)
+    written = 0
+    requests_made = 0
+    last_row = None
+    use_append = True
+    next_row = None
+
+    for i in range(0, len(values), chunk_rows):
+        chunk = values[i:i + chunk_rows]
+        if use_append:
+            try:
+                resp = _values_append(token, spreadsheet_token, f"{sheet_id}!A:{last_col}", chunk)
+                requests_made += 1
+                last_row = _updated_end_row(resp)
+                if last_row:
+                    _set_cursor(spreadsheet_token, sheet_id, last_row)
+                written += len(chunk)
+                continue
+            except Exception as e:
+                # 超时等结果不明的失败：这批行可能已经写进去了，先按行 id 确认，避免重复追加
+                landed = (
+                    get_sheets_client().appended_end_row(token, spreadsheet_token, sheet_id, chunk)
+                    if maybe_applied(e) else None
+                )
+                if landed:
+                    print(f"[WARN] values_append failed but rows already landed (last row {landed}): {e}")
+                    requests_made += 1
+                    last_row = landed
+                    _set_cursor(spreadsheet_token, sheet_id, last_row)
+                    written += len(chunk)
+                    continue
+                print(f"[WARN] values_append failed, fallback to cursor + batch_update: {e}")
+                use_append = False
+
+        if next_row is None:
+            next_row = _next_free_row(token, spreadsheet_token, sheet_id)
+        end_row = next_row + len(chunk) - 1
+        _batch_update(token, spreadsheet_token, [{
+            "range": f"{sheet_id}!A{next_row}:{last_col}{end_row}",
+            "values": chunk,
+        }])
+        requests_made += 1
+        _set_cursor(spreadsheet_token, sheet_id, end_row)
+        written += len(chunk)
+        last_row = end_row
+        next_row = end_row + 1
+
+    return {"rows": written, "requests": requests_made, "last_row": last_row}
+
+# ---------------------------------------------------------------------------
+# 单元格更新缓冲：按列合并相邻行为一个 range，定量 / 定时分批写入
+# ---------------------------------------------------------------------------
+class SheetUpdateBuffer:
+    """
+    收集 (行, 列) -> 值 的单元格更新，同一单元格以最后一次为准。
+    flush() 时把同一列里连续的行合并成一个 range（如 G2:G57），
+    按 max_cells 分块调用 values_batch_update；写入失败时保留未写入的单元格。
+    开启 LARK_WRITE_BEHIND 时 flush() 只把单元格交给后台写入队列（落盘后即视为已写入）。
+    """
+
+    def __init__(
+        self,
+        token: str,
+        spreadsheet_token: str,
+        sheet_id: str,
+        flush_rows: int = LARK_UPDATE_FLUSH_ROWS,
+        flush_seconds: float = LARK_UPDATE_FLUSH_SECONDS,
+        max_cells: int = LARK_UPDATE_MAX_CELLS,
+    ):
+        self.token = token
+        self.spreadsheet_token = spreadsheet_token
+        self.sheet_id = sheet_id
+        self.flush_rows = max(int(flush_rows), 1)
+        self.flush_seconds = flush_seconds
+        self.max_cells = max(int(max_cells), 1)
+        self._cells: dict[tuple[str, int], object] = {}
+        self._last_flush = time.monotonic()
+        self._stats = {"cells": 0, "ranges": 0, "requests": 0, "bytes": 0, "flushes": 0}
+
+    def set(self, row: int, col: str, value) -> None:
+        self._cells[(col, row)] = value
+
+    @property
+    def pending_rows(self) -> int:
+        return len({row for _, row in self._cells})
+
+    def due(self) -> bool:
+        if not self._cells:
+            return False
+        if self.pending_rows >= self.flush_rows:
+            return True
+        return self.flush_seconds > 0 and time.monotonic() - self._last_flush >= self.flush_seconds
+
+    def _runs(self) -> list[tuple[str, int, list]]:
+        """按列、行排序后把连续的行合并为 (列, 起始行, 值列表)，单段不超过 max_cells。"""
+        return _cell_runs(self._cells, self.max_cells)
+
+    def flush(self) -> dict[str, int]:
+        """写入全部待写单元格，返回本次的 {"cells", "ranges", "requests", "bytes"}。"""
+        self._last_flush = time.monotonic()
+        result = {"cells": 0, "ranges": 0, "requests": 0, "bytes": 0}
+        if not self._cells:
+            return result
+
+        write_behind = get_write_behind()
+        if write_behind is not None:
+            result["cells"] = write_behind.put_cells(self.spreadsheet_token, self.sheet_id, self._cells)
+            self._cells.clear()
+            self._stats["cells"] += result["cells"]
+            self._stats["flushes"] += 1
+            return result
+
+        chunks: list[list[tuple[str, int, list]]] = [[]]
+        chunk_cells = 0
+        for run in self._runs():
+            if chunks[-1] and chunk_cells + len(run[2]) > self.max_cells:
+                chunks.append([])
+                chunk_cells = 0
+            chunks[-1].append(run)
+            chunk_cells += len(run[2])
+
+        try:
+            for chunk in chunks:
+                value_ranges = [
+                    {"range": f"{self.sheet_id}!{col}{start}:{col}{start + len(values) - 1}", "values": [[v] for v in values]}
+                    for col, start, values in chunk
+                ]
+                _batch_update(self.token, self.spreadsheet_token, value_ranges)
+                for col, start, values in chunk:
+                    for row in range(start, start + len(values)):
+                        self._cells.pop((col, row), None)
+                result["cells"] += sum(len(values) for _, _, values in chunk)
+                result["ranges"] += len(chunk)
+                result["requests"] += 1
+                result["bytes"] += len(json.dumps({"valueInputOption": "RAW", "valueRanges": value_ranges}).encode("utf-8"))
+        finally:
+            for k, v in result.items():
+                self._stats[k] += v
+            self._stats["flushes"] += 1
+        return result
+
+    def stats(self) -> dict[str, int]:
+        return dict(self._stats)
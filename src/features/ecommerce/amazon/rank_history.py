@@ -0,0 +1,163 @@
+"""
+关键词排名的本地历史库（SQLite），替代不断增长的 rank_log.csv。
+和 CSV 一样保留每一次运行：主键为 (id, time)，id = 日期 + ASIN + 关键词 + 类型，time 为该次运行的开始时间；
+同一天跑多次都会留下，query(latest=True) 只取每天最后一次。
+按 (asin, keyword, date) 和 date 建索引，查询只读取需要的日期范围和列。
+默认路径 data/rank_history.sqlite，可用 AMZ_RANK_HISTORY_PATH 修改。
+"""
+from __future__ import annotations
+
+import csv
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+from src.core.config_manager import get_env, get_project_path
+
+RANK_HISTORY_PATH = get_env("AMZ_RANK_HISTORY_PATH") or str(get_project_path("data", "rank_history.sqlite"))
+
+COLUMNS = ("id", "date", "time", "brand", "asin", "product", "keyword", "rank_type", "rank")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS keyword_ranks (
+    id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL DEFAULT '',
+    brand TEXT,
+    asin TEXT NOT NULL,
+    product TEXT,
+    keyword TEXT NOT NULL,
+    rank_type TEXT NOT NULL,
+    rank INTEGER,
+    PRIMARY KEY (id, time)
+);
+CREATE INDEX IF NOT EXISTS idx_keyword_ranks_pair ON keyword_ranks (asin, keyword, date);
+CREATE INDEX IF NOT EXISTS idx_keyword_ranks_date ON keyword_ranks (date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class RankHistoryStore:
+    def __init__(self, path: str | Path = RANK_HISTORY_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._migrate()
+        self._db.executescript(_SCHEMA)
+
+    def _migrate(self) -> None:
+        """旧版本以 id 为主键（同一天的多次运行互相覆盖），改成 (id, time) 主键，保留已有记录。"""
+        pk = [r[1] for r in sorted(self._db.execute("PRAGMA table_info(keyword_ranks)"), key=lambda r: r[5]) if r[5]]
+        if pk != ["id"]:
+            return
+        cols = ", ".join(COLUMNS)
+        select = ", ".join("COALESCE(time, '')" if c == "time" else c for c in COLUMNS)
+        with self._db:
+            self._db.execute("ALTER TABLE keyword_ranks RENAME TO keyword_ranks_old")
+            self._db.execute("DROP INDEX IF EXISTS idx_keyword_ranks_pair")
+            self._db.execute("DROP INDEX IF EXISTS idx_keyword_ranks_date")
+        self._db.executescript(_SCHEMA)
+        with self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO keyword_ranks ({cols}) SELECT {select} FROM keyword_ranks_old"
+            )
+            self._db.execute("DROP TABLE keyword_ranks_old")
+
+    def append(self, logs: Iterable[dict[str, Any]]) -> int:
+        """
+        写入 create_log() 生成的记录。每次运行（time 不同）各保留一份；
+        同一次运行重复写入（id 和 time 都相同）时以最后一次为准。
+        """
+        rows = [tuple(log.get(c) if c != "time" else (log.get(c) or "") for c in COLUMNS) for log in logs]
+        if not rows:
+            return 0
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO keyword_ranks ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+            self._db.commit()
+        return len(rows)
+
+    def query(
+        self,
+        start: str | None = None,
+        end: str | None = None,
+        asin: str | None = None,
+        keyword: str | None = None,
+        rank_type: str | None = None,
+        columns: Iterable[str] | None = None,
+        latest: bool = False,
+    ) -> list[dict[str, Any]]:
+        """
+        按日期范围（YYYY-MM-DD，含两端）/ ASIN / 关键词 / 类型查询，只返回 columns 指定的列。
+        默认返回每一次运行的记录；latest=True 时同一天同一组只取最后一次运行。
+        """
+        cols = list(columns or COLUMNS)
+        unknown = [c for c in cols if c not in COLUMNS]
+        if unknown:
+            raise ValueError(f"unknown columns: {unknown}")
+
+        where: list[str] = []
+        params: list[Any] = []
+        for col, op, value in (
+            ("asin", "=", asin),
+            ("keyword", "=", keyword),
+            ("rank_type", "=", rank_type),
+            ("date", ">=", start),
+            ("date", "<=", end),
+        ):
+            if value is not None:
+                where.append(f"{col} {op} ?")
+                params.append(value)
+
+        if latest:
+            where.append("time = (SELECT MAX(k.time) FROM keyword_ranks k WHERE k.id = keyword_ranks.id)")
+
+        sql = f"SELECT {', '.join(cols)} FROM keyword_ranks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date, time"
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [dict(zip(cols, r)) for r in rows]
+
+    def query_frame(self, **kwargs):
+        """同 query()，返回 pandas DataFrame，便于做分析。"""
+        import pandas as pd
+
+        columns = list(kwargs.get("columns") or COLUMNS)
+        return pd.DataFrame(self.query(**kwargs), columns=columns)
+
+    def import_csv(self, csv_path: str | Path) -> int:
+        """导入旧的 rank_log.csv；同一个文件只导入一次。"""
+        csv_path = Path(csv_path)
+        if not csv_path.exists():
+            return 0
+        marker = f"csv_imported:{csv_path.resolve()}"
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return 0
+        with open(csv_path, encoding="utf-8", newline="") as f:
+            count = self.append(csv.DictReader(f))
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (marker, str(count)))
+            self._db.commit()
+        return count
+
+
+_STORE: RankHistoryStore | None = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_rank_history() -> RankHistoryStore:
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = RankHistoryStore()
+        return _STORE
@@ -4,27 +4,36 @@ Amazon 日本站排名同步到飞书电子表格。
 """
 from __future__ import annotations
 
+import heapq
 import re
 import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta
+from typing import Iterator
 
 import requests
-from bs4 import BeautifulSoup
 
 from src.core.config_manager import get_env
+from src.core.html_parser import make_soup
+from src.core.rate_limiter import CircuitBreaker, TokenBucket, get_host_breaker, get_host_limiter
 from src.features.feishu.bot_client import _get_tenant_access_token
+from src.features.feishu.sheets_client import get_sheets_client
+from .checkpoint import RankSyncCheckpoint, prune_checkpoints
+from .html_cache import get_html_store, save_snapshot
+from .lark_api import SheetUpdateBuffer, _ensure_today_col, _resolve_sheet_id, iter_sheet_rows
+from .session_pool import AmazonSessionPool
 
 # ---------------------------------------------------------------------------
 # 配置
 # ---------------------------------------------------------------------------
-LARK_HOST = (get_env("LARK_HOST") or "https://open.larksuite.com").rstrip("/")
-
-HEADER_ROW = 1
 DATA_START_ROW = 2
 ASIN_COL = "A"
 AMZ_CAT_COL = "F"
-MAX_ROWS = int(get_env("MAX_ROWS") or "200")
+# 最多读取多少行 ASIN；不设置则读到数据末尾
+MAX_ROWS = int(get_env("MAX_ROWS") or "0") or None
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36",
@@ -32,124 +41,53 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122 Safari/537.36",
 ]
 
-LARK_RETRY = int(get_env("LARK_RETRY") or "3")
-LARK_RETRY_BASE_SLEEP = float(get_env("LARK_RETRY_BASE_SLEEP") or "1.5")
 AMZ_TRY = int(get_env("AMZ_TRY") or "2")
 AMZ_SLEEP_MIN = float(get_env("AMZ_SLEEP_MIN") or "2.0")
 AMZ_SLEEP_MAX = float(get_env("AMZ_SLEEP_MAX") or "6.0")
+# 抓取失败的 ASIN 放到队尾，冷却 AMZ_RETRY_BASE_DELAY * 2^(n-1) 秒后再抓
+AMZ_RETRY_BASE_DELAY = float(get_env("AMZ_RETRY_BASE_DELAY") or "30")
+AMZ_RETRY_MAX_DELAY = float(get_env("AMZ_RETRY_MAX_DELAY") or "600")
+# 最近 AMZ_BREAKER_WINDOW 次请求中被拦截的比例超过阈值时，暂停所有抓取 AMZ_BREAKER_COOLDOWN 秒
+AMZ_BREAKER_WINDOW = int(get_env("AMZ_BREAKER_WINDOW") or "20")
+AMZ_BREAKER_THRESHOLD = float(get_env("AMZ_BREAKER_THRESHOLD") or "0.5")
+AMZ_BREAKER_COOLDOWN = float(get_env("AMZ_BREAKER_COOLDOWN") or "120")
+BLOCK_STATUSES = ("HTTP_403", "HTTP_429", "HTTP_503", "CAPTCHA?")
+
+# 并发抓取：worker 数；请求预算与关键词追踪共用 amazon.co.jp 的令牌桶（AMZ_RPM / AMZ_BURST）
+AMZ_HOST = "www.amazon.co.jp"
+RANK_CONCURRENCY = int(get_env("AMZ_RANK_CONCURRENCY") or "1")
+AMZ_RPM = float(get_env("AMZ_RPM") or "20")
+AMZ_BURST = int(get_env("AMZ_BURST") or "2")
 
 JST = timezone(timedelta(hours=9))
-AMZ_SESSION = requests.Session()
-
-
-# ---------------------------------------------------------------------------
-# 工具函数
-# ---------------------------------------------------------------------------
-def _sleep_jitter(a: float = 1.2, b: float = 2.8) -> None:
-    time.sleep(random.uniform(a, b))
-
 
-def _today_header_text() -> str:
-    now = datetime.now(JST)
-    return f"{now.month}月{now.day}日"
-
-
-def _num_to_col(n: int) -> str:
-    s = ""
-    while n > 0:
-        n, r = divmod(n - 1, 26)
-        s = chr(r + ord("A")) + s
-    return s
-
-
-def _headers(token: str) -> dict:
-    return {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json; charset=utf-8",
-    }
+# 商品页不需要预热；每个 worker 借出自己的 Session，避免多线程共用一个 requests.Session
+_SESSION_POOL = AmazonSessionPool(
+    headers={
+        "Accept-Language": "ja-JP,ja;q=0.9",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Connection": "keep-alive",
+    },
+    warm_url=None,
+    max_idle=max(RANK_CONCURRENCY, 8),
+)
 
 
-def _request_with_retry(fn, *, max_retry=LARK_RETRY, base_sleep=LARK_RETRY_BASE_SLEEP):
-    last_err = None
-    for attempt in range(1, max_retry + 1):
-        try:
-            return fn()
-        except Exception as e:
-            last_err = e
-            t = base_sleep * (1.6 ** (attempt - 1)) + random.uniform(0, 0.8)
-            print(f"[WARN] retry {attempt}/{max_retry} error={e} sleep={t:.1f}s")
-            time.sleep(t)
-    raise last_err
+def close_session_pool() -> None:
+    """关闭池里空闲的 Session（命令行退出、FastAPI 关闭时调用）。"""
+    _SESSION_POOL.close()
 
 
 # ---------------------------------------------------------------------------
-# Lark Sheet API
+# 工具函数
 # ---------------------------------------------------------------------------
-def _list_sheets(token: str, spreadsheet_token: str) -> list[dict]:
-    url = f"{LARK_HOST}/open-apis/sheets/v3/spreadsheets/{spreadsheet_token}/sheets/query"
-
-    def _call():
-        r = requests.get(url, headers=_headers(token), timeout=20)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-            except Exception:
-                j = r.text
-            raise RuntimeError(f"[LARK][list_sheets] status={r.status_code} body={j}")
-        data = r.json()
-        if data.get("code") != 0:
-            raise RuntimeError(f"[LARK][list_sheets] {data}")
-        return data.get("data", {}).get("sheets", [])
-
-    return _request_with_retry(_call)
-
-
-def _resolve_sheet_id(token: str, spreadsheet_token: str, title: str) -> str:
-    sheets = _list_sheets(token, spreadsheet_token)
-    for s in sheets:
-        if s.get("title") == title:
-            return s.get("sheet_id")
-    titles = [x.get("title") for x in sheets]
-    raise RuntimeError(f"[LARK] sheet title not found: '{title}'. existing titles={titles}")
-
-
-def _batch_get(token: str, spreadsheet_token: str, ranges: list[str]) -> dict:
-    url = f"{LARK_HOST}/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values_batch_get"
-
-    def _call():
-        r = requests.get(url, headers=_headers(token), params={"ranges": ranges}, timeout=30)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-            except Exception:
-                j = r.text
-            raise RuntimeError(f"[LARK][batch_get] status={r.status_code} body={j}")
-        data = r.json()
-        if data.get("code") != 0:
-            raise RuntimeError(f"[LARK][batch_get] {data}")
-        return data
-
-    return _request_with_retry(_call)
-
-
-def _batch_update(token: str, spreadsheet_token: str, updates: list[dict]) -> dict:
-    url = f"{LARK_HOST}/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values_batch_update"
-
-    def _call():
-        body = {"valueInputOption": "RAW", "valueRanges": updates}
-        r = requests.post(url, headers=_headers(token), json=body, timeout=30)
-        if r.status_code != 200:
-            try:
-                j = r.json()
-            except Exception:
-                j = r.text
-            raise RuntimeError(f"[LARK][batch_update] status={r.status_code} body={j}")
-        data = r.json()
-        if data.get("code") != 0:
-            raise RuntimeError(f"[LARK][batch_update] {data}")
-        return data
-
-    return _request_with_retry(_call)
+def _amazon_breaker() -> CircuitBreaker:
+    return get_host_breaker(
+        AMZ_HOST,
+        window=AMZ_BREAKER_WINDOW,
+        threshold=AMZ_BREAKER_THRESHOLD,
+        cooldown=AMZ_BREAKER_COOLDOWN,
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -166,51 +104,31 @@ def _extract_asin(v) -> str | None:
     return None
 
 
-def _ensure_today_col(token: str, spreadsheet_token: str, sheet_id: str) -> str:
-    rng = f"{sheet_id}!A{HEADER_ROW}:ZZ{HEADER_ROW}"
-    data = _batch_get(token, spreadsheet_token, [rng])
-    vr = data.get("data", {}).get("valueRanges", [])
-    row = ((vr[0].get("values") if vr else None) or [[]])[0]
-    today = _today_header_text()
-    last = 0
-    for i, v in enumerate(row):
-        sv = str(v).strip() if v is not None else ""
-        if sv:
-            last = i + 1
-        if sv == today:
-            return _num_to_col(i + 1)
-    target = last + 1
-    col = _num_to_col(target)
-    _batch_update(token, spreadsheet_token, [{
-        "range": f"{sheet_id}!{col}{HEADER_ROW}:{col}{HEADER_ROW}",
-        "values": [[today]],
-    }])
-    return col
-
-
 def _fetch_rank(asin: str) -> tuple[str | None, str | None, str]:
-    url = f"https://www.amazon.co.jp/dp/{asin}"
-    headers = {
-        "User-Agent": random.choice(USER_AGENTS),
-        "Accept-Language": "ja-JP,ja;q=0.9",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Connection": "keep-alive",
-    }
-    r = AMZ_SESSION.get(url, headers=headers, timeout=25)
+    url = f"https://{AMZ_HOST}/dp/{asin}"
+    with _SESSION_POOL.checkout() as pooled:
+        r = pooled.get(url, headers={"User-Agent": random.choice(USER_AGENTS)}, timeout=25)
+        if r.status_code in (403, 503):
+            # 被拦截的 Session 不再复用
+            pooled.discard()
     if r.status_code == 403:
         return None, None, "HTTP_403"
     if r.status_code != 200:
         return None, None, f"HTTP_{r.status_code}"
     html = r.text
-    low = html.lower()
-    if "captcha" in low or "ロボットではありません" in html:
-        return None, None, "CAPTCHA?"
-    soup = BeautifulSoup(html, "lxml")
-    text = soup.get_text("\n", strip=True)
-    key = "Amazon 売れ筋ランキング"
-    idx = text.find(key)
-    segment = text[idx: idx + 2500] if idx != -1 else text
-    matches = re.findall(r"([^\n]{2,80})\s*[\-–—－]\s*(\d[\d,]*)\s*位", segment)
+    save_snapshot("product", asin, 1, html)
+    return _parse_rank(html)
+
+
+BSR_KEY = "Amazon 売れ筋ランキング"
+_BSR_MATCH = re.compile(r"([^\n]{2,80})\s*[\-–—－]\s*(\d[\d,]*)\s*位")
+_CAPTCHA = re.compile(r"captcha", re.IGNORECASE)
+# 快速路径只解析排名所在的这一段 HTML（从所在 <li>/<tr> 开始）
+_BSR_WINDOW = 32 * 1024
+
+
+def _pick_rank(matches: list[tuple[str, str]]) -> tuple[str | None, str | None, str]:
+    """有子类目时取子类目排名，否则取大类排名。"""
     if not matches:
         return None, None, "RANK_N/A"
     if len(matches) >= 2:
@@ -220,13 +138,161 @@ def _fetch_rank(asin: str) -> tuple[str | None, str | None, str]:
     return main_rank.replace(",", ""), main_cat.strip(), "OK"
 
 
+def _parse_rank(html: str, targeted: bool = True) -> tuple[str | None, str | None, str]:
+    if _CAPTCHA.search(html) or "ロボットではありません" in html:
+        return None, None, "CAPTCHA?"
+    return (targeted and _parse_rank_targeted(html)) or _parse_rank_full(html)
+
+
+def _parse_rank_targeted(html: str) -> tuple[str | None, str | None, str] | None:
+    """
+    直接在原始 HTML 里定位売れ筋ランキング，只解析它所在的一小段。
+    结果不能确定与整页解析一致时（找不到、片段太短）返回 None，交给 _parse_rank_full。
+    """
+    idx = html.find(BSR_KEY)
+    if idx == -1:
+        return None
+    start = max(html.rfind("<li", 0, idx), html.rfind("<tr", 0, idx))
+    if start == -1:
+        return None
+    end = idx + _BSR_WINDOW
+    text = make_soup(html[start:end]).get_text("\n", strip=True)
+    key_at = text.find(BSR_KEY)
+    if key_at == -1:
+        return None
+    segment = text[key_at: key_at + 2500]
+    matches = _BSR_MATCH.findall(segment)
+    # 子类目已找到，或片段覆盖了整页逻辑会看的全部 2500 字，结果与整页解析相同
+    if matches and (len(matches) >= 2 or len(segment) >= 2500 or end >= len(html)):
+        return _pick_rank(matches)
+    return None
+
+
+def _parse_rank_full(html: str) -> tuple[str | None, str | None, str]:
+    """原来的整页解析：整页转成文本后在売れ筋ランキング之后 2500 字内找排名。"""
+    soup = make_soup(html)
+    text = soup.get_text("\n", strip=True)
+    idx = text.find(BSR_KEY)
+    segment = text[idx: idx + 2500] if idx != -1 else text
+    return _pick_rank(_BSR_MATCH.findall(segment))
+
+
+def reparse_rank_from_cache(asin: str, day: str | None = None) -> tuple[str | None, str | None, str]:
+    """用缓存的商品页快照重新解析排名（不访问网络）。没有快照时状态为 NO_CACHE。"""
+    store = get_html_store()
+    html = store.get("product", asin, 1, day=day) if store is not None else None
+    if not html:
+        return None, None, "NO_CACHE"
+    return _parse_rank(html)
+
+
+# ---------------------------------------------------------------------------
+# 抓取调度：线程池 + 延后重试队列 + host 熔断
+# ---------------------------------------------------------------------------
+def _check_once(asin: str, limiter: TokenBucket, breaker: CircuitBreaker, stop: threading.Event):
+    """在 worker 线程中抓取一次，返回 (排名, 分类, 状态)。熔断期间先等待恢复。"""
+    breaker.wait(stop)
+    if stop.is_set():
+        return None, None, "CANCELLED"
+    limiter.acquire()
+    try:
+        val, cat, status = _fetch_rank(asin)
+    except requests.RequestException as e:
+        val, cat, status = None, None, f"ERROR_{type(e).__name__}"
+    if breaker.record(status in BLOCK_STATUSES):
+        print(f"[WARN] {AMZ_HOST} block rate too high, pausing all fetches for {breaker.remaining():.0f}s")
+    return val, cat, status
+
+
+def _retry_delay(attempt: int) -> float:
+    """第 attempt 次失败后的冷却时间：指数增长 + 随机抖动。"""
+    delay = AMZ_RETRY_BASE_DELAY * (2 ** (attempt - 1)) + random.uniform(AMZ_SLEEP_MIN, AMZ_SLEEP_MAX)
+    return min(delay, AMZ_RETRY_MAX_DELAY)
+
+
+def _iter_rank_checks(
+    targets: list[tuple[int, str]], workers: int, limiter: TokenBucket, breaker: CircuitBreaker
+) -> Iterator[tuple | None]:
+    """
+    用线程池抓取 (行号, ASIN)，按完成顺序产出事件：
+    - ("result", 行号, ASIN, (排名, 分类, 状态), 尝试次数)：成功，或已用完 AMZ_TRY 次尝试
+    - ("retry", 行号, ASIN, 状态, 尝试次数, 冷却秒数)：失败，放到重试队列末尾，冷却后再抓
+    - ("paused", 秒数)：被拦截比例过高，熔断器暂停了所有抓取
+    - None：等待中的心跳
+    只保持 workers*2 个任务在途；冷却到期的重试优先于新 ASIN。生成器被关闭时取消尚未开始的任务。
+    """
+    print(f"[INFO] fetch workers={workers} rpm={limiter.rate_per_minute:.0f}")
+    pool = ThreadPoolExecutor(max_workers=workers)
+    stop = threading.Event()
+    pending: dict[Future, tuple[int, str, int]] = {}
+    queue = deque((row_no, asin, 1) for row_no, asin in targets)
+    retry_lane: list[tuple[float, int, int, str, int]] = []
+    seq = 0
+    trips = breaker.trips
+    try:
+        while queue or retry_lane or pending:
+            while len(pending) < workers * 2:
+                if retry_lane and retry_lane[0][0] <= time.monotonic():
+                    _, _, row_no, asin, attempt = heapq.heappop(retry_lane)
+                elif queue:
+                    row_no, asin, attempt = queue.popleft()
+                else:
+                    break
+                pending[pool.submit(_check_once, asin, limiter, breaker, stop)] = (row_no, asin, attempt)
+
+            if not pending:
+                # 只剩还在冷却的重试
+                time.sleep(min(max(retry_lane[0][0] - time.monotonic(), 0.0), 1.0))
+                yield None
+                continue
+
+            done, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            if breaker.trips != trips:
+                trips = breaker.trips
+                yield "paused", breaker.remaining()
+            if not done:
+                yield None
+                continue
+            for fut in done:
+                row_no, asin, attempt = pending.pop(fut)
+                val, cat, status = fut.result()
+                if val or attempt >= AMZ_TRY:
+                    yield "result", row_no, asin, (val, cat, status), attempt
+                    continue
+                delay = _retry_delay(attempt)
+                seq += 1
+                heapq.heappush(retry_lane, (time.monotonic() + delay, seq, row_no, asin, attempt + 1))
+                yield "retry", row_no, asin, status, attempt, delay
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
 # ---------------------------------------------------------------------------
 # 主入口
 # ---------------------------------------------------------------------------
-def run_amazon_rank_sync_generator(sheet_title: str | None = None):
+def run_amazon_rank_sync_generator(
+    sheet_title: str | None = None,
+    concurrency: int | None = None,
+    rpm: float | None = None,
+    cancel: threading.Event | None = None,
+    resume: bool = False,
+):
     """
     流式的 Amazon 排名同步，实时 yield 进度供前端显示与手动取消。
+    concurrency > 1 时并发抓取，进度按完成顺序产出；所有 worker 共享 amazon.co.jp 的请求预算。
+    抓取失败的 ASIN 进入重试队列，冷却后再抓（不阻塞其他 ASIN）；被拦截比例过高时熔断暂停。
+    cancel 被 set 时停止抓取，已抓到的排名仍会写回飞书。
+    resume=True 时读取当日断点：已抓到排名的 ASIN 跳过，抓到但未写回的结果直接补写。
     """
+    workers = max(int(concurrency or RANK_CONCURRENCY), 1)
+    limiter = get_host_limiter(AMZ_HOST, rate_per_minute=AMZ_RPM, burst=AMZ_BURST)
+    default_rpm = limiter.rate_per_minute
+    breaker = _amazon_breaker()
+    trips_before = breaker.trips
+    fetch_stats = {"done": 0, "attempts": 0, "blocked": 0}
+    retried: set[int] = set()
+
     spreadsheet_token = get_env("FEISHU_SHEET_TOKEN") or ""
     if not spreadsheet_token:
         yield {"type": "error", "message": "未配置 FEISHU_SHEET_TOKEN", "updated_cells": 0}
@@ -241,78 +307,192 @@ def run_amazon_rank_sync_generator(sheet_title: str | None = None):
     title = sheet_title or (get_env("FEISHU_SHEET_NAME") or f"{datetime.now(JST).month}月")
     yield {"type": "progress", "message": f"正在解析飞书 Sheet '{title}' 数据..."}
 
+    buffer: SheetUpdateBuffer | None = None
+    checkpoint: RankSyncCheckpoint | None = None
     try:
+        if rpm:
+            # 令牌桶是整个进程共用的：rpm 只对本次运行生效，结束时在 finally 里恢复
+            limiter.set_rate(rpm)
         token = _get_tenant_access_token()
         sheet_id = _resolve_sheet_id(token, spreadsheet_token, title)
         col = _ensure_today_col(token, spreadsheet_token, sheet_id)
         
-        end_row = DATA_START_ROW + MAX_ROWS - 1
-        asin_rng = f"{sheet_id}!{ASIN_COL}{DATA_START_ROW}:{ASIN_COL}{end_row}"
-        data = _batch_get(token, spreadsheet_token, [asin_rng])
-        vr = data.get("data", {}).get("valueRanges", [])
-        rows = (vr[0].get("values") if vr else None) or []
-
-        updates: list[dict] = []
-        valid_count = 0
-        for r in rows:
-            if _extract_asin(r[0] if r else ""):
-                valid_count += 1
-                
-        yield {"type": "progress", "message": f"共读取到 {valid_count} 个需要抓取的 ASIN，开始查询..."}
-
-        for i, r in enumerate(rows):
-            # 每个循环内部的 yield 回调
-            yield {"type": "heartbeat"}
-
-            row_no = DATA_START_ROW + i
-            asin = _extract_asin(r[0] if r else "")
-            if not asin:
-                continue
-                
-            val, cat, status = None, None, "RANK_N/A"
-            for attempt in range(AMZ_TRY):
-                val, cat, status = _fetch_rank(asin)
-                if val:
-                    break
-                # 如果没抓到，给前端发个状态说明在重试
-                if attempt < AMZ_TRY - 1:
-                    yield {"type": "progress", "message": f"[{row_no}] {asin} 暂时没有排名，稍作重试..."}
-                    time.sleep(random.uniform(AMZ_SLEEP_MIN, AMZ_SLEEP_MAX))
-            
-            updates.append({
-                "range": f"{sheet_id}!{col}{row_no}:{col}{row_no}",
-                "values": [[val or status]],
-            })
+        # 只读 ASIN 列，分页读到数据末尾（设置了 MAX_ROWS 时最多读这么多行）
+        asins: list[tuple[int, str]] = []
+        for row_no, (cell,) in iter_sheet_rows(
+            token, spreadsheet_token, sheet_id, [ASIN_COL], start_row=DATA_START_ROW, max_rows=MAX_ROWS
+        ):
+            asin = _extract_asin(cell)
+            if asin:
+                asins.append((row_no, asin))
+
+        # 排名列和 F 列的更新按列合并相邻行，每 LARK_UPDATE_FLUSH_ROWS 行或 LARK_UPDATE_FLUSH_SECONDS 秒写一次
+        buffer = SheetUpdateBuffer(token, spreadsheet_token, sheet_id)
+
+        def _set_cells(row_no: int, val: str | None, cat: str | None, status: str) -> None:
+            buffer.set(row_no, col, val or status)
             if status == "OK" and cat:
-                updates.append({
-                    "range": f"{sheet_id}!{AMZ_CAT_COL}{row_no}:{AMZ_CAT_COL}{row_no}",
-                    "values": [[cat]],
-                })
-            
+                buffer.set(row_no, AMZ_CAT_COL, cat)
+
+        def _flush() -> dict[str, int]:
+            result = buffer.flush()
+            checkpoint.mark_all_written()
+            checkpoint.save()
+            return result
+
+        prune_checkpoints()
+        checkpoint = RankSyncCheckpoint(spreadsheet_token, sheet_id, col)
+        if resume and checkpoint.load():
+            restored = checkpoint.unwritten()
+            for row_no, e in restored:
+                _set_cells(row_no, e["value"], e["category"], e["status"])
+            yield {
+                "type": "progress",
+                "message": f"从断点恢复：已写回 {checkpoint.stats()['written']} 行，补写 {len(restored)} 行已抓取的结果",
+            }
+
+        targets = [(row_no, asin) for row_no, asin in asins if not (resume and checkpoint.finished(row_no, asin))]
+        valid_count = len(asins)
+        skipped = valid_count - len(targets)
+
+        message = f"共读取到 {valid_count} 个需要抓取的 ASIN，开始查询..."
+        if skipped:
+            message = f"共读取到 {valid_count} 个 ASIN，跳过 {skipped} 个今天已完成的，开始查询..."
+        yield {"type": "progress", "message": message}
+
+        def _record(row_no: int, asin: str, val: str | None, cat: str | None, status: str) -> str:
+            _set_cells(row_no, val, cat, status)
+            checkpoint.mark_fetched(row_no, asin, val, cat, status)
+            checkpoint.save()
             log_str = f"行 {row_no} | ASIN {asin} | 排名: {val or status} | 分类: {cat if (status == 'OK' and cat) else ''}"
             print(log_str)
-            yield {"type": "progress", "message": log_str}
-            
-            _sleep_jitter()
-
-        if updates:
-            yield {"type": "progress", "message": "全部抓取完毕，正在将结果统一写回飞书..."}
-            _batch_update(token, spreadsheet_token, updates)
-            yield {"type": "done", "success": True, "message": f"已更新 {len(updates)} 个单元格", "updated_cells": len(updates)}
+            return log_str
+
+        checks = _iter_rank_checks(targets, workers, limiter, breaker)
+        try:
+            for item in checks:
+                if cancel is not None and cancel.is_set():
+                    yield {"type": "progress", "message": "已取消，正在写回已抓取的排名..."}
+                    break
+                if item is None:
+                    yield {"type": "heartbeat"}
+                elif item[0] == "paused":
+                    yield {"type": "progress", "message": f"⚠️ 被拦截比例过高，暂停抓取 {item[1]:.0f} 秒..."}
+                elif item[0] == "retry":
+                    _, row_no, asin, status, attempt, delay = item
+                    fetch_stats["attempts"] += 1
+                    fetch_stats["blocked"] += int(status in BLOCK_STATUSES)
+                    retried.add(row_no)
+                    yield {"type": "progress", "message": f"[{row_no}] {asin} {status}，{delay:.0f} 秒后重试..."}
+                else:
+                    _, row_no, asin, (val, cat, status), attempts = item
+                    fetch_stats["attempts"] += 1
+                    fetch_stats["blocked"] += int(status in BLOCK_STATUSES)
+                    fetch_stats["done"] += 1
+                    log_str = _record(row_no, asin, val, cat, status)
+                    if attempts > 1:
+                        log_str += f" | 重试 {attempts - 1} 次"
+                    yield {"type": "progress", "message": f"[{fetch_stats['done']}/{len(targets)}] {log_str}"}
+                # 每个事件（含心跳、熔断暂停、重试）都检查一次：冷却期间已抓到的行也按时写回
+                if buffer.due():
+                    yield {"type": "progress", "message": _flush_message(_flush())}
+        finally:
+            checks.close()
+
+        if buffer.pending_rows:
+            yield {"type": "progress", "message": "全部抓取完毕，正在将剩余结果写回飞书..."}
+            _flush()
+        stats = buffer.stats()
+        fetch_stats.update(_fetch_summary(fetch_stats, len(retried), breaker, trips_before))
+        print(f"[INFO] sheet writes: {stats}, fetch={fetch_stats}, lark={get_sheets_client().stats()}")
+        if stats["cells"]:
+            yield {
+                "type": "done",
+                "success": True,
+                "message": (
+                    f"已更新 {stats['cells']} 个单元格（{stats['requests']} 次写入，{stats['bytes'] / 1024:.1f} KB）；"
+                    f"拦截率 {fetch_stats['block_rate']:.0%}，重试率 {fetch_stats['retry_rate']:.0%}"
+                ),
+                "updated_cells": stats["cells"],
+                "write_stats": stats,
+                "fetch_stats": fetch_stats,
+            }
         else:
-            yield {"type": "done", "success": True, "message": "无 ASIN 需要更新", "updated_cells": 0}
+            yield {"type": "done", "success": True, "message": "无 ASIN 需要更新", "updated_cells": 0, "fetch_stats": fetch_stats}
 
     except Exception as e:
-        yield {"type": "error", "message": str(e), "updated_cells": 0}
+        yield {"type": "error", "message": str(e), "updated_cells": buffer.stats()["cells"] if buffer else 0}
+    finally:
+        # 出错、取消、客户端断开时把已抓到的排名写回飞书；写回失败的行留在断点里，resume 时补写
+        if buffer is not None and buffer.pending_rows:
+            try:
+                buffer.flush()
+                checkpoint.mark_all_written()
+            except Exception as e:
+                print(f"[ERROR] failed to flush rank updates: {e}")
+        if checkpoint is not None:
+            checkpoint.save()
+        if rpm:
+            limiter.set_rate(default_rpm)
+
+
+def _fetch_summary(counts: dict[str, int], retried: int, breaker: CircuitBreaker, trips_before: int) -> dict:
+    attempts = counts["attempts"]
+    return {
+        "retried": retried,
+        "block_rate": round(counts["blocked"] / attempts, 3) if attempts else 0.0,
+        "retry_rate": round(retried / counts["done"], 3) if counts["done"] else 0.0,
+        "breaker_trips": breaker.trips - trips_before,
+    }
+
+
+def _flush_message(result: dict[str, int]) -> str:
+    return f"已写回 {result['cells']} 个单元格（{result['ranges']} 个区域，{result['bytes'] / 1024:.1f} KB）"
+
 
 # 兼容旧同步方法的壳
-def run_amazon_rank_sync(sheet_title: str | None = None) -> dict:
+def run_amazon_rank_sync(
+    sheet_title: str | None = None,
+    concurrency: int | None = None,
+    rpm: float | None = None,
+    resume: bool = False,
+) -> dict:
     result = {"success": False, "message": "Unknown error", "updated_cells": 0}
-    for event in run_amazon_rank_sync_generator(sheet_title):
+    for event in run_amazon_rank_sync_generator(sheet_title, concurrency, rpm, resume=resume):
         if event["type"] in ("done", "error"):
             result = {
                 "success": event.get("success", False) or event["type"] == "done",
                 "message": event.get("message", ""),
                 "updated_cells": event.get("updated_cells", 0)
             }
+            for key in ("write_stats", "fetch_stats"):
+                if event.get(key):
+                    result[key] = event[key]
     return result
+
+
+def rebuild_rank_values_from_cache(day: str | None = None) -> dict:
+    """
+    离线重新解析：用指定日期（默认今天）缓存的商品页快照重新算出每个 ASIN 的排名，不访问网络。
+    ASIN 对应的行号要读飞书才知道，这里只返回结果，不写回 Sheet。
+    """
+    store = get_html_store()
+    if store is None:
+        return {"success": False, "message": "HTML 缓存未启用（AMZ_HTML_CACHE=0）", "updated_cells": 0}
+
+    day = day or datetime.now(JST).strftime("%Y-%m-%d")
+    asins = list(dict.fromkeys(s["key"] for s in store.list_snapshots("product", day=day)))
+    if not asins:
+        return {"success": False, "message": f"缓存中没有 {day} 的商品页快照", "updated_cells": 0}
+
+    results = []
+    for asin in asins:
+        val, cat, status = reparse_rank_from_cache(asin, day=day)
+        results.append({"asin": asin, "rank": val, "category": cat, "status": status})
+    ok = sum(r["status"] == "OK" for r in results)
+    return {
+        "success": True,
+        "message": f"reparse: 从缓存重新解析了 {day} 的 {len(results)} 个 ASIN（{ok} 个取到排名）",
+        "updated_cells": 0,
+        "results": results,
+    }
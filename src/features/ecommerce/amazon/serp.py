@@ -0,0 +1,136 @@
+"""
+Amazon 搜索结果页（SERP）解析：一次遍历商品卡片，得到自然位与广告位的有序 ASIN 列表。
+排名规则与 README_AmazonKeywordTracker.md 中的说明一致：
+- 自然位：所有带 data-asin 的卡片，跳过 class 含 AdHolder / sp-sponsored-result 的广告卡片
+- 广告位：s-search-result 卡片或 AdHolder，class / 广告标签 / 前 200 字符含"スポンサー"即视为广告
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+from src.core.html_parser import get_parser_backend, make_soup
+
+# strainer 后端只构建带 data-asin 的卡片（及其子节点），跳过页面其余部分
+SERP_STRAINER = SoupStrainer("div", attrs={"data-asin": True})
+
+SPONSORED_CLASSES = ("AdHolder", "sp-sponsored-result")
+SPONSORED_LABEL_CLASSES = {
+    "puis-label-popover-default",
+    "s-label-popover-default",
+    "s-sponsored-label-info-icon",
+}
+SPONSORED_WORDS = ("スポンサー", "Sponsored")
+
+
+def _leading_text(tag: Tag, limit: int = 200) -> str:
+    """等价于 tag.get_text(" ", strip=True)[:limit]，但凑够 limit 个字符就停止遍历。"""
+    parts: list[str] = []
+    size = 0
+    for s in tag.stripped_strings:
+        parts.append(s)
+        size += len(s) + 1
+        if size > limit:
+            break
+    return " ".join(parts)[:limit]
+
+
+def _is_sponsored_card(card: Tag, classes: list[str]) -> bool:
+    if any(c in SPONSORED_CLASSES for c in classes):
+        return True
+    label = card.find(class_=lambda c: c in SPONSORED_LABEL_CLASSES)
+    if label is not None and any(kw in label.get_text() for kw in SPONSORED_WORDS):
+        return True
+    return any(kw in _leading_text(card) for kw in SPONSORED_WORDS)
+
+
+@dataclass
+class SerpPage:
+    """单个搜索结果页的位置表。位置从 1 开始，同一 ASIN 出现多次时取第一次。"""
+
+    organic: list[str] = field(default_factory=list)
+    sponsored: list[str] = field(default_factory=list)
+    organic_pos: dict[str, int] = field(default_factory=dict)
+    sponsored_pos: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def organic_count(self) -> int:
+        return len(self.organic)
+
+    @property
+    def sponsored_count(self) -> int:
+        return len(self.sponsored)
+
+    def organic_rank(self, asin: str, offset: int = 0) -> int | None:
+        pos = self.organic_pos.get(asin)
+        return offset + pos if pos else None
+
+    def ad_rank(self, asin: str, offset: int = 0) -> int | None:
+        pos = self.sponsored_pos.get(asin)
+        return offset + pos if pos else None
+
+    def _add_organic(self, asin: str) -> None:
+        self.organic.append(asin)
+        self.organic_pos.setdefault(asin, len(self.organic))
+
+    def _add_sponsored(self, asin: str) -> None:
+        self.sponsored.append(asin)
+        self.sponsored_pos.setdefault(asin, len(self.sponsored))
+
+    @classmethod
+    def from_html(cls, html: str, backend: str | None = None) -> "SerpPage":
+        """按配置的解析后端解析搜索结果页。"""
+        backend = backend or get_parser_backend()
+        if backend == "selectolax":
+            return cls._from_selectolax(html)
+        return cls.from_soup(make_soup(html, backend, parse_only=SERP_STRAINER))
+
+    @classmethod
+    def from_soup(cls, soup: BeautifulSoup) -> "SerpPage":
+        page = cls()
+        for card in soup.find_all("div", attrs={"data-asin": True}):
+            asin = card.get("data-asin")
+            if not asin:
+                continue
+            classes = card.get("class") or []
+            class_ad = any(c in SPONSORED_CLASSES for c in classes)
+
+            # 自然位：跳过广告位和空卡片（有时会有无 ASIN 的占位符）
+            if not class_ad and len(asin) >= 5:
+                page._add_organic(asin)
+
+            # 广告位：只看搜索结果卡片和 AdHolder
+            if "AdHolder" in classes or card.get("data-component-type") == "s-search-result":
+                if _is_sponsored_card(card, classes):
+                    page._add_sponsored(asin)
+        return page
+
+    @classmethod
+    def _from_selectolax(cls, html: str) -> "SerpPage":
+        from selectolax.lexbor import LexborHTMLParser
+
+        label_selector = ", ".join(f".{c}" for c in sorted(SPONSORED_LABEL_CLASSES))
+        page = cls()
+        for card in LexborHTMLParser(html).css("div[data-asin]"):
+            attrs = card.attributes
+            asin = attrs.get("data-asin")
+            if not asin:
+                continue
+            classes = (attrs.get("class") or "").split()
+            class_ad = any(c in SPONSORED_CLASSES for c in classes)
+
+            if not class_ad and len(asin) >= 5:
+                page._add_organic(asin)
+
+            if "AdHolder" in classes or attrs.get("data-component-type") == "s-search-result":
+                sponsored = class_ad
+                if not sponsored:
+                    label = card.css_first(label_selector)
+                    sponsored = label is not None and any(kw in label.text() for kw in SPONSORED_WORDS)
+                if not sponsored:
+                    lead = card.text(separator=" ", strip=True)[:200]
+                    sponsored = any(kw in lead for kw in SPONSORED_WORDS)
+                if sponsored:
+                    page._add_sponsored(asin)
+        return page
@@ -0,0 +1,126 @@
+"""
+Amazon 抓取用的 Session 池。
+每个 Session 创建时访问一次首页完成预热（带上邮编 Cookie），之后在多次抓取之间复用，
+保持 keep-alive 连接和 Cookie 状态；使用 N 次后或遇到 503 时回收重建。
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import requests
+
+from src.core.rate_limiter import TokenBucket
+
+
+class PooledSession:
+    """池中的单个 Session，记录使用次数；调用 discard() 后归还时会被关闭而不是放回池中。"""
+
+    def __init__(self, session: requests.Session):
+        self.session = session
+        self.uses = 0
+        self.discarded = False
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        self.uses += 1
+        return self.session.get(url, **kwargs)
+
+    def discard(self) -> None:
+        self.discarded = True
+
+
+class AmazonSessionPool:
+    def __init__(
+        self,
+        headers: dict,
+        cookies: dict | None = None,
+        warm_url: str | None = "https://www.amazon.co.jp",
+        max_uses: int = 50,
+        max_idle: int = 8,
+        timeout: int = 15,
+        limiter: TokenBucket | None = None,
+    ):
+        self.headers = headers
+        self.cookies = cookies or {}
+        self.warm_url = warm_url
+        self.max_uses = max(int(max_uses), 1)
+        self.timeout = timeout
+        self.limiter = limiter
+        self._idle: queue.LifoQueue[PooledSession] = queue.LifoQueue(maxsize=max(int(max_idle), 1))
+        self._lock = threading.Lock()
+        self._stats = {
+            "sessions_created": 0,
+            "warmups": 0,
+            "checkouts": 0,
+            "requests": 0,
+            "reused_requests": 0,
+            "recycled": 0,
+            "discarded": 0,
+        }
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    def _new_session(self) -> PooledSession:
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.cookies.update(self.cookies)
+        self._count("sessions_created")
+        if self.warm_url:
+            try:
+                if self.limiter:
+                    self.limiter.acquire()
+                session.get(self.warm_url, timeout=self.timeout)
+                self._count("warmups")
+            except requests.RequestException as e:
+                # 预热失败不影响使用，Cookie 已经设置在 Session 上
+                print(f"[WARN] Amazon session warm-up failed: {e}")
+        return PooledSession(session)
+
+    @contextmanager
+    def checkout(self) -> Iterator[PooledSession]:
+        """借出一个已预热的 Session；with 块结束时自动归还（或按规则回收）。"""
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            pooled = self._new_session()
+        self._count("checkouts")
+        uses_before = pooled.uses
+        try:
+            yield pooled
+        finally:
+            made = pooled.uses - uses_before
+            self._count("requests", made)
+            if uses_before:
+                self._count("reused_requests", made)
+            self._release(pooled)
+
+    def _release(self, pooled: PooledSession) -> None:
+        if pooled.discarded:
+            self._count("discarded")
+            pooled.session.close()
+            return
+        if pooled.uses >= self.max_uses:
+            self._count("recycled")
+            pooled.session.close()
+            return
+        try:
+            self._idle.put_nowait(pooled)
+        except queue.Full:
+            pooled.session.close()
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            s = dict(self._stats)
+        s["reuse_ratio"] = round(s["reused_requests"] / s["requests"], 3) if s["requests"] else 0.0
+        return s
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().session.close()
+            except queue.Empty:
+                return
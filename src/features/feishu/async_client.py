@@ -0,0 +1,244 @@
+"""
+飞书（Lark）开放平台的 asyncio 客户端，供 FastAPI 的 async 接口直接调用，不阻塞事件循环。
+- 连接：httpx.AsyncClient（带连接池），在 run_api 的 lifespan 里关闭
+- 限流 / 重试 / 统计：与 sheets_client.LarkHttpClient 共用同一套逻辑和跨进程令牌桶
+- 只覆盖 async 接口用到的多维表格 bitable v1（records 列表 / 批量写入、load_index、bulk_upsert）；
+  流式接口等其它调用仍走同步客户端，放在线程池里执行
+"""
+from __future__ import annotations
+
+import asyncio
+import json as jsonlib
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator
+
+import httpx
+
+from .bitable_client import (
+    BITABLE_BATCH_SIZE,
+    BITABLE_PAGE_SIZE,
+    RECORD_NOT_FOUND_CODES,
+    _chunks,
+    _created_index,
+    _index_items,
+    _plan_upsert,
+    _upsert_result,
+)
+from .bitable_index import get_bitable_index
+from .bot_client import _get_tenant_access_token
+from .sheets_client import (
+    LARK_HOST,
+    LARK_POOL_SIZE,
+    LARK_RETRY,
+    LARK_RETRY_BASE_SLEEP,
+    TOKEN_INVALID_CODES,
+    LarkApiError,
+    _LarkClientBase,
+)
+
+
+async def get_tenant_access_token() -> str:
+    """tenant_access_token 在进程内缓存，过期前才会真正请求；请求放到线程里，不阻塞事件循环。"""
+    return await asyncio.to_thread(_get_tenant_access_token)
+
+
+class AsyncLarkClient(_LarkClientBase):
+    def __init__(
+        self,
+        host: str = LARK_HOST,
+        pool_size: int = LARK_POOL_SIZE,
+        max_retry: int = LARK_RETRY,
+        base_sleep: float = LARK_RETRY_BASE_SLEEP,
+    ):
+        super().__init__(host, max_retry, base_sleep)
+        self.pool_size = pool_size
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self._client = httpx.AsyncClient(limits=limits, timeout=30)
+        return self._client
+
+    async def call(
+        self,
+        method: str,
+        path: str,
+        token: str,
+        name: str,
+        params: dict | None = None,
+        json: dict | None = None,
+        timeout: float = 30,
+    ) -> dict:
+        """
+        同 LarkHttpClient.call()：失败时抛出 LarkApiError，按配置重试，被限流时等待服务端的重置时间，
+        token 被判为无效时刷新一次 token 再发。
+        令牌桶是 SQLite（跨进程加锁，可能要等），预约 / 暂停都放到线程里，不阻塞事件循环。
+        """
+        url = self._url(path)
+        auth = {"token": token, "refreshed": False}
+
+        async def _send() -> dict:
+            wait = await asyncio.to_thread(self._throttle_reserve, name) if self.throttle is not None else 0.0
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                r = await self.client.request(
+                    method, url, headers=self._headers(auth["token"]), params=params, json=json, timeout=timeout
+                )
+            except httpx.HTTPError:
+                self._count(name, time.monotonic() - started, error=True)
+                raise
+            return self._check(name, r.status_code, r.json, r.headers, time.monotonic() - started, r.text)
+
+        last_err: Exception | None = None
+        for attempt in range(1, self.max_retry + 1):
+            try:
+                try:
+                    return await _send()
+                except LarkApiError as e:
+                    if e.code not in TOKEN_INVALID_CODES or auth["refreshed"]:
+                        raise
+                    auth["refreshed"] = True
+                    print(f"[WARN] tenant_access_token rejected [{name}], refreshing: code={e.code}")
+                    auth["token"] = await asyncio.to_thread(_get_tenant_access_token, auth["token"])
+                    return await _send()
+            except Exception as e:
+                last_err = e
+                if getattr(e, "retry_after", None) is not None:
+                    await asyncio.to_thread(self._penalize, e)
+                if attempt == self.max_retry or not self._retryable(e):
+                    break
+                t = self._retry_delay(name, attempt, e)
+                if t > 0:
+                    await asyncio.sleep(t)
+        raise last_err
+
+    # -----------------------------------------------------------------------
+    # 多维表格（bitable）
+    # -----------------------------------------------------------------------
+    async def list_records(
+        self,
+        token: str,
+        app_token: str,
+        table_id: str,
+        page_size: int = BITABLE_PAGE_SIZE,
+        page_token: str | None = None,
+        field_names: list[str] | None = None,
+    ) -> dict:
+        """取一页记录，返回 data（items / has_more / page_token / total）。"""
+        params: dict[str, Any] = {"page_size": page_size}
+        if page_token:
+            params["page_token"] = page_token
+        if field_names:
+            params["field_names"] = jsonlib.dumps(field_names, ensure_ascii=False)
+        data = await self.call(
+            "GET", f"bitable/v1/apps/{app_token}/tables/{table_id}/records", token, "bitable_list", params=params,
+        )
+        return data.get("data", {})
+
+    async def iter_records(
+        self, token: str, app_token: str, table_id: str, field_names: list[str] | None = None
+    ) -> AsyncIterator[dict]:
+        page_token = None
+        while True:
+            data = await self.list_records(token, app_token, table_id, page_token=page_token, field_names=field_names)
+            for item in data.get("items") or []:
+                yield item
+            page_token = data.get("page_token")
+            if not data.get("has_more") or not page_token:
+                return
+
+    async def batch_create_records(
+        self, token: str, app_token: str, table_id: str, records: list[dict], key_field: str | None = None
+    ) -> list[dict]:
+        created: list[dict] = []
+        store = await asyncio.to_thread(get_bitable_index) if key_field else None
+        for chunk in _chunks(records, BITABLE_BATCH_SIZE):
+            data = await self.call(
+                "POST", f"bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create", token,
+                "bitable_batch_create", params={"client_token": str(uuid.uuid4())}, json={"records": chunk},
+            )
+            new = data.get("data", {}).get("records") or []
+            if store is not None:
+                await asyncio.to_thread(
+                    store.add, app_token, table_id, key_field, _created_index(chunk, new, key_field), len(new)
+                )
+            created += new
+        return created
+
+    async def batch_update_records(self, token: str, app_token: str, table_id: str, records: list[dict]) -> int:
+        for chunk in _chunks(records, BITABLE_BATCH_SIZE):
+            await self.call(
+                "POST", f"bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_update", token,
+                "bitable_batch_update", json={"records": chunk},
+            )
+        return len(records)
+
+    async def scan_index(
+        self, token: str, app_token: str, table_id: str, key_field: str
+    ) -> tuple[dict[str, str], int]:
+        items = [item async for item in self.iter_records(token, app_token, table_id, field_names=[key_field])]
+        return _index_items(items, key_field), len(items)
+
+    async def load_index(
+        self, token: str, app_token: str, table_id: str, key_field: str, force: bool = False
+    ) -> tuple[dict[str, str], bool]:
+        """同 LarkBitableClient.load_index()；本地索引（SQLite）的读写放到线程里。"""
+        store = await asyncio.to_thread(get_bitable_index)
+        if not force:
+            total = (await self.list_records(token, app_token, table_id, page_size=1)).get("total")
+            cached = await asyncio.to_thread(store.load, app_token, table_id, key_field, total)
+            if cached is not None:
+                return cached, True
+        index, scanned = await self.scan_index(token, app_token, table_id, key_field)
+        await asyncio.to_thread(store.replace, app_token, table_id, key_field, index, scanned)
+        return index, False
+
+    async def bulk_upsert(
+        self, token: str, app_token: str, table_id: str, key_field: str, rows: list[dict]
+    ) -> dict[str, int]:
+        """同 LarkBitableClient.bulk_upsert()。"""
+        index, cached = await self.load_index(token, app_token, table_id, key_field)
+        updates, creates = _plan_upsert(index, key_field, rows)
+        try:
+            await self.batch_update_records(token, app_token, table_id, updates)
+        except LarkApiError as e:
+            if e.code not in RECORD_NOT_FOUND_CODES:
+                raise
+            print(f"[WARN] bitable index for {table_id} is stale, rescanning: {e}")
+            index, cached = await self.load_index(token, app_token, table_id, key_field, force=True)
+            updates, creates = _plan_upsert(index, key_field, rows)
+            await self.batch_update_records(token, app_token, table_id, updates)
+        await self.batch_create_records(token, app_token, table_id, creates, key_field=key_field)
+        return _upsert_result(index, updates, creates, cached)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_CLIENT: AsyncLarkClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_async_lark_client() -> AsyncLarkClient:
+    """进程内共享的 asyncio 客户端。"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = AsyncLarkClient()
+        return _CLIENT
+
+
+async def close_async_lark_client() -> None:
+    """在应用退出时（lifespan）关闭连接池。"""
+    global _CLIENT
+    client, _CLIENT = _CLIENT, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,287 @@
+"""
+飞书多维表格（bitable）客户端：在 LarkHttpClient（长连接 + 全局限流 + 重试）上封装记录接口。
+批量写入用 records/batch_update / records/batch_create，单次最多 BITABLE_BATCH_SIZE 条；
+bulk_upsert() 先取得 键 -> record_id，再分批更新 / 新建，代替逐条 search + 写入。
+键 -> record_id 保存在本地索引（bitable_index），记录数没变时不再整表扫描。
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+from typing import Any, Iterator
+
+from src.core.config_manager import get_env
+
+from .bitable_index import get_bitable_index
+from .sheets_client import LarkApiError, LarkHttpClient
+
+# 批量新增 / 更新接口单次最多 500 条；列表接口 page_size 最大 500
+BITABLE_BATCH_SIZE = 500
+BITABLE_PAGE_SIZE = 500
+# 字段列表接口 page_size 最大 100
+BITABLE_FIELD_PAGE_SIZE = 100
+# 逐条查找 record_id 时，本地索引校验（比对记录数）后多少秒内不再重复校验
+BITABLE_INDEX_CHECK_SECONDS = float(get_env("LARK_BITABLE_INDEX_CHECK_SECONDS") or "300")
+# 更新的 record_id 已被删除时返回的错误码
+RECORD_NOT_FOUND_CODES = {1254043}
+
+
+def _field_text(value: Any) -> str:
+    """把记录里的字段值转成文本：文本字段在列表接口里返回 [{"type": "text", "text": ...}]。"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "".join(
+            str(v.get("text") or v.get("name") or "") if isinstance(v, dict) else str(v) for v in value
+        ).strip()
+    if isinstance(value, dict):
+        return str(value.get("text") or value.get("name") or "").strip()
+    return str(value).strip()
+
+
+def _is_filter(field: str, value: str) -> dict:
+    """records/search 的过滤条件：field 等于 value。"""
+    return {
+        "conjunction": "and",
+        "conditions": [{"field_name": field, "operator": "is", "value": [value]}],
+    }
+
+
+def _index_items(items: list[dict], key_field: str) -> dict[str, str]:
+    """记录列表 -> 键 -> record_id；键重复时保留第一条。"""
+    index: dict[str, str] = {}
+    for item in items:
+        key = _field_text((item.get("fields") or {}).get(key_field))
+        if key and key not in index:
+            index[key] = item.get("record_id")
+    return index
+
+
+def _created_index(requested: list[dict], created: list[dict], key_field: str) -> dict[str, str]:
+    """batch_create 返回的记录与请求一一对应；返回里没有字段时用请求的字段取键。"""
+    index: dict[str, str] = {}
+    for req, rec in zip(requested, created):
+        key = _field_text((rec.get("fields") or req.get("fields") or {}).get(key_field))
+        if key and rec.get("record_id"):
+            index[key] = rec["record_id"]
+    return index
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _plan_upsert(index: dict[str, str], key_field: str, rows: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    按 key_field 把 rows 分成要更新的（已存在 record_id）和要新建的记录。
+    同一个键出现多次时字段合并，后出现的为准。
+    """
+    merged: dict[str, dict] = {}
+    for fields in rows:
+        key = _field_text(fields.get(key_field))
+        if key:
+            merged.setdefault(key, {}).update(fields)
+    updates = [{"record_id": index[k], "fields": f} for k, f in merged.items() if k in index]
+    creates = [{"fields": f} for k, f in merged.items() if k not in index]
+    return updates, creates
+
+
+def _upsert_result(index: dict, updates: list, creates: list, cached: bool) -> dict[str, int]:
+    return {
+        "indexed": len(index),
+        "index_cached": int(cached),
+        "updated": len(updates),
+        "created": len(creates),
+        "write_requests": -(-len(updates) // BITABLE_BATCH_SIZE) - (-len(creates) // BITABLE_BATCH_SIZE),
+    }
+
+
+class LarkBitableClient(LarkHttpClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (app_token, table_id, key_field) -> 最近一次校验索引的时间
+        self._index_checked: dict[tuple[str, str, str], float] = {}
+
+    def _records_path(self, app_token: str, table_id: str) -> str:
+        return f"bitable/v1/apps/{app_token}/tables/{table_id}/records"
+
+    def list_records(
+        self,
+        token: str,
+        app_token: str,
+        table_id: str,
+        page_size: int = BITABLE_PAGE_SIZE,
+        page_token: str | None = None,
+        field_names: list[str] | None = None,
+    ) -> dict:
+        """取一页记录，返回 data（items / has_more / page_token / total）。"""
+        params: dict[str, Any] = {"page_size": page_size}
+        if page_token:
+            params["page_token"] = page_token
+        if field_names:
+            params["field_names"] = json.dumps(field_names, ensure_ascii=False)
+        data = self.call("GET", self._records_path(app_token, table_id), token, "bitable_list", params=params)
+        return data.get("data", {})
+
+    def iter_records(
+        self, token: str, app_token: str, table_id: str, field_names: list[str] | None = None
+    ) -> Iterator[dict]:
+        """按 page_token 翻页逐条产出记录（{"record_id", "fields"}）。"""
+        page_token = None
+        while True:
+            data = self.list_records(token, app_token, table_id, page_token=page_token, field_names=field_names)
+            yield from data.get("items") or []
+            page_token = data.get("page_token")
+            if not data.get("has_more") or not page_token:
+                return
+
+    def list_fields(self, token: str, app_token: str, table_id: str) -> list[dict]:
+        """表的全部字段定义（field_id / field_name / type ...），按 page_token 翻页。"""
+        fields: list[dict] = []
+        page_token = None
+        while True:
+            params: dict[str, Any] = {"page_size": BITABLE_FIELD_PAGE_SIZE}
+            if page_token:
+                params["page_token"] = page_token
+            data = self.call(
+                "GET", f"bitable/v1/apps/{app_token}/tables/{table_id}/fields", token, "bitable_fields", params=params,
+            ).get("data", {})
+            fields += data.get("items") or []
+            page_token = data.get("page_token")
+            if not data.get("has_more") or not page_token:
+                return fields
+
+    def scan_records(
+        self, token: str, app_token: str, table_id: str, field_names: list[str]
+    ) -> Iterator[dict]:
+        """
+        整表扫描：每页取 BITABLE_PAGE_SIZE 条，只请求 field_names 这几列，
+        逐条产出 {"record_id": ..., 字段: 原始值}；记录里没有的字段（空值）为 None。
+        """
+        for item in self.iter_records(token, app_token, table_id, field_names=field_names):
+            fields = item.get("fields") or {}
+            row = {name: fields.get(name) for name in field_names}
+            row["record_id"] = item.get("record_id")
+            yield row
+
+    def search_records(
+        self, token: str, app_token: str, table_id: str, filter: dict | None = None, page_size: int = 20
+    ) -> list[dict]:
+        """按条件搜索记录（只取第一页），返回 items。"""
+        data = self.call(
+            "POST", f"{self._records_path(app_token, table_id)}/search", token, "bitable_search",
+            params={"page_size": page_size}, json={"filter": filter} if filter else {}, timeout=10,
+        )
+        return data.get("data", {}).get("items") or []
+
+    def batch_create_records(
+        self, token: str, app_token: str, table_id: str, records: list[dict], key_field: str | None = None
+    ) -> list[dict]:
+        """
+        records: [{"fields": {...}}]，按 BITABLE_BATCH_SIZE 分批，返回新建的记录（含 record_id）。
+        每批带一个 client_token，call() 内的重试不会重复新建。
+        指定 key_field 时把新记录的 键 -> record_id 记入本地索引。
+        """
+        created: list[dict] = []
+        for chunk in _chunks(records, BITABLE_BATCH_SIZE):
+            # client_token 是 Lark 的幂等参数：同一批次的重试带同一个值，超时后重发也不会重复新建
+            data = self.call(
+                "POST", f"{self._records_path(app_token, table_id)}/batch_create", token, "bitable_batch_create",
+                params={"client_token": str(uuid.uuid4())}, json={"records": chunk},
+            )
+            new = data.get("data", {}).get("records") or []
+            if key_field:
+                get_bitable_index().add(app_token, table_id, key_field, _created_index(chunk, new, key_field), len(new))
+            created += new
+        return created
+
+    def batch_update_records(self, token: str, app_token: str, table_id: str, records: list[dict]) -> int:
+        """records: [{"record_id": ..., "fields": {...}}]，按 BITABLE_BATCH_SIZE 分批，返回更新条数。"""
+        for chunk in _chunks(records, BITABLE_BATCH_SIZE):
+            self.call(
+                "POST", f"{self._records_path(app_token, table_id)}/batch_update", token, "bitable_batch_update",
+                json={"records": chunk},
+            )
+        return len(records)
+
+    def record_count(self, token: str, app_token: str, table_id: str) -> int | None:
+        """表的记录总数（列表接口 page_size=1 返回的 total）。"""
+        return self.list_records(token, app_token, table_id, page_size=1).get("total")
+
+    def scan_index(self, token: str, app_token: str, table_id: str, key_field: str) -> tuple[dict[str, str], int]:
+        """整表扫描一次（只取 key_field 一列），返回 (键 -> record_id, 扫描到的记录数)。"""
+        items = list(self.iter_records(token, app_token, table_id, field_names=[key_field]))
+        return _index_items(items, key_field), len(items)
+
+    def load_index(
+        self, token: str, app_token: str, table_id: str, key_field: str, force: bool = False
+    ) -> tuple[dict[str, str], bool]:
+        """
+        取得 键 -> record_id：本地索引的记录数与表一致时直接用，否则整表扫描并保存。
+        返回 (映射, 是否命中本地索引)。
+        """
+        store = get_bitable_index()
+        if not force:
+            cached = store.load(app_token, table_id, key_field, self.record_count(token, app_token, table_id))
+            if cached is not None:
+                self._index_checked[(app_token, table_id, key_field)] = time.monotonic()
+                return cached, True
+        index, scanned = self.scan_index(token, app_token, table_id, key_field)
+        store.replace(app_token, table_id, key_field, index, scanned)
+        self._index_checked[(app_token, table_id, key_field)] = time.monotonic()
+        return index, False
+
+    def lookup_record_id(self, token: str, app_token: str, table_id: str, key_field: str, key: str) -> str | None:
+        """
+        逐条查找：先查本地索引（每 BITABLE_INDEX_CHECK_SECONDS 秒最多校验一次记录数），
+        索引里没有时才调用 records/search，找到的结果记入索引。
+        """
+        checked = self._index_checked.get((app_token, table_id, key_field))
+        if checked is None or time.monotonic() - checked >= BITABLE_INDEX_CHECK_SECONDS:
+            self.load_index(token, app_token, table_id, key_field)
+        store = get_bitable_index()
+        record_id = store.get(app_token, table_id, key_field, key)
+        if record_id:
+            return record_id
+        items = self.search_records(token, app_token, table_id, _is_filter(key_field, key), page_size=1)
+        if items:
+            record_id = items[0].get("record_id")
+            store.add(app_token, table_id, key_field, {key: record_id})
+            return record_id
+        return None
+
+    def bulk_upsert(self, token: str, app_token: str, table_id: str, key_field: str, rows: list[dict]) -> dict[str, int]:
+        """
+        按 key_field 批量 upsert：取得索引（本地缓存或整表扫描），已有的走 batch_update，没有的走 batch_create。
+        更新时发现 record_id 已被删除，会重新扫描一次再写。
+        返回 {"indexed", "index_cached", "updated", "created", "write_requests"}。
+        """
+        index, cached = self.load_index(token, app_token, table_id, key_field)
+        updates, creates = _plan_upsert(index, key_field, rows)
+        try:
+            self.batch_update_records(token, app_token, table_id, updates)
+        except LarkApiError as e:
+            if e.code not in RECORD_NOT_FOUND_CODES:
+                raise
+            print(f"[WARN] bitable index for {table_id} is stale, rescanning: {e}")
+            index, cached = self.load_index(token, app_token, table_id, key_field, force=True)
+            updates, creates = _plan_upsert(index, key_field, rows)
+            self.batch_update_records(token, app_token, table_id, updates)
+        self.batch_create_records(token, app_token, table_id, creates, key_field=key_field)
+        return _upsert_result(index, updates, creates, cached)
+
+
+_CLIENT: LarkBitableClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_bitable_client() -> LarkBitableClient:
+    """进程内共享的多维表格客户端。"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = LarkBitableClient()
+        return _CLIENT
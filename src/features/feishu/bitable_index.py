@@ -0,0 +1,127 @@
+"""
+多维表格的 键 -> record_id 本地索引（SQLite，默认 data/bitable_index.sqlite）。
+按 (app_token, table_id, 键字段) 保存整表扫描得到的映射和当时的记录数；
+使用前用列表接口返回的 total（page_size=1，一次很轻的请求）和保存的记录数比对，
+一致时直接复用，不一致（有人增删过记录）时由调用方重新扫描。
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.core.config_manager import get_env, get_project_path
+
+BITABLE_INDEX_PATH = get_env("LARK_BITABLE_INDEX_PATH") or str(get_project_path("data", "bitable_index.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS record_keys (
+    app_token TEXT NOT NULL,
+    table_id TEXT NOT NULL,
+    key_field TEXT NOT NULL,
+    key TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    PRIMARY KEY (app_token, table_id, key_field, key)
+);
+CREATE TABLE IF NOT EXISTS indexes (
+    app_token TEXT NOT NULL,
+    table_id TEXT NOT NULL,
+    key_field TEXT NOT NULL,
+    record_count INTEGER NOT NULL,
+    built_at REAL NOT NULL,
+    PRIMARY KEY (app_token, table_id, key_field)
+);
+"""
+
+
+class BitableKeyIndex:
+    def __init__(self, path: str | Path = BITABLE_INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "rebuilds": 0}
+
+    def record_count(self, app_token: str, table_id: str, key_field: str) -> int | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT record_count FROM indexes WHERE app_token = ? AND table_id = ? AND key_field = ?",
+                (app_token, table_id, key_field),
+            ).fetchone()
+        return row[0] if row else None
+
+    def load(self, app_token: str, table_id: str, key_field: str, record_count: int | None) -> dict[str, str] | None:
+        """保存的记录数与 record_count 一致时返回整个映射，否则（或没有索引）返回 None。"""
+        saved = self.record_count(app_token, table_id, key_field)
+        if saved is None or record_count is None or saved != record_count:
+            with self._lock:
+                self._stats["stale" if saved is not None else "misses"] += 1
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, record_id FROM record_keys WHERE app_token = ? AND table_id = ? AND key_field = ?",
+                (app_token, table_id, key_field),
+            ).fetchall()
+            self._stats["hits"] += 1
+        return dict(rows)
+
+    def get(self, app_token: str, table_id: str, key_field: str, key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT record_id FROM record_keys WHERE app_token = ? AND table_id = ? AND key_field = ? AND key = ?",
+                (app_token, table_id, key_field, key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def replace(self, app_token: str, table_id: str, key_field: str, mapping: dict[str, str], record_count: int) -> None:
+        """用一次整表扫描的结果替换索引。"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM record_keys WHERE app_token = ? AND table_id = ? AND key_field = ?",
+                (app_token, table_id, key_field),
+            )
+            self._db.executemany(
+                "INSERT INTO record_keys (app_token, table_id, key_field, key, record_id) VALUES (?, ?, ?, ?, ?)",
+                [(app_token, table_id, key_field, k, rid) for k, rid in mapping.items()],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO indexes (app_token, table_id, key_field, record_count, built_at) VALUES (?, ?, ?, ?, ?)",
+                (app_token, table_id, key_field, record_count, time.time()),
+            )
+            self._db.commit()
+            self._stats["rebuilds"] += 1
+
+    def add(self, app_token: str, table_id: str, key_field: str, mapping: dict[str, str], created: int = 0) -> None:
+        """
+        记入新的 键 -> record_id。created 为本次新建的记录数，会加到保存的记录数上，
+        这样自己新建的记录不会让下次校验失败。
+        """
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO record_keys (app_token, table_id, key_field, key, record_id) VALUES (?, ?, ?, ?, ?)",
+                [(app_token, table_id, key_field, k, rid) for k, rid in mapping.items()],
+            )
+            if created:
+                self._db.execute(
+                    "UPDATE indexes SET record_count = record_count + ? WHERE app_token = ? AND table_id = ? AND key_field = ?",
+                    (created, app_token, table_id, key_field),
+                )
+            self._db.commit()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_INDEX: BitableKeyIndex | None = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_bitable_index() -> BitableKeyIndex:
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = BitableKeyIndex()
+        return _INDEX
@@ -0,0 +1,269 @@
+"""
+多维表格的本地快照：用 scan_records() 整表扫描（每页 500 条，只取需要的列），
+导出为 SQLite（默认）或 Parquet，看板读取本地副本，不必每次打开都请求飞书。
+默认目录 data/bitable_snapshots，可用 LARK_BITABLE_SNAPSHOT_DIR 修改；
+导出先写临时文件再替换，读取方不会读到写了一半的快照。
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from src.core.config_manager import get_env, get_project_path
+
+from .bitable_client import BITABLE_PAGE_SIZE, get_bitable_client
+from .bot_client import _get_tenant_access_token
+from .sheets_client import LarkApiError
+
+BITABLE_SNAPSHOT_DIR = get_env("LARK_BITABLE_SNAPSHOT_DIR") or str(get_project_path("data", "bitable_snapshots"))
+BITABLE_SNAPSHOT_FORMAT = (get_env("LARK_BITABLE_SNAPSHOT_FORMAT") or "sqlite").lower()
+SNAPSHOT_FORMATS = ("sqlite", "parquet")
+_SUFFIX = {"sqlite": ".sqlite", "parquet": ".parquet"}
+
+
+def _cell(value: Any) -> Any:
+    """
+    把字段原始值转成可以直接存的标量：数字 / 布尔原样保留；
+    文本（[{"type": "text", "text": ...}] 分段）拼成一个字符串；人员、单选等取 name；
+    多选等列表用 ", " 连接；其它结构存 JSON 文本。
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        text = value.get("text") or value.get("name")
+        return str(text) if text is not None else json.dumps(value, ensure_ascii=False)
+    if isinstance(value, list):
+        if all(isinstance(v, dict) and v.get("type") == "text" for v in value):
+            return "".join(str(v.get("text") or "") for v in value)
+        return ", ".join(str(c) for c in (_cell(v) for v in value) if c is not None)
+    return str(value)
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _value_type(value: Any) -> int:
+    """按字段值猜字段类型（与飞书字段 type 编号一致）：布尔 7 复选框，数字 2，其它 1 文本。"""
+    if isinstance(value, bool):
+        return 7
+    return 2 if isinstance(value, (int, float)) else 1
+
+
+def _discover_fields(client, token: str, app_token: str, table_id: str) -> dict[str, int | None]:
+    """
+    要导出的列及其字段类型 {field_name: type}：优先用字段列表接口（需要应用有读取字段的权限）；
+    没有该权限时退回为从第一页记录推断列名和类型（只需读取记录的权限，空值字段可能漏掉）。
+    """
+    try:
+        return {f["field_name"]: f.get("type") for f in client.list_fields(token, app_token, table_id)}
+    except LarkApiError as e:
+        print(f"[WARN] cannot list fields of {table_id}, inferring columns from records: {e}")
+    fields: dict[str, int | None] = {}
+    for item in client.list_records(token, app_token, table_id).get("items") or []:
+        for name, value in (item.get("fields") or {}).items():
+            if fields.get(name) is None:
+                fields[name] = _value_type(value) if value is not None else None
+    return fields
+
+
+def snapshot_path(table_id: str, fmt: str | None = None) -> Path:
+    fmt = fmt or BITABLE_SNAPSHOT_FORMAT
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"unknown snapshot format: {fmt}")
+    return Path(BITABLE_SNAPSHOT_DIR) / f"{table_id}{_SUFFIX[fmt]}"
+
+
+def _write_sqlite(path: Path, columns: list[str], rows: Iterator[dict], meta: dict[str, Any]) -> int:
+    """逐页写入（不把整表留在内存里），返回记录数。"""
+    with closing(sqlite3.connect(str(path))) as db:
+        # 列不声明类型：数字按数字存，文本按文本存
+        db.execute(
+            f"CREATE TABLE records (record_id TEXT PRIMARY KEY, {', '.join(_quote(c) for c in columns)})"
+            if columns else "CREATE TABLE records (record_id TEXT PRIMARY KEY)"
+        )
+        db.execute("CREATE TABLE snapshot_meta (key TEXT PRIMARY KEY, value TEXT)")
+        sql = (
+            f"INSERT OR REPLACE INTO records (record_id{''.join(', ' + _quote(c) for c in columns)}) "
+            f"VALUES ({', '.join('?' * (len(columns) + 1))})"
+        )
+        count = 0
+        batch: list[tuple] = []
+        for row in rows:
+            batch.append((row["record_id"], *(_cell(row.get(c)) for c in columns)))
+            if len(batch) >= BITABLE_PAGE_SIZE:
+                db.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            db.executemany(sql, batch)
+            count += len(batch)
+        meta = {**meta, "record_count": count}
+        db.executemany(
+            "INSERT INTO snapshot_meta (key, value) VALUES (?, ?)",
+            [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()],
+        )
+        db.commit()
+    return count
+
+
+# 飞书字段类型 -> Parquet 列类型：数字、日期（毫秒时间戳）、创建/修改时间、复选框；其它都存文本
+_ARROW_TYPES = {2: "float64", 5: "int64", 1001: "int64", 1002: "int64", 7: "bool_"}
+
+
+def _typed(value: Any, kind: str) -> Any:
+    """把字段值转成 Parquet 列类型对应的 Python 值，转不了的存空值。"""
+    value = _cell(value)
+    if value is None:
+        return None
+    try:
+        if kind == "float64":
+            return float(value)
+        if kind == "int64":
+            return int(value)
+        if kind == "bool_":
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def _write_parquet(
+    path: Path, columns: list[str], types: dict[str, int | None], rows: Iterable[dict], meta: dict[str, Any]
+) -> int:
+    """用 ParquetWriter 每 BITABLE_PAGE_SIZE 条写一个 row group（不把整表留在内存里），返回记录数。"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("导出 Parquet 需要安装 pyarrow（pip install pyarrow），或改用 sqlite 格式") from e
+
+    kinds = [_ARROW_TYPES.get(types.get(c), "string") for c in columns]
+    schema = pa.schema(
+        [pa.field("record_id", pa.string()), *(pa.field(c, getattr(pa, k)()) for c, k in zip(columns, kinds))],
+        # 记录数不放进 meta：读取时用文件自带的 num_rows
+        metadata={"snapshot_meta": json.dumps(meta, ensure_ascii=False)},
+    )
+    rows = iter(rows)
+    count = 0
+    with pq.ParquetWriter(str(path), schema) as writer:
+        while batch := list(islice(rows, BITABLE_PAGE_SIZE)):
+            arrays = [
+                [row["record_id"] for row in batch],
+                *([_typed(row.get(c), k) for row in batch] for c, k in zip(columns, kinds)),
+            ]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            count += len(batch)
+    return count
+
+
+def export_snapshot(
+    app_token: str,
+    table_id: str,
+    field_names: list[str] | None = None,
+    fmt: str | None = None,
+    path: str | Path | None = None,
+) -> dict[str, Any]:
+    """
+    整表扫描一次并导出快照。field_names 为空时导出全部字段（先取一次字段列表，见 _discover_fields()）。
+    返回 {"path", "format", "fields", "records", "seconds"}。
+    """
+    fmt = fmt or BITABLE_SNAPSHOT_FORMAT
+    target = Path(path) if path else snapshot_path(table_id, fmt)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    token = _get_tenant_access_token()
+    client = get_bitable_client()
+    started = time.monotonic()
+
+    # Parquet 要按字段类型建列，指定了 field_names 也要取一次字段类型
+    fields = _discover_fields(client, token, app_token, table_id) if not field_names or fmt == "parquet" else {}
+    columns = list(field_names or fields)
+    meta = {"app_token": app_token, "table_id": table_id, "fields": columns, "exported_at": time.time()}
+    rows = client.scan_records(token, app_token, table_id, columns)
+
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        if fmt == "parquet":
+            count = _write_parquet(tmp, columns, fields, rows, meta)
+        elif fmt == "sqlite":
+            count = _write_sqlite(tmp, columns, rows, meta)
+        else:
+            raise ValueError(f"unknown snapshot format: {fmt}")
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    return {
+        "path": str(target),
+        "format": fmt,
+        "fields": columns,
+        "records": count,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def find_snapshot(table_id: str, fmt: str | None = None) -> tuple[Path, str] | None:
+    """
+    已有的快照文件 (path, format)：指定 fmt 时只找该格式；
+    不指定时两种格式都找，都存在时取最近导出的那个。没有快照时返回 None。
+    """
+    candidates = [(snapshot_path(table_id, f), f) for f in ((fmt,) if fmt else SNAPSHOT_FORMATS)]
+    existing = [(p, f) for p, f in candidates if p.exists()]
+    if not existing:
+        return None
+    return max(existing, key=lambda pf: pf[0].stat().st_mtime)
+
+
+def _locate(table_id: str, fmt: str | None, path: str | Path | None) -> tuple[Path, str] | None:
+    if path:
+        source = Path(path)
+        if not source.exists():
+            return None
+        return source, fmt or ("parquet" if source.suffix == ".parquet" else "sqlite")
+    return find_snapshot(table_id, fmt)
+
+
+def read_snapshot(
+    table_id: str, columns: Iterable[str] | None = None, fmt: str | None = None, path: str | Path | None = None
+):
+    """
+    读取本地快照为 pandas DataFrame（只读 columns 指定的列，record_id 总会带上）。
+    fmt 为空时按已有的快照文件判断格式（见 find_snapshot()）。快照不存在时抛 FileNotFoundError。
+    """
+    import pandas as pd
+
+    found = _locate(table_id, fmt, path)
+    if found is None:
+        where = path or (snapshot_path(table_id, fmt) if fmt else Path(BITABLE_SNAPSHOT_DIR) / f"{table_id}.*")
+        raise FileNotFoundError(f"snapshot not found: {where}")
+    source, fmt = found
+    cols = ["record_id", *[c for c in (columns or []) if c != "record_id"]] if columns else None
+    if fmt == "parquet":
+        return pd.read_parquet(source, columns=cols)
+    with closing(sqlite3.connect(f"file:{source}?mode=ro", uri=True)) as db:
+        select = ", ".join(_quote(c) for c in cols) if cols else "*"
+        return pd.read_sql_query(f"SELECT {select} FROM records", db)
+
+
+def snapshot_info(table_id: str, fmt: str | None = None, path: str | Path | None = None) -> dict[str, Any] | None:
+    """快照的元数据（format / exported_at / record_count / fields ...），fmt 为空时按已有文件判断；没有快照时返回 None。"""
+    found = _locate(table_id, fmt, path)
+    if found is None:
+        return None
+    source, fmt = found
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        metadata = pq.read_metadata(source)
+        meta = json.loads((metadata.schema.to_arrow_schema().metadata or {}).get(b"snapshot_meta") or b"{}")
+        return {**meta, "record_count": metadata.num_rows, "format": fmt}
+    with closing(sqlite3.connect(f"file:{source}?mode=ro", uri=True)) as db:
+        rows = db.execute("SELECT key, value FROM snapshot_meta").fetchall()
+    return {**{k: json.loads(v) for k, v in rows}, "format": fmt}
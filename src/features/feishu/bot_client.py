@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import threading
+import time
+
 import requests
 from dataclasses import dataclass
 from typing import Any
@@ -9,23 +12,47 @@ from src.core.config_manager import get_env
 # The user provided a larksuite.com URL, so we must use the international API base URL
 FEISHU_BASE_URL = "https://open.larksuite.com/open-apis"
 
+# tenant_access_token 在过期前多少秒就提前刷新
+TOKEN_REFRESH_MARGIN = float(get_env("FEISHU_TOKEN_REFRESH_MARGIN") or "300")
+
+_TOKEN_LOCK = threading.Lock()
+_TOKEN_CACHE: dict[str, Any] = {"app_id": "", "token": "", "expires_at": 0.0}
+
 
-def _get_tenant_access_token() -> str:
+def _get_tenant_access_token(rejected: str | None = None) -> str:
+    """
+    取得 tenant_access_token，按返回的 expire 在进程内缓存，过期前 TOKEN_REFRESH_MARGIN 秒刷新。
+    多线程同时需要刷新时只有一个线程去请求，其余线程等待并复用结果。
+    rejected: 被 Lark 判为无效 / 过期的 token；缓存里还是它时重新获取，已被别的线程换掉时直接返回新的。
+    """
     app_id = get_env("FEISHU_APP_ID") or ""
     app_secret = get_env("FEISHU_APP_SECRET") or ""
     if not app_id or not app_secret:
         raise RuntimeError("FEISHU_APP_ID / FEISHU_APP_SECRET 未配置")
 
-    url = f"{FEISHU_BASE_URL}/auth/v3/tenant_access_token/internal"
-    resp = requests.post(url, json={"app_id": app_id, "app_secret": app_secret}, timeout=10)
-    resp.raise_for_status()
-    data: dict[str, Any] = resp.json()
-    if data.get("code") != 0:
-        raise RuntimeError(f"获取 tenant_access_token 失败: {data}")
-    token = data.get("tenant_access_token") or ""
-    if not token:
-        raise RuntimeError("tenant_access_token 为空")
-    return token
+    with _TOKEN_LOCK:
+        cached = _TOKEN_CACHE
+        if (
+            cached["token"]
+            and cached["token"] != rejected
+            and cached["app_id"] == app_id
+            and time.monotonic() < cached["expires_at"] - TOKEN_REFRESH_MARGIN
+        ):
+            return cached["token"]
+
+        url = f"{FEISHU_BASE_URL}/auth/v3/tenant_access_token/internal"
+        resp = requests.post(url, json={"app_id": app_id, "app_secret": app_secret}, timeout=10)
+        resp.raise_for_status()
+        data: dict[str, Any] = resp.json()
+        if data.get("code") != 0:
+            raise RuntimeError(f"获取 tenant_access_token 失败: {data}")
+        token = data.get("tenant_access_token") or ""
+        if not token:
+            raise RuntimeError("tenant_access_token 为空")
+        # expire 为剩余有效秒数（通常 7200）
+        expire = float(data.get("expire") or 0)
+        _TOKEN_CACHE.update(app_id=app_id, token=token, expires_at=time.monotonic() + expire)
+        return token
 
 
 def send_text_to_open_id(open_id: str, text: str) -> None:
@@ -3,11 +3,13 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Any
 
-import requests
-
 from src.core.config_manager import load_yaml_config
 
-from .bot_client import _get_tenant_access_token, FeishuBotClient, FEISHU_BASE_URL
+from .async_client import get_async_lark_client, get_tenant_access_token
+from .bitable_client import _plan_upsert, get_bitable_client
+from .bitable_snapshot import export_snapshot, find_snapshot, read_snapshot, snapshot_info
+from .bot_client import _get_tenant_access_token, FeishuBotClient
+from .write_behind import get_write_behind
 
 
 @dataclass
@@ -19,57 +21,40 @@ class FeishuSheetManager:
         return (cfg.get("feishu") or {}).get("revenue_bitable") or {}
 
     def _search_record_by_sku(self, app_token: str, table_id: str, sku: str) -> str | None:
-        """根据 SKU（商品名）搜索表格中的现有记录，返回记录的 ID_record。如果没有找到则返回 None。"""
+        """
+        根据 SKU（商品名）查找表格中的现有记录，返回记录的 ID_record。如果没有找到则返回 None。
+        先查本地 SKU -> record_id 索引，索引里没有时才调用 records/search。
+        """
         token = _get_tenant_access_token()
-        url = f"{FEISHU_BASE_URL}/bitable/v1/apps/{app_token}/tables/{table_id}/records/search"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json; charset=utf-8",
-        }
-        
+
         # 假设用来匹配的列名叫 "商品名"
         conf = self._get_revenue_bitable_conf()
         sku_field = conf.get("sku_field", "商品名")
-        
-        payload = {
-            "filter": {
-                "conjunction": "and",
-                "conditions": [
-                    {
-                        "field_name": sku_field,
-                        "operator": "is",
-                        "value": [sku]
-                    }
-                ]
-            }
-        }
-        
+
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            if data.get("code") == 0:
-                items = data.get("data", {}).get("items", [])
-                if items:
-                    return items[0].get("record_id")
+            # 走共享客户端：经过全局限流，被限流时按重置时间等待后重试
+            return get_bitable_client().lookup_record_id(token, app_token, table_id, sku_field, sku)
         except Exception as e:
             print(f"搜索飞书记录失败 ({sku}): {e}")
-        
+
         return None
 
-    def upsert_pivot_revenue_record(self, app_token: str | None, table_id: str | None, target_date: Any, data: dict) -> None:
-        """向图表按天更新 SKU 的营业额透视记录（横表逻辑）。"""
+    def _pivot_target(self, app_token: str | None, table_id: str | None) -> tuple[str, str, str]:
+        """返回 (app_token, table_id, sku_field)，未传入时取 config.yaml.feishu.revenue_bitable。"""
         conf = self._get_revenue_bitable_conf()
         app_token = app_token or conf.get("app_token") or ""
         table_id = table_id or conf.get("table_id") or ""
         if not app_token or not table_id:
             raise RuntimeError("未配置 FEISHU_BITABLE_APP_TOKEN / FEISHU_BITABLE_TABLE_ID 或 config.yaml.feishu.revenue_bitable")
-
         # Excel 对应的列名： 商品名 (SKU), 1日, 2日, 3日...
-        sku_field = conf.get("sku_field", "商品名")
+        return app_token, table_id, conf.get("sku_field", "商品名")
+
+    @staticmethod
+    def _pivot_fields(sku_field: str, target_date: Any, data: dict) -> dict | None:
+        """一个 SKU 当天要写入的字段；没有 SKU 时返回 None。"""
         sku_val = data.get("sku", "")
         if not sku_val:
-            return
+            return None
 
         # 获取日期代表的"天"
         day_number = target_date.day
@@ -78,54 +63,112 @@ class FeishuSheetManager:
         revenue_val = data.get("revenue", 0.0)
 
         # 接下来要组成我们要更新或插入的字段
-        fields = {
+        return {
             sku_field: sku_val,
             day_field: revenue_val,
         }
 
+    def upsert_pivot_revenue_record(self, app_token: str | None, table_id: str | None, target_date: Any, data: dict) -> None:
+        """向图表按天更新 SKU 的营业额透视记录（横表逻辑）。多个 SKU 请用 upsert_pivot_revenue_records。"""
+        app_token, table_id, sku_field = self._pivot_target(app_token, table_id)
+        fields = self._pivot_fields(sku_field, target_date, data)
+        if fields is None:
+            return
+        sku_val = data.get("sku", "")
+
         # 搜索这行 SKU 是否已经存在
         token = _get_tenant_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json; charset=utf-8",
-        }
-        
+        client = get_bitable_client()
+
         existing_record_id = self._search_record_by_sku(app_token, table_id, sku_val)
-        
-        if existing_record_id:
-            # 存在 -> Update
-            url = f"{FEISHU_BASE_URL}/bitable/v1/apps/{app_token}/tables/{table_id}/records/{existing_record_id}"
-            payload = {"fields": fields}
-            resp = requests.put(url, headers=headers, json=payload, timeout=10)
-        else:
-            # 不存在 -> Create (会在底部新建一个商品)
-            url = f"{FEISHU_BASE_URL}/bitable/v1/apps/{app_token}/tables/{table_id}/records"
-            payload = {"fields": fields}
-            resp = requests.post(url, headers=headers, json=payload, timeout=10)
-
-        resp.raise_for_status()
-        resp_data = resp.json()
-        if resp_data.get("code") != 0:
-            raise RuntimeError(f"更新飞书多维表格(透视表)失败: {resp_data}")
+
+        write_behind = get_write_behind()
+        if write_behind is not None:
+            # 交给后台写入队列：同一 SKU 的写入合并，按表批量写回
+            write_behind.put_record(app_token, table_id, fields, record_id=existing_record_id, key_field=sku_field)
+            return
+
+        try:
+            if existing_record_id:
+                # 存在 -> Update
+                client.batch_update_records(token, app_token, table_id, [{"record_id": existing_record_id, "fields": fields}])
+            else:
+                # 不存在 -> Create (会在底部新建一个商品)
+                client.batch_create_records(token, app_token, table_id, [{"fields": fields}], key_field=sku_field)
+        except RuntimeError as e:
+            raise RuntimeError(f"更新飞书多维表格(透视表)失败: {e}") from e
+
+    def _pivot_rows(self, sku_field: str, target_date: Any, data_list: list[dict]) -> list[dict]:
+        rows = [self._pivot_fields(sku_field, target_date, data) for data in data_list]
+        return [r for r in rows if r is not None]
+
+    @staticmethod
+    def _queue_pivot_rows(
+        write_behind, app_token: str, table_id: str, sku_field: str, index: dict, cached: bool, rows: list[dict]
+    ) -> dict:
+        updates, creates = _plan_upsert(index, sku_field, rows)
+        for u in updates:
+            write_behind.put_record(app_token, table_id, u["fields"], record_id=u["record_id"])
+        for c in creates:
+            write_behind.put_record(app_token, table_id, c["fields"], key_field=sku_field)
+        return {
+            "indexed": len(index),
+            "index_cached": int(cached),
+            "updated": len(updates),
+            "created": len(creates),
+            "queued": len(updates) + len(creates),
+        }
+
+    def upsert_pivot_revenue_records(
+        self, app_token: str | None, table_id: str | None, target_date: Any, data_list: list[dict]
+    ) -> dict[str, int]:
+        """
+        批量更新多个 SKU 当天的营业额：取得 SKU -> record_id（本地索引或整表扫描一次），
+        再按 500 条一批 batch_update / batch_create。记录数没变时直接用本地索引，不再整表扫描。
+        返回 {"indexed", "index_cached", "updated", "created", "write_requests"}。
+        """
+        app_token, table_id, sku_field = self._pivot_target(app_token, table_id)
+        rows = self._pivot_rows(sku_field, target_date, data_list)
+        token = _get_tenant_access_token()
+        client = get_bitable_client()
+        try:
+            write_behind = get_write_behind()
+            if write_behind is not None:
+                index, cached = client.load_index(token, app_token, table_id, sku_field)
+                return self._queue_pivot_rows(write_behind, app_token, table_id, sku_field, index, cached, rows)
+            return client.bulk_upsert(token, app_token, table_id, sku_field, rows)
+        except RuntimeError as e:
+            raise RuntimeError(f"更新飞书多维表格(透视表)失败: {e}") from e
+
+    async def upsert_pivot_revenue_records_async(
+        self, app_token: str | None, table_id: str | None, target_date: Any, data_list: list[dict]
+    ) -> dict[str, int]:
+        """upsert_pivot_revenue_records 的 asyncio 版本，供 async 接口调用，不阻塞事件循环。"""
+        app_token, table_id, sku_field = self._pivot_target(app_token, table_id)
+        rows = self._pivot_rows(sku_field, target_date, data_list)
+        token = await get_tenant_access_token()
+        client = get_async_lark_client()
+        try:
+            write_behind = get_write_behind()
+            if write_behind is not None:
+                index, cached = await client.load_index(token, app_token, table_id, sku_field)
+                return self._queue_pivot_rows(write_behind, app_token, table_id, sku_field, index, cached, rows)
+            return await client.bulk_upsert(token, app_token, table_id, sku_field, rows)
+        except RuntimeError as e:
+            raise RuntimeError(f"更新飞书多维表格(透视表)失败: {e}") from e
 
     def list_table_fields(self, app_token: str, table_id: str) -> list[str]:
         """通过获取一条记录的字段来推断表格的所有列名（使用 base:record:retrieve 权限）。"""
         token = _get_tenant_access_token()
         print(f"  ✅ token 获取成功: {token[:20]}...")
         # 获取最多 1 条记录，从字段 key 里推断列名
-        url = f"{FEISHU_BASE_URL}/bitable/v1/apps/{app_token}/tables/{table_id}/records"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json; charset=utf-8",
-        }
-        params = {"page_size": 1}
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        print(f"  HTTP 状态码: {resp.status_code}")
-        if not resp.ok:
-            print(f"  响应内容: {resp.text[:500]}")
-            resp.raise_for_status()
-
-        data = resp.json()
+        path = f"bitable/v1/apps/{app_token}/tables/{table_id}/records"
+        try:
+            data = get_bitable_client().call("GET", path, token, "bitable_list", params={"page_size": 1}, timeout=10)
+        except RuntimeError as e:
+            print(f"  响应内容: {str(e)[:500]}")
+            raise
+
         items = data.get("data", {}).get("items", [])
         if not items:
             print("  ⚠️ 表格暂无数据，无法推断列名。请先手动添加至少一行数据。")
@@ -138,3 +181,24 @@ class FeishuSheetManager:
             print(f"  - {name}")
         return field_names
 
+    def export_pivot_snapshot(
+        self, app_token: str | None = None, table_id: str | None = None, fmt: str | None = None
+    ) -> dict[str, Any]:
+        """把营业额横表整表导出为本地快照（SQLite / Parquet），看板读本地副本。"""
+        app_token, table_id, _ = self._pivot_target(app_token, table_id)
+        return export_snapshot(app_token, table_id, fmt=fmt)
+
+    def read_pivot_snapshot(self, columns: list[str] | None = None, refresh: bool = False, fmt: str | None = None):
+        """
+        读取营业额横表的本地快照（pandas DataFrame）。fmt 为空时读已有的快照，不管是哪种格式；
+        还没有快照或 refresh=True 时先导出一次（格式为 fmt，为空时用 LARK_BITABLE_SNAPSHOT_FORMAT）。
+        """
+        app_token, table_id, _ = self._pivot_target(None, None)
+        if refresh or find_snapshot(table_id, fmt) is None:
+            export_snapshot(app_token, table_id, fmt=fmt)
+        return read_snapshot(table_id, columns=columns, fmt=fmt)
+
+    def pivot_snapshot_info(self, fmt: str | None = None) -> dict[str, Any] | None:
+        """营业额横表本地快照的元数据（format / exported_at / record_count / fields），没有快照时返回 None。"""
+        _, table_id, _ = self._pivot_target(None, None)
+        return snapshot_info(table_id, fmt=fmt)
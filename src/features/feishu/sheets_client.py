@@ -0,0 +1,544 @@
+"""
+飞书（Lark）开放平台的 HTTP 客户端，供电子表格相关的模块共用。
+- LarkHttpClient:   长连接 Session（带连接池）+ 统一的重试退避 + 按接口统计耗时
+- LarkSheetsClient: 电子表格接口（sheets/query、values_batch_get、values_batch_update、values_append）
+- SpreadsheetMetaCache: 按 spreadsheet_token 缓存 sheet 标题 -> sheet_id 和表头行，带 TTL
+所有调用共用一个进程内实例（get_sheets_client()），每次往返都复用已建立的 TLS 连接。
+所有请求先经过 get_lark_throttle() 的跨进程令牌桶（按应用 QPS 限流）；遇到 HTTP 429 或
+频控错误码时按服务端返回的重置时间暂停所有进程的请求。
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.core.config_manager import get_env, get_project_path
+from src.core.rate_limiter import SharedTokenBucket
+
+from .bot_client import _get_tenant_access_token
+
+LARK_HOST = (get_env("LARK_HOST") or "https://open.larksuite.com").rstrip("/")
+LARK_RETRY = int(get_env("LARK_RETRY") or "3")
+LARK_RETRY_BASE_SLEEP = float(get_env("LARK_RETRY_BASE_SLEEP") or "1.5")
+# 连接池大小：并发写入 / 读取时同时保持的连接数
+LARK_POOL_SIZE = int(get_env("LARK_POOL_SIZE") or "8")
+# 表格元数据（sheet 列表、表头行）的缓存秒数，0 表示不缓存
+LARK_META_TTL_SECONDS = float(get_env("LARK_META_TTL_SECONDS") or "300")
+# 每秒请求数上限（同一应用的所有进程共用），0 表示不限流
+LARK_QPS = float(get_env("LARK_QPS") or "20")
+LARK_BURST = int(get_env("LARK_BURST") or "0") or max(int(LARK_QPS), 1)
+# 跨进程共享的令牌桶状态
+LARK_THROTTLE_PATH = get_env("LARK_THROTTLE_PATH") or str(get_project_path("data", "lark_throttle.sqlite"))
+# 被限流但服务端没给重置时间时，暂停的秒数
+LARK_RATE_LIMIT_WAIT = float(get_env("LARK_RATE_LIMIT_WAIT") or "1")
+# 频控错误码（HTTP 429 之外，有的接口以 200 + code 返回）
+RATE_LIMIT_CODES = {99991400}
+# tenant_access_token 无效 / 已过期（如应用凭证被重置）
+TOKEN_INVALID_CODES = {99991663, 99991668}
+# sheetId 不存在（sheet 被删除 / 重建）时 Lark 返回的错误码
+SHEET_NOT_FOUND_CODES = {90215}
+
+JST = timezone(timedelta(hours=9))
+
+
+def _today_header_text() -> str:
+    now = datetime.now(JST)
+    return f"{now.month}月{now.day}日"
+
+
+def _num_to_col(n: int) -> str:
+    s = ""
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        s = chr(r + ord("A")) + s
+    return s
+
+
+def _cell_runs(cells: dict[tuple[str, int], Any], max_cells: int) -> list[tuple[str, int, list]]:
+    """(列, 行) -> 值 按列、行排序后把连续的行合并为 (列, 起始行, 值列表)，单段不超过 max_cells。"""
+    runs: list[tuple[str, int, list]] = []
+    for col, row in sorted(cells, key=lambda k: (len(k[0]), k[0], k[1])):
+        value = cells[(col, row)]
+        if runs:
+            last_col, start, values = runs[-1]
+            if last_col == col and start + len(values) == row and len(values) < max_cells:
+                values.append(value)
+                continue
+        runs.append((col, row, [value]))
+    return runs
+
+
+def _locate_today_col(row: list) -> tuple[str, list | None]:
+    """
+    在表头行中找今天的列。返回 (列名, None)；没有时返回 (新列名, 新表头行)，
+    新列为最后一个非空表头之后的一列，调用方负责把今天的表头写进去。
+    """
+    today = _today_header_text()
+    last = 0
+    for i, v in enumerate(row):
+        sv = str(v).strip() if v is not None else ""
+        if sv:
+            last = i + 1
+        if sv == today:
+            return _num_to_col(i + 1), None
+    return _num_to_col(last + 1), list(row[:last]) + [None] * (last - len(row)) + [today]
+
+
+class LarkApiError(RuntimeError):
+    """
+    Lark 返回 code != 0（或 HTTP 状态异常）时抛出，code 为 Lark 的错误码（拿不到时为 None），
+    status 为 HTTP 状态码。被限流时 retry_after 为服务端要求等待的秒数。
+    """
+
+    def __init__(
+        self, message: str, code: int | None = None, retry_after: float | None = None, status: int | None = None
+    ):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+        self.status = status
+
+
+def maybe_applied(error: Exception) -> bool:
+    """
+    请求失败后，服务端是否可能已经执行了它：超时 / 连接中断 / 5xx 都说不准，
+    Lark 明确返回的错误（4xx、code != 0、被限流）说明请求没有生效。
+    """
+    if isinstance(error, LarkApiError):
+        return (error.status or 0) >= 500
+    return True
+
+
+def _reset_hint(headers) -> float:
+    """从限流响应头中取得重置秒数（x-ogw-ratelimit-reset / Retry-After），没有则用默认值。"""
+    for key in ("x-ogw-ratelimit-reset", "Retry-After"):
+        try:
+            value = float(headers.get(key) or 0)
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            return value
+    return LARK_RATE_LIMIT_WAIT
+
+
+_THROTTLE: SharedTokenBucket | None = None
+_THROTTLE_LOCK = threading.Lock()
+
+
+def get_lark_throttle() -> SharedTokenBucket | None:
+    """进程内共享、跨进程协调的 Lark 令牌桶；LARK_QPS=0 时返回 None（不限流）。"""
+    global _THROTTLE
+    if LARK_QPS <= 0:
+        return None
+    with _THROTTLE_LOCK:
+        if _THROTTLE is None:
+            _THROTTLE = SharedTokenBucket(LARK_THROTTLE_PATH, "lark", LARK_QPS, LARK_BURST)
+        return _THROTTLE
+
+
+class SpreadsheetMetaCache:
+    """
+    spreadsheet_token -> {"sheets": {标题: sheet_id}, "headers": {(sheet_id, 行号): [表头]}}。
+    超过 ttl 秒的条目视为过期；发现 sheet 不存在时整个表格的条目作废，下次重新读取。
+    另外记住见过的 sheet_id -> 标题（不过期），sheet 被删除重建后据此按标题找到新的 sheet_id，
+    旧 id -> 新 id 记在 moved 里，调用方手里的旧 id 之后直接换成新的。
+    """
+
+    def __init__(self, ttl: float = LARK_META_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sheets: dict[str, tuple[float, dict[str, str]]] = {}
+        self._headers: dict[tuple[str, str, int], tuple[float, list]] = {}
+        self._titles: dict[tuple[str, str], str] = {}
+        self._moved: dict[tuple[str, str], str] = {}
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return self.ttl > 0 and time.monotonic() - loaded_at < self.ttl
+
+    def get_sheets(self, spreadsheet_token: str) -> dict[str, str] | None:
+        with self._lock:
+            entry = self._sheets.get(spreadsheet_token)
+            hit = entry is not None and self._fresh(entry[0])
+            self._stats["hits" if hit else "misses"] += 1
+            return dict(entry[1]) if hit else None
+
+    def put_sheets(self, spreadsheet_token: str, sheets: dict[str, str]) -> None:
+        with self._lock:
+            self._sheets[spreadsheet_token] = (time.monotonic(), dict(sheets))
+            for title, sheet_id in sheets.items():
+                self._titles[(spreadsheet_token, sheet_id)] = title
+
+    def title_of(self, spreadsheet_token: str, sheet_id: str) -> str | None:
+        with self._lock:
+            return self._titles.get((spreadsheet_token, sheet_id))
+
+    def put_moved(self, spreadsheet_token: str, old_id: str, new_id: str) -> None:
+        with self._lock:
+            self._moved[(spreadsheet_token, old_id)] = new_id
+
+    def current_range(self, spreadsheet_token: str, rng: str) -> str:
+        """"sheet_id!A1:B2" 中的 sheet_id 已被重建时换成新的 id。"""
+        sheet_id, sep, rest = rng.partition("!")
+        with self._lock:
+            sheet_id = self._moved.get((spreadsheet_token, sheet_id), sheet_id)
+        return f"{sheet_id}{sep}{rest}"
+
+    def get_header(self, spreadsheet_token: str, sheet_id: str, row: int) -> list | None:
+        with self._lock:
+            entry = self._headers.get((spreadsheet_token, sheet_id, row))
+            hit = entry is not None and self._fresh(entry[0])
+            self._stats["hits" if hit else "misses"] += 1
+            return list(entry[1]) if hit else None
+
+    def put_header(self, spreadsheet_token: str, sheet_id: str, row: int, values: list) -> None:
+        with self._lock:
+            self._headers[(spreadsheet_token, sheet_id, row)] = (time.monotonic(), list(values))
+
+    def invalidate(self, spreadsheet_token: str) -> None:
+        with self._lock:
+            self._sheets.pop(spreadsheet_token, None)
+            for key in [k for k in self._headers if k[0] == spreadsheet_token]:
+                del self._headers[key]
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+class _LarkClientBase:
+    """同步 / 异步客户端共用的部分：请求头、限流记账、重试间隔、响应检查和耗时统计。"""
+
+    def __init__(self, host: str, max_retry: int, base_sleep: float):
+        self.host = host.rstrip("/")
+        self.max_retry = max(int(max_retry), 1)
+        self.base_sleep = base_sleep
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, float]] = {}
+        self.throttle = get_lark_throttle()
+
+    def _url(self, path: str) -> str:
+        return f"{self.host}/open-apis/{path.lstrip('/')}"
+
+    @staticmethod
+    def _headers(token: str) -> dict:
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json; charset=utf-8",
+        }
+
+    def _entry(self, name: str) -> dict[str, float]:
+        return self._stats.setdefault(name, {
+            "calls": 0, "errors": 0, "retries": 0, "rate_limited": 0,
+            "total_ms": 0.0, "max_ms": 0.0, "throttle_ms": 0.0,
+        })
+
+    def _throttle_reserve(self, name: str) -> float:
+        """在共享令牌桶里预约一个令牌，返回需要等待的秒数（由调用方 sleep）。"""
+        if self.throttle is None:
+            return 0.0
+        wait = self.throttle.reserve()
+        if wait > 0:
+            with self._lock:
+                self._entry(name)["throttle_ms"] += wait * 1000
+        return wait
+
+    def _rate_limited(self, name: str) -> None:
+        with self._lock:
+            self._entry(name)["rate_limited"] += 1
+
+    def _penalize(self, error: Exception) -> None:
+        """被限流时按服务端的重置时间暂停共享令牌桶（所有进程一起等待）。"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None and self.throttle is not None:
+            self.throttle.penalize(retry_after)
+
+    def _count(self, name: str, elapsed: float, error: bool = False, retry: bool = False) -> None:
+        with self._lock:
+            s = self._entry(name)
+            if retry:
+                s["retries"] += 1
+                return
+            s["calls"] += 1
+            s["errors"] += int(error)
+            s["total_ms"] += elapsed * 1000
+            s["max_ms"] = max(s["max_ms"], elapsed * 1000)
+
+    @staticmethod
+    def _retryable(error: Exception, idempotent: bool = True) -> bool:
+        """
+        sheet 不存在是确定的错误，重试也不会成功。
+        非幂等的请求（如 values_append）只在被限流或服务端明确返回 5xx 时重试：
+        超时等情况下请求可能已经生效，再发一次会重复写入。
+        """
+        if isinstance(error, LarkApiError):
+            if error.code in SHEET_NOT_FOUND_CODES:
+                return False
+            if error.retry_after is not None or (error.status or 0) >= 500:
+                return True
+        return idempotent
+
+    def _retry_delay(self, name: str, attempt: int, error: Exception) -> float:
+        """第 attempt 次失败后到下一次重试前要等待的秒数。"""
+        self._count(name, 0.0, retry=True)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            # 被限流：共享令牌桶已按重置时间暂停，下一次预约令牌时会等够；不限流时直接等待
+            print(f"[WARN] rate limited {attempt}/{self.max_retry} [{name}] reset={retry_after:.1f}s")
+            return 0.0 if self.throttle is not None else retry_after
+        t = self.base_sleep * (1.6 ** (attempt - 1)) + random.uniform(0, 0.8)
+        print(f"[WARN] retry {attempt}/{self.max_retry} error={error} sleep={t:.1f}s")
+        return t
+
+    def _check(self, name: str, status: int, body: Callable[[], Any], headers, elapsed: float, text: str = "") -> dict:
+        """检查响应：HTTP 状态非 200 或 code != 0 时记账并抛出 LarkApiError，否则返回 JSON。"""
+        if status != 200:
+            self._count(name, elapsed, error=True)
+            try:
+                j = body()
+            except Exception:
+                j = text
+            code = j.get("code") if isinstance(j, dict) else None
+            retry_after = None
+            if status == 429 or code in RATE_LIMIT_CODES:
+                retry_after = _reset_hint(headers)
+                self._rate_limited(name)
+            raise LarkApiError(f"[LARK][{name}] status={status} body={j}", code, retry_after, status)
+        data = body()
+        if data.get("code") != 0:
+            self._count(name, elapsed, error=True)
+            retry_after = None
+            if data.get("code") in RATE_LIMIT_CODES:
+                retry_after = _reset_hint(headers)
+                self._rate_limited(name)
+            raise LarkApiError(f"[LARK][{name}] {data}", data.get("code"), retry_after, status)
+        self._count(name, elapsed)
+        return data
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """按接口统计：调用次数、失败 / 重试 / 被限流次数、平均 / 最大耗时、等待令牌的总耗时（毫秒）。"""
+        with self._lock:
+            out = {}
+            for name, s in self._stats.items():
+                out[name] = {
+                    **{k: v for k, v in s.items() if k != "total_ms"},
+                    "avg_ms": round(s["total_ms"] / s["calls"], 1) if s["calls"] else 0.0,
+                    "max_ms": round(s["max_ms"], 1),
+                    "throttle_ms": round(s["throttle_ms"], 1),
+                }
+            return out
+
+
+class LarkHttpClient(_LarkClientBase):
+    def __init__(
+        self,
+        host: str = LARK_HOST,
+        pool_size: int = LARK_POOL_SIZE,
+        max_retry: int = LARK_RETRY,
+        base_sleep: float = LARK_RETRY_BASE_SLEEP,
+    ):
+        super().__init__(host, max_retry, base_sleep)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def with_retry(self, fn: Callable[[], Any], name: str = "request", idempotent: bool = True) -> Any:
+        last_err = None
+        for attempt in range(1, self.max_retry + 1):
+            try:
+                return fn()
+            except Exception as e:
+                last_err = e
+                self._penalize(e)
+                if attempt == self.max_retry or not self._retryable(e, idempotent):
+                    break
+                t = self._retry_delay(name, attempt, e)
+                if t > 0:
+                    time.sleep(t)
+        raise last_err
+
+    def call(
+        self,
+        method: str,
+        path: str,
+        token: str,
+        name: str,
+        params: dict | None = None,
+        json: dict | None = None,
+        timeout: float = 30,
+        idempotent: bool = True,
+    ) -> dict:
+        """
+        调用 /open-apis/{path}，HTTP 状态非 200 或返回 code != 0 时抛出 LarkApiError（会按配置重试）。
+        name 用于错误信息和耗时统计，如 "batch_get"。token 被判为无效时刷新一次 token 再发。
+        idempotent=False 的请求不在结果不明（超时、连接中断）时重试，见 _retryable()。
+        """
+        url = self._url(path)
+        auth = {"token": token, "refreshed": False}
+
+        def _send():
+            wait = self._throttle_reserve(name)
+            if wait > 0:
+                time.sleep(wait)
+            started = time.monotonic()
+            try:
+                r = self.session.request(
+                    method, url, headers=self._headers(auth["token"]), params=params, json=json, timeout=timeout
+                )
+            except requests.RequestException:
+                self._count(name, time.monotonic() - started, error=True)
+                raise
+            return self._check(name, r.status_code, r.json, r.headers, time.monotonic() - started, r.text)
+
+        def _call():
+            try:
+                return _send()
+            except LarkApiError as e:
+                if e.code not in TOKEN_INVALID_CODES or auth["refreshed"]:
+                    raise
+                auth["refreshed"] = True
+                # token 在本地过期前就失效了：换一个新的再发一次
+                print(f"[WARN] tenant_access_token rejected [{name}], refreshing: code={e.code}")
+                auth["token"] = _get_tenant_access_token(rejected=auth["token"])
+                return _send()
+
+        return self.with_retry(_call, name, idempotent)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class LarkSheetsClient(LarkHttpClient):
+    def __init__(self, *args, meta_ttl: float = LARK_META_TTL_SECONDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.meta = SpreadsheetMetaCache(meta_ttl)
+
+    def _sheet_call(self, token: str, spreadsheet_token: str, ranges: list[str], send: Callable[[list[str]], dict]) -> dict:
+        """
+        send(ranges) 发出请求。sheet 不存在（被删除 / 重建）时作废该表格的元数据缓存，
+        按标题重新解析一次 sheet_id，换成新 id 再发一次；找不到同名 sheet 时抛出原错误。
+        """
+        ranges = [self.meta.current_range(spreadsheet_token, r) for r in ranges]
+        try:
+            return send(ranges)
+        except LarkApiError as e:
+            if e.code not in SHEET_NOT_FOUND_CODES:
+                raise
+            self.meta.invalidate(spreadsheet_token)
+            if not self._relocate_sheets(token, spreadsheet_token, ranges):
+                raise
+        return send([self.meta.current_range(spreadsheet_token, r) for r in ranges])
+
+    def _relocate_sheets(self, token: str, spreadsheet_token: str, ranges: list[str]) -> bool:
+        """按标题找到 ranges 里各 sheet 的新 sheet_id，有任何一个变了时返回 True。"""
+        titles = {sid: self.meta.title_of(spreadsheet_token, sid) for sid in {r.partition("!")[0] for r in ranges}}
+        if not any(titles.values()):
+            return False
+        current = {s.get("title"): s.get("sheet_id") for s in self.list_sheets(token, spreadsheet_token)}
+        moved = False
+        for sid, title in titles.items():
+            new_id = current.get(title) if title else None
+            if new_id and new_id != sid:
+                print(f"[WARN] sheet '{title}' was recreated: {sid} -> {new_id}")
+                self.meta.put_moved(spreadsheet_token, sid, new_id)
+                moved = True
+        return moved
+
+    def list_sheets(self, token: str, spreadsheet_token: str) -> list[dict]:
+        data = self.call(
+            "GET", f"sheets/v3/spreadsheets/{spreadsheet_token}/sheets/query", token, "list_sheets", timeout=20
+        )
+        sheets = data.get("data", {}).get("sheets", [])
+        self.meta.put_sheets(spreadsheet_token, {s.get("title"): s.get("sheet_id") for s in sheets})
+        return sheets
+
+    def resolve_sheet_id(self, token: str, spreadsheet_token: str, title: str) -> str:
+        """优先用缓存；缓存里没有该标题时重新读取一次 sheet 列表（可能是新建的 sheet）。"""
+        cached = self.meta.get_sheets(spreadsheet_token)
+        if cached and title in cached:
+            return cached[title]
+        sheets = self.list_sheets(token, spreadsheet_token)
+        for s in sheets:
+            if s.get("title") == title:
+                return s.get("sheet_id")
+        titles = [x.get("title") for x in sheets]
+        raise RuntimeError(f"[LARK] sheet title not found: '{title}'. existing titles={titles}")
+
+    def batch_get(self, token: str, spreadsheet_token: str, ranges: list[str]) -> dict:
+        return self._sheet_call(token, spreadsheet_token, ranges, lambda rs: self.call(
+            "GET", f"sheets/v2/spreadsheets/{spreadsheet_token}/values_batch_get", token, "batch_get",
+            params={"ranges": rs},
+        ))
+
+    def batch_update(self, token: str, spreadsheet_token: str, updates: list[dict]) -> dict:
+        return self._sheet_call(token, spreadsheet_token, [u["range"] for u in updates], lambda rs: self.call(
+            "POST", f"sheets/v2/spreadsheets/{spreadsheet_token}/values_batch_update", token, "batch_update",
+            json={"valueInputOption": "RAW", "valueRanges": [{**u, "range": r} for u, r in zip(updates, rs)]},
+        ))
+
+    def values_append(self, token: str, spreadsheet_token: str, rng: str, values: list[list]) -> dict:
+        """追加到 range 所在数据区域的末尾（由服务端定位空行，耗时与表格大小无关）。"""
+        return self._sheet_call(token, spreadsheet_token, [rng], lambda rs: self.call(
+            "POST", f"sheets/v2/spreadsheets/{spreadsheet_token}/values_append", token, "values_append",
+            json={"valueRange": {"range": rs[0], "values": values}}, idempotent=False,
+        ))
+
+    def appended_end_row(self, token: str, spreadsheet_token: str, sheet_id: str, rows: list[list]) -> int | None:
+        """
+        values_append 结果不明（超时 / 5xx）时确认这些行是否已经写入：
+        A 列末尾几行与 rows 的第一列（行 id）一致时返回最后一行的行号，否则返回 None。
+        """
+        data = self.batch_get(token, spreadsheet_token, [f"{sheet_id}!A:A"])
+        vr = data.get("data", {}).get("valueRanges", [])
+        col = [str(r[0]) if r and r[0] is not None else "" for r in ((vr[0].get("values") if vr else None) or [])]
+        while col and col[-1] == "":
+            col.pop()
+        ids = [str(r[0]) for r in rows]
+        if ids and col[-len(ids):] == ids:
+            return len(col)
+        return None
+
+    def header_row(self, token: str, spreadsheet_token: str, sheet_id: str, header_row: int = 1) -> list:
+        """读取表头行（A:ZZ）的原始值，TTL 内复用缓存。"""
+        cached = self.meta.get_header(spreadsheet_token, sheet_id, header_row)
+        if cached is not None:
+            return cached
+        rng = f"{sheet_id}!A{header_row}:ZZ{header_row}"
+        data = self.batch_get(token, spreadsheet_token, [rng])
+        vr = data.get("data", {}).get("valueRanges", [])
+        row = ((vr[0].get("values") if vr else None) or [[]])[0] or []
+        self.meta.put_header(spreadsheet_token, sheet_id, header_row, row)
+        return list(row)
+
+    def ensure_today_col(self, token: str, spreadsheet_token: str, sheet_id: str, header_row: int = 1) -> str:
+        """返回表头为今天（如 3月13日）的列；没有则在最后一个非空表头之后新建。"""
+        col, new_row = _locate_today_col(self.header_row(token, spreadsheet_token, sheet_id, header_row))
+        if new_row is None:
+            return col
+        self.batch_update(token, spreadsheet_token, [{
+            "range": f"{sheet_id}!{col}{header_row}:{col}{header_row}",
+            "values": [[new_row[-1]]],
+        }])
+        self.meta.put_header(spreadsheet_token, sheet_id, header_row, new_row)
+        return col
+
+
+_CLIENT: LarkSheetsClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_sheets_client() -> LarkSheetsClient:
+    """进程内共享的电子表格客户端。"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = LarkSheetsClient()
+        return _CLIENT
@@ -0,0 +1,357 @@
+"""
+飞书写入的后台合并队列（write-behind），默认关闭，LARK_WRITE_BEHIND=1 时启用。
+各个任务（排名同步、关键词追踪、乐天透视表）把写入交给这里，由后台线程定时统一写回：
+- 单元格：同一单元格以最后一次为准，同一表格的所有 sheet 合并成尽量少的 values_batch_update
+- 追加行：按行 id 去重，同一 sheet 的行合并成尽量少的 values_append
+- 多维表格记录：同一记录的字段合并（每个字段以最后一次为准），按表分批 batch_update / batch_create
+待写内容先落到本地 SQLite（默认 data/lark_spool.sqlite），进程重启后会继续写回；
+FastAPI 的 lifespan 和进程退出时（atexit）都会在停止前写回一次。
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from src.core.config_manager import get_env, get_project_path
+
+from .bitable_client import BITABLE_BATCH_SIZE, _created_index, _field_text, get_bitable_client
+from .bot_client import _get_tenant_access_token
+from .sheets_client import _cell_runs, get_sheets_client, maybe_applied
+
+WRITE_BEHIND_ENABLED = (get_env("LARK_WRITE_BEHIND") or "0") == "1"
+WRITE_BEHIND_PATH = get_env("LARK_WRITE_BEHIND_PATH") or str(get_project_path("data", "lark_spool.sqlite"))
+# 后台线程每隔多少秒写回一次
+WRITE_BEHIND_INTERVAL = float(get_env("LARK_WRITE_BEHIND_INTERVAL") or "5")
+# 单次请求的上限：单元格数 / 追加行数（多维表格记录数见 bitable_client.BITABLE_BATCH_SIZE）
+WRITE_BEHIND_MAX_CELLS = int(get_env("LARK_UPDATE_MAX_CELLS") or "5000")
+WRITE_BEHIND_APPEND_ROWS = int(get_env("LARK_APPEND_CHUNK_ROWS") or "500")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mutations (
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (kind, target, scope, key)
+);
+"""
+
+_CELL_KEY = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+def _create_key_field(rkey: str) -> str | None | bool:
+    """
+    record 行的 key：record_id 表示更新（返回 False）；"new:" 开头表示新建，
+    返回去重用的 key_field（'new:["商品名", "SKU1"]'），没有时返回 None。
+    """
+    if not rkey.startswith("new:"):
+        return False
+    try:
+        key_field, _ = json.loads(rkey[4:])
+        return key_field
+    except (ValueError, TypeError):
+        return None
+
+
+class LarkWriteBehind:
+    """
+    mutations 表的一行是一个待写操作，主键 (kind, target, scope, key)：
+    - cell:   (spreadsheet_token, sheet_id, "G12")            value = 单元格的值
+    - append: (spreadsheet_token, "sheet_id!A:I", 行 id)      value = 整行
+    - record: (app_token, table_id, record_id 或 "new:"+[key_field, 键])  value = 字段
+    seq 在每次写入时递增，写回成功后只删除 seq 没变的行，写回期间的新写入不会丢。
+    """
+
+    def __init__(
+        self,
+        path: str | Path = WRITE_BEHIND_PATH,
+        interval: float = WRITE_BEHIND_INTERVAL,
+        max_cells: int = WRITE_BEHIND_MAX_CELLS,
+        append_rows: int = WRITE_BEHIND_APPEND_ROWS,
+        record_batch: int = BITABLE_BATCH_SIZE,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.max_cells = max(int(max_cells), 1)
+        self.append_rows = max(int(append_rows), 1)
+        self.record_batch = max(int(record_batch), 1)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._seq = time.time_ns()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats = {"queued": 0, "cells": 0, "rows": 0, "records": 0, "requests": 0, "failures": 0}
+
+    # -----------------------------------------------------------------------
+    # 写入队列
+    # -----------------------------------------------------------------------
+    def _next_seq(self) -> int:
+        self._seq = max(self._seq + 1, time.time_ns())
+        return self._seq
+
+    def _put(self, items: list[tuple[str, str, str, str, Any]]) -> int:
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO mutations (kind, target, scope, key, value, seq) VALUES (?, ?, ?, ?, ?, ?)",
+                [(k, t, sc, key, json.dumps(v, ensure_ascii=False), self._next_seq()) for k, t, sc, key, v in items],
+            )
+            self._db.commit()
+            self._stats["queued"] += len(items)
+        return len(items)
+
+    def put_cells(self, spreadsheet_token: str, sheet_id: str, cells: dict[tuple[str, int], Any]) -> int:
+        """(列, 行) -> 值；同一单元格以最后一次为准。"""
+        return self._put([("cell", spreadsheet_token, sheet_id, f"{col}{row}", v) for (col, row), v in cells.items()])
+
+    def put_rows(self, spreadsheet_token: str, sheet_id: str, last_col: str, rows: list[list]) -> int:
+        """追加到 sheet 末尾的行，以第一列为行 id 去重（同一 id 以最后一次为准）。"""
+        scope = f"{sheet_id}!A:{last_col}"
+        return self._put([("append", spreadsheet_token, scope, str(r[0]), r) for r in rows])
+
+    def put_record(
+        self, app_token: str, table_id: str, fields: dict, record_id: str | None = None, key_field: str | None = None
+    ) -> None:
+        """
+        更新（有 record_id）或新建多维表格记录；同一记录的多次写入按字段合并。
+        新建时按 fields[key_field]（如 SKU）去重，写回后新记录的 record_id 记入本地索引；
+        不填 key_field 则每次都新建一条。
+        """
+        if record_id:
+            rkey = record_id
+        elif key_field:
+            rkey = "new:" + json.dumps([key_field, _field_text(fields.get(key_field))], ensure_ascii=False)
+        else:
+            rkey = f"new:{self._next_seq()}"
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM mutations WHERE kind = 'record' AND target = ? AND scope = ? AND key = ?",
+                (app_token, table_id, rkey),
+            ).fetchone()
+            merged = {**(json.loads(row[0]) if row else {}), **fields}
+            self._db.execute(
+                "INSERT OR REPLACE INTO mutations (kind, target, scope, key, value, seq) VALUES ('record', ?, ?, ?, ?, ?)",
+                (app_token, table_id, rkey, json.dumps(merged, ensure_ascii=False), self._next_seq()),
+            )
+            self._db.commit()
+            self._stats["queued"] += 1
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM mutations").fetchone()[0]
+
+    # -----------------------------------------------------------------------
+    # 写回
+    # -----------------------------------------------------------------------
+    def _done(self, kind: str, target: str, scope: str, rows: list[tuple[str, int]]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM mutations WHERE kind = ? AND target = ? AND scope = ? AND key = ? AND seq = ?",
+                [(kind, target, scope, key, seq) for key, seq in rows],
+            )
+            self._db.commit()
+
+    def _done_created(
+        self, app_token: str, table_id: str, rows: list[tuple[str, int]], record_ids: dict[str, str]
+    ) -> None:
+        """
+        新建写回成功后的收尾：删除 seq 没变的行；写回期间同一个键又有新写入（seq 变了）时，
+        把这行改挂到新记录的 record_id 上，下次作为更新写回，而不是再新建一条。
+        record_ids: 键 -> 新记录的 record_id（batch_create 的返回）。
+        """
+        with self._lock:
+            for rkey, seq in rows:
+                self._db.execute(
+                    "DELETE FROM mutations WHERE kind = 'record' AND target = ? AND scope = ? AND key = ? AND seq = ?",
+                    (app_token, table_id, rkey, seq),
+                )
+                row = self._db.execute(
+                    "SELECT value FROM mutations WHERE kind = 'record' AND target = ? AND scope = ? AND key = ?",
+                    (app_token, table_id, rkey),
+                ).fetchone()
+                record_id = record_ids.get(json.loads(rkey[4:])[1]) if row else None
+                if not record_id:
+                    continue
+                existing = self._db.execute(
+                    "SELECT value FROM mutations WHERE kind = 'record' AND target = ? AND scope = ? AND key = ?",
+                    (app_token, table_id, record_id),
+                ).fetchone()
+                merged = {**(json.loads(existing[0]) if existing else {}), **json.loads(row[0])}
+                self._db.execute(
+                    "INSERT OR REPLACE INTO mutations (kind, target, scope, key, value, seq) VALUES ('record', ?, ?, ?, ?, ?)",
+                    (app_token, table_id, record_id, json.dumps(merged, ensure_ascii=False), self._next_seq()),
+                )
+                self._db.execute(
+                    "DELETE FROM mutations WHERE kind = 'record' AND target = ? AND scope = ? AND key = ?",
+                    (app_token, table_id, rkey),
+                )
+            self._db.commit()
+
+    def _flush_cells(self, token: str, spreadsheet_token: str, entries: dict[str, list]) -> None:
+        """同一表格的所有 sheet 一起合并成 range，按 max_cells 分块。"""
+        runs = []
+        for sheet_id, items in entries.items():
+            cells, seqs = {}, {}
+            for key, value, seq in items:
+                m = _CELL_KEY.match(key)
+                cells[(m.group(1), int(m.group(2)))] = value
+                seqs[(m.group(1), int(m.group(2)))] = (key, seq)
+            runs += [(sheet_id, col, start, values, seqs) for col, start, values in _cell_runs(cells, self.max_cells)]
+
+        chunks: list[list] = [[]]
+        chunk_cells = 0
+        for run in runs:
+            if chunks[-1] and chunk_cells + len(run[3]) > self.max_cells:
+                chunks.append([])
+                chunk_cells = 0
+            chunks[-1].append(run)
+            chunk_cells += len(run[3])
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+            get_sheets_client().batch_update(token, spreadsheet_token, [
+                {"range": f"{sid}!{col}{start}:{col}{start + len(vals) - 1}", "values": [[v] for v in vals]}
+                for sid, col, start, vals, _ in chunk
+            ])
+            for sid, col, start, vals, seqs in chunk:
+                self._done("cell", spreadsheet_token, sid, [seqs[(col, r)] for r in range(start, start + len(vals))])
+            self._stats["cells"] += sum(len(run[3]) for run in chunk)
+            self._stats["requests"] += 1
+
+    def _flush_rows(self, token: str, spreadsheet_token: str, scope: str, items: list) -> None:
+        client = get_sheets_client()
+        for i in range(0, len(items), self.append_rows):
+            chunk = items[i:i + self.append_rows]
+            rows = [value for _, value, _ in chunk]
+            try:
+                client.values_append(token, spreadsheet_token, scope, rows)
+            except Exception as e:
+                # 结果不明（超时等）时这批行可能已经写入，按行 id 确认后再决定是否留到下次重写
+                sheet_id = scope.partition("!")[0]
+                if not maybe_applied(e) or not client.appended_end_row(token, spreadsheet_token, sheet_id, rows):
+                    raise
+                print(f"[WARN] values_append failed but rows already landed in {scope}: {e}")
+            self._done("append", spreadsheet_token, scope, [(key, seq) for key, _, seq in chunk])
+            self._stats["rows"] += len(chunk)
+            self._stats["requests"] += 1
+
+    def _flush_records(self, token: str, app_token: str, table_id: str, items: list) -> None:
+        """
+        更新按 record_id 分批；新建按 key_field 分组分批，新记录的 键 -> record_id 写入本地索引，
+        写回期间同一个键的新写入改为更新这条新记录（见 _done_created()）。
+        """
+        client = get_bitable_client()
+        groups: dict[tuple[str, str | None], list] = {}
+        for item in items:
+            key_field = _create_key_field(item[0])
+            groups.setdefault(("update", None) if key_field is False else ("create", key_field), []).append(item)
+        for (op, key_field), group in groups.items():
+            for i in range(0, len(group), self.record_batch):
+                chunk = group[i:i + self.record_batch]
+                if op == "update":
+                    client.batch_update_records(
+                        token, app_token, table_id, [{"record_id": key, "fields": fields} for key, fields, _ in chunk]
+                    )
+                    self._done("record", app_token, table_id, [(key, seq) for key, _, seq in chunk])
+                else:
+                    requested = [{"fields": fields} for _, fields, _ in chunk]
+                    created = client.batch_create_records(token, app_token, table_id, requested, key_field=key_field)
+                    if key_field:
+                        record_ids = _created_index(requested, created, key_field)
+                        self._done_created(app_token, table_id, [(key, seq) for key, _, seq in chunk], record_ids)
+                    else:
+                        self._done("record", app_token, table_id, [(key, seq) for key, _, seq in chunk])
+                self._stats["records"] += len(chunk)
+                self._stats["requests"] += 1
+
+    def flush(self) -> dict[str, int]:
+        """把队列中的全部写入写回飞书；某一组失败时保留在队列里，下次再写。返回累计统计。"""
+        with self._flush_lock:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT kind, target, scope, key, value, seq FROM mutations ORDER BY seq"
+                ).fetchall()
+            if not rows:
+                return self.stats()
+
+            groups: dict[tuple[str, str], dict[str, list]] = {}
+            for kind, target, scope, key, value, seq in rows:
+                groups.setdefault((kind, target), {}).setdefault(scope, []).append((key, json.loads(value), seq))
+
+            token = _get_tenant_access_token()
+            for (kind, target), scopes in groups.items():
+                try:
+                    if kind == "cell":
+                        self._flush_cells(token, target, scopes)
+                    elif kind == "append":
+                        for scope, items in scopes.items():
+                            self._flush_rows(token, target, scope, items)
+                    elif kind == "record":
+                        for scope, items in scopes.items():
+                            self._flush_records(token, target, scope, items)
+                except Exception as e:
+                    self._stats["failures"] += 1
+                    print(f"[WARN] write-behind flush failed kind={kind} target={target}: {e}")
+            return self.stats()
+
+    # -----------------------------------------------------------------------
+    # 后台线程
+    # -----------------------------------------------------------------------
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARN] write-behind flush failed: {e}")
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="lark-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush: bool = True) -> dict[str, int]:
+        """停止后台线程，默认在停止前把队列写回一次。可重复调用。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARN] write-behind final flush failed, {self.pending()} writes kept in {self.path}: {e}")
+        return self.stats()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_WRITE_BEHIND: LarkWriteBehind | None = None
+_WRITE_BEHIND_LOCK = threading.Lock()
+
+
+def get_write_behind() -> LarkWriteBehind | None:
+    """进程内共享的写入队列，首次调用时启动后台线程；LARK_WRITE_BEHIND 未开启时返回 None（各任务直接写入）。"""
+    global _WRITE_BEHIND
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    with _WRITE_BEHIND_LOCK:
+        if _WRITE_BEHIND is None:
+            _WRITE_BEHIND = LarkWriteBehind()
+            _WRITE_BEHIND.start()
+            atexit.register(_WRITE_BEHIND.stop)
+        return _WRITE_BEHIND
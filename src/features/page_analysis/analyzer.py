@@ -7,7 +7,12 @@ from dataclasses import dataclass, field
 from typing import Optional
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+
+from src.core.html_parser import make_soup
+
+# strainer 后端只构建分析需要的标签
+SEO_STRAINER = SoupStrainer(["title", "meta", "h1"])
 
 
 @dataclass
@@ -44,8 +49,9 @@ class PageAnalysisResult:
 class PageAnalyzer:
     """页面分析：请求 URL，解析 HTML，提取 SEO 与结构信息。"""
 
-    def __init__(self, timeout: int = 15, headers: Optional[dict] = None):
+    def __init__(self, timeout: int = 15, headers: Optional[dict] = None, parser_backend: Optional[str] = None):
         self.timeout = timeout
+        self.parser_backend = parser_backend
         self.headers = headers or {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         }
@@ -61,7 +67,7 @@ class PageAnalyzer:
             )
             result.status_code = resp.status_code
             resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
+            soup = make_soup(resp.text, self.parser_backend, parse_only=SEO_STRAINER)
 
             # title
             tag = soup.find("title")